@@ -0,0 +1,91 @@
+"""Schéma initial (tables jusqu'ici créées par create_all)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _existing_tables() -> set[str]:
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade():
+    # Les bases déjà en production ont été créées par create_all : on ne
+    # crée que ce qui manque.
+    existing = _existing_tables()
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("email", sa.String(255), nullable=False),
+            sa.Column("username", sa.String(100), nullable=False),
+            sa.Column("hashed_password", sa.String(255), nullable=False),
+            sa.Column("role", sa.Enum("user", "admin", name="userrole"), nullable=False),
+            sa.Column("is_active", sa.Boolean),
+            sa.Column("daily_quota", sa.Integer),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    if "usage_logs" not in existing:
+        op.create_table(
+            "usage_logs",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("action", sa.String(50), nullable=False),
+            sa.Column("tokens_used", sa.Integer),
+            sa.Column("log_date", sa.Date),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("extra", sa.Text),
+        )
+        op.create_index("ix_usage_logs_id", "usage_logs", ["id"])
+
+    if "generation_cache" not in existing:
+        op.create_table(
+            "generation_cache",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("cache_key", sa.String(64), nullable=False),
+            sa.Column("action", sa.String(50), nullable=False),
+            sa.Column("payload", sa.Text, nullable=False),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("expires_at", sa.DateTime, nullable=False),
+            sa.Column("last_used_at", sa.DateTime),
+        )
+        op.create_index("ix_generation_cache_id", "generation_cache", ["id"])
+        op.create_index("ix_generation_cache_cache_key", "generation_cache", ["cache_key"])
+        op.create_index("ix_generation_cache_last_used_at", "generation_cache", ["last_used_at"])
+
+    if "exercise_pool" not in existing:
+        op.create_table(
+            "exercise_pool",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("action", sa.String(50), nullable=False),
+            sa.Column("theme", sa.String(255), nullable=False),
+            sa.Column("level", sa.String(20), nullable=False),
+            sa.Column("payload", sa.Text, nullable=False),
+            sa.Column("tokens_used", sa.Integer),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_exercise_pool_id", "exercise_pool", ["id"])
+        op.create_index(
+            "ix_exercise_pool_bucket", "exercise_pool", ["action", "theme", "level", "id"]
+        )
+
+
+def downgrade():
+    op.drop_table("exercise_pool")
+    op.drop_table("generation_cache")
+    op.drop_table("usage_logs")
+    op.drop_table("users")
+    sa.Enum(name="userrole").drop(op.get_bind(), checkfirst=True)
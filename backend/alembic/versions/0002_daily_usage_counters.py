@@ -0,0 +1,61 @@
+"""Compteurs journaliers d'usage + index composite sur usage_logs
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# Figé ici : la migration ne doit pas dépendre du code applicatif
+QUOTA_ACTIONS = (
+    "writing_generate", "fill_generate",
+    "reading_generate", "flashcards_generate",
+    "writing_correct",
+)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    if "daily_usage_counters" not in inspector.get_table_names():
+        op.create_table(
+            "daily_usage_counters",
+            sa.Column(
+                "user_id", sa.Integer,
+                sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True,
+            ),
+            sa.Column("day", sa.Date, primary_key=True),
+            sa.Column("count", sa.Integer, nullable=False, server_default="0"),
+            sa.Column("tokens", sa.Integer, nullable=False, server_default="0"),
+        )
+
+    indexes = {ix["name"] for ix in inspector.get_indexes("usage_logs")}
+    if "ix_usage_logs_user_date_action" not in indexes:
+        op.create_index(
+            "ix_usage_logs_user_date_action", "usage_logs", ["user_id", "log_date", "action"]
+        )
+
+    # Backfill : les compteurs sont entièrement dérivés des logs existants
+    actions = ", ".join(f"'{a}'" for a in QUOTA_ACTIONS)
+    op.execute("DELETE FROM daily_usage_counters")
+    op.execute(f"""
+        INSERT INTO daily_usage_counters (user_id, day, count, tokens)
+        SELECT user_id,
+               log_date,
+               SUM(CASE WHEN action IN ({actions}) THEN 1 ELSE 0 END),
+               COALESCE(SUM(tokens_used), 0)
+        FROM usage_logs
+        WHERE log_date IS NOT NULL
+        GROUP BY user_id, log_date
+    """)
+
+
+def downgrade():
+    op.drop_index("ix_usage_logs_user_date_action", table_name="usage_logs")
+    op.drop_table("daily_usage_counters")
@@ -0,0 +1,26 @@
+"""Version de token par utilisateur (claim "ver" des JWT)
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("users")}
+    if "token_version" not in columns:
+        op.add_column(
+            "users",
+            sa.Column("token_version", sa.Integer, nullable=False, server_default="0"),
+        )
+
+
+def downgrade():
+    op.drop_column("users", "token_version")
@@ -0,0 +1,23 @@
+"""Index (created_at, id) sur users pour la pagination admin
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    indexes = {ix["name"] for ix in sa.inspect(op.get_bind()).get_indexes("users")}
+    if "ix_users_created_at_id" not in indexes:
+        op.create_index("ix_users_created_at_id", "users", ["created_at", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_users_created_at_id", table_name="users")
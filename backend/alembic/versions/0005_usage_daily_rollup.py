@@ -0,0 +1,46 @@
+"""Rollups journaliers d'usage pour le dashboard admin
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    if "usage_daily_rollup" not in inspector.get_table_names():
+        op.create_table(
+            "usage_daily_rollup",
+            sa.Column("day", sa.Date, primary_key=True),
+            sa.Column("action", sa.String(50), primary_key=True),
+            sa.Column("calls", sa.Integer, nullable=False, server_default="0"),
+            sa.Column("tokens", sa.Integer, nullable=False, server_default="0"),
+            sa.Column("distinct_users", sa.Integer, nullable=False, server_default="0"),
+        )
+
+    indexes = {ix["name"] for ix in inspector.get_indexes("usage_logs")}
+    if "ix_usage_logs_log_date" not in indexes:
+        op.create_index("ix_usage_logs_log_date", "usage_logs", ["log_date"])
+
+    # Backfill complet depuis l'historique
+    op.execute("DELETE FROM usage_daily_rollup")
+    op.execute("""
+        INSERT INTO usage_daily_rollup (day, action, calls, tokens, distinct_users)
+        SELECT log_date, action, COUNT(id), COALESCE(SUM(tokens_used), 0), COUNT(DISTINCT user_id)
+        FROM usage_logs
+        WHERE log_date IS NOT NULL
+        GROUP BY log_date, action
+    """)
+
+
+def downgrade():
+    op.drop_index("ix_usage_logs_log_date", table_name="usage_logs")
+    op.drop_table("usage_daily_rollup")
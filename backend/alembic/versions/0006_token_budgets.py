@@ -0,0 +1,80 @@
+"""Budgets de tokens : surcharges par utilisateur, compteurs mensuels et globaux
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    columns = {c["name"] for c in inspector.get_columns("users")}
+    for name in ("daily_token_budget", "monthly_token_budget"):
+        if name not in columns:
+            op.add_column("users", sa.Column(name, sa.Integer, nullable=True))
+
+    tables = inspector.get_table_names()
+    if "monthly_usage_counters" not in tables:
+        op.create_table(
+            "monthly_usage_counters",
+            sa.Column(
+                "user_id", sa.Integer,
+                sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True,
+            ),
+            sa.Column("month", sa.Date, primary_key=True),
+            sa.Column("tokens", sa.BigInteger, nullable=False, server_default="0"),
+        )
+    if "global_usage_counters" not in tables:
+        op.create_table(
+            "global_usage_counters",
+            sa.Column("granularity", sa.String(5), primary_key=True),
+            sa.Column("period_start", sa.Date, primary_key=True),
+            sa.Column("tokens", sa.BigInteger, nullable=False, server_default="0"),
+        )
+
+    # Backfill depuis les compteurs journaliers (tokens déjà journalisés)
+    bind = op.get_bind()
+    rows = bind.execute(sa.text(
+        "SELECT user_id, day, tokens FROM daily_usage_counters WHERE tokens > 0"
+    )).all()
+    monthly: dict[tuple, int] = {}
+    daily_total: dict = {}
+    monthly_total: dict = {}
+    for user_id, day, tokens in rows:
+        if isinstance(day, str):   # SQLite via sa.text : dates en texte ISO
+            day = date.fromisoformat(day)
+        month = day.replace(day=1)
+        monthly[(user_id, month)] = monthly.get((user_id, month), 0) + tokens
+        daily_total[day] = daily_total.get(day, 0) + tokens
+        monthly_total[month] = monthly_total.get(month, 0) + tokens
+    bind.execute(sa.text("DELETE FROM monthly_usage_counters"))
+    bind.execute(sa.text("DELETE FROM global_usage_counters"))
+    if monthly:
+        bind.execute(
+            sa.text("INSERT INTO monthly_usage_counters (user_id, month, tokens) VALUES (:u, :m, :t)"),
+            [{"u": u, "m": m, "t": t} for (u, m), t in monthly.items()],
+        )
+    totals = [{"g": "day", "p": d, "t": t} for d, t in daily_total.items()]
+    totals += [{"g": "month", "p": m, "t": t} for m, t in monthly_total.items()]
+    if totals:
+        bind.execute(
+            sa.text("INSERT INTO global_usage_counters (granularity, period_start, tokens) VALUES (:g, :p, :t)"),
+            totals,
+        )
+
+
+def downgrade():
+    op.drop_table("global_usage_counters")
+    op.drop_table("monthly_usage_counters")
+    op.drop_column("users", "monthly_token_budget")
+    op.drop_column("users", "daily_token_budget")
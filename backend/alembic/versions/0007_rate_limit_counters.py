@@ -0,0 +1,27 @@
+"""Compteurs de limitation de débit (backend partagé RATE_LIMIT_BACKEND=db)
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "rate_limit_counters" not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            "rate_limit_counters",
+            sa.Column("key", sa.String(255), primary_key=True),
+            sa.Column("window_start", sa.BigInteger, primary_key=True),
+            sa.Column("count", sa.Integer, nullable=False, server_default="0"),
+        )
+
+
+def downgrade():
+    op.drop_table("rate_limit_counters")
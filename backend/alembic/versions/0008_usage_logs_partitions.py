@@ -0,0 +1,120 @@
+"""usage_logs partitionnée par mois (Postgres) + index (user_id, created_at DESC)
+
+Sur Postgres, la table est recréée en PARTITION BY RANGE (created_at) : une
+partition par mois présent dans les données jusqu'à deux mois après le mois
+courant, plus une partition par défaut. La clé primaire devient (id,
+created_at) (la clé de partition doit en faire partie) ; la séquence des id
+est conservée. Sur SQLite, la table reste telle quelle et reçoit seulement
+l'index.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 2
+
+
+def _add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _is_partitioned(bind) -> bool:
+    return bind.execute(sa.text(
+        "SELECT relkind FROM pg_class WHERE relname = 'usage_logs'"
+    )).scalar() == "p"
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        op.create_index("ix_usage_logs_user_created", "usage_logs", ["user_id", sa.text("created_at DESC")])
+        return
+    if _is_partitioned(bind):
+        return
+
+    op.execute("UPDATE usage_logs SET created_at = COALESCE(log_date::timestamp, now()) WHERE created_at IS NULL")
+    op.execute("ALTER TABLE usage_logs RENAME TO usage_logs_unpartitioned")
+    op.execute("ALTER TABLE usage_logs_unpartitioned RENAME CONSTRAINT usage_logs_pkey TO usage_logs_unpartitioned_pkey")
+    for index in ("ix_usage_logs_id", "ix_usage_logs_user_date_action", "ix_usage_logs_log_date"):
+        op.execute(f"DROP INDEX IF EXISTS {index}")
+    op.execute("ALTER SEQUENCE usage_logs_id_seq OWNED BY NONE")
+    op.execute("""
+        CREATE TABLE usage_logs (
+            id          INTEGER NOT NULL DEFAULT nextval('usage_logs_id_seq'),
+            user_id     INTEGER NOT NULL REFERENCES users (id),
+            action      VARCHAR(50) NOT NULL,
+            tokens_used INTEGER,
+            log_date    DATE,
+            created_at  TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            extra       TEXT,
+            CONSTRAINT usage_logs_pkey PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+
+    oldest = bind.execute(sa.text("SELECT min(created_at) FROM usage_logs_unpartitioned")).scalar()
+    current = date.today().replace(day=1)
+    month = oldest.date().replace(day=1) if oldest else current
+    while month <= _add_months(current, MONTHS_AHEAD):
+        op.execute(
+            f"CREATE TABLE usage_logs_{month:%Y_%m} PARTITION OF usage_logs "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+        month = _add_months(month, 1)
+    op.execute("CREATE TABLE usage_logs_default PARTITION OF usage_logs DEFAULT")
+
+    op.execute("""
+        INSERT INTO usage_logs (id, user_id, action, tokens_used, log_date, created_at, extra)
+        SELECT id, user_id, action, tokens_used, log_date, created_at, extra FROM usage_logs_unpartitioned
+    """)
+    op.execute("DROP TABLE usage_logs_unpartitioned")
+    op.execute("ALTER SEQUENCE usage_logs_id_seq OWNED BY usage_logs.id")
+
+    # Index sur la table parente : créés sur chaque partition, présente et future
+    op.create_index("ix_usage_logs_id", "usage_logs", ["id"])
+    op.create_index("ix_usage_logs_user_date_action", "usage_logs", ["user_id", "log_date", "action"])
+    op.create_index("ix_usage_logs_log_date", "usage_logs", ["log_date"])
+    op.create_index("ix_usage_logs_user_created", "usage_logs", ["user_id", sa.text("created_at DESC")])
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql" or not _is_partitioned(bind):
+        op.drop_index("ix_usage_logs_user_created", table_name="usage_logs")
+        return
+
+    op.execute("ALTER SEQUENCE usage_logs_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE usage_logs RENAME TO usage_logs_partitioned")
+    op.execute("ALTER TABLE usage_logs_partitioned RENAME CONSTRAINT usage_logs_pkey TO usage_logs_partitioned_pkey")
+    for index in ("ix_usage_logs_id", "ix_usage_logs_user_date_action", "ix_usage_logs_log_date", "ix_usage_logs_user_created"):
+        op.execute(f"DROP INDEX IF EXISTS {index}")
+    op.execute("""
+        CREATE TABLE usage_logs (
+            id          INTEGER NOT NULL DEFAULT nextval('usage_logs_id_seq') PRIMARY KEY,
+            user_id     INTEGER NOT NULL REFERENCES users (id),
+            action      VARCHAR(50) NOT NULL,
+            tokens_used INTEGER,
+            log_date    DATE,
+            created_at  TIMESTAMP WITHOUT TIME ZONE,
+            extra       TEXT
+        )
+    """)
+    op.execute("""
+        INSERT INTO usage_logs (id, user_id, action, tokens_used, log_date, created_at, extra)
+        SELECT id, user_id, action, tokens_used, log_date, created_at, extra FROM usage_logs_partitioned
+    """)
+    op.execute("DROP TABLE usage_logs_partitioned CASCADE")
+    op.execute("ALTER SEQUENCE usage_logs_id_seq OWNED BY usage_logs.id")
+    op.create_index("ix_usage_logs_id", "usage_logs", ["id"])
+    op.create_index("ix_usage_logs_user_date_action", "usage_logs", ["user_id", "log_date", "action"])
+    op.create_index("ix_usage_logs_log_date", "usage_logs", ["log_date"])
@@ -0,0 +1,47 @@
+"""Compteurs globaux de tokens répartis sur plusieurs lignes (shards)
+
+Chaque génération incrémentait la même ligne globale du jour et du mois :
+toutes les réservations se sérialisaient sur son verrou. La clé devient
+(granularity, period_start, shard) ; l'app écrit dans le shard
+user_id % GLOBAL_COUNTER_SHARDS et somme les shards à la lecture. Les
+totaux existants deviennent le shard 0.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def _rebuild(with_shard: bool) -> None:
+    columns = [
+        sa.Column("granularity", sa.String(5), primary_key=True),
+        sa.Column("period_start", sa.Date, primary_key=True),
+    ]
+    if with_shard:
+        columns.append(sa.Column("shard", sa.Integer, primary_key=True, server_default="0"))
+    columns.append(sa.Column("tokens", sa.BigInteger, nullable=False, server_default="0"))
+    op.create_table("global_usage_counters_new", *columns)
+    op.execute(
+        "INSERT INTO global_usage_counters_new (granularity, period_start, tokens) "
+        "SELECT granularity, period_start, SUM(tokens) FROM global_usage_counters "
+        "GROUP BY granularity, period_start"
+    )
+    op.drop_table("global_usage_counters")
+    op.rename_table("global_usage_counters_new", "global_usage_counters")
+
+
+def upgrade():
+    columns = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("global_usage_counters")}
+    if "shard" not in columns:
+        _rebuild(with_shard=True)
+
+
+def downgrade():
+    _rebuild(with_shard=False)
@@ -1,27 +1,70 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .config import get_settings
 from .database import get_db
+from .metrics import BCRYPT_TIME, db_stage
 from .models import User
-from .schemas import TokenData
+from .schemas import TokenData, AuthUser
+from .user_cache import user_cache
 
 settings = get_settings()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+# bcrypt coûte ~100-250 ms de CPU : exécuté hors de la boucle, dans un pool borné
+_bcrypt_executor = ThreadPoolExecutor(
+    max_workers=settings.bcrypt_max_workers, thread_name_prefix="bcrypt"
+)
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+
+# passlib/bcrypt et jose/cryptography sont importés au premier usage (ou par
+# le préchauffage du lifespan, voir startup.py) : hors du chemin d'import de l'app
+
+@lru_cache()
+def pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def warm_up_auth() -> None:
+    """Charge passlib, le backend bcrypt et jose (appelé dans un thread au démarrage)."""
+    import jose.jwt  # noqa: F401
+    pwd_context().hash("warm-up")
+
+
+def hash_password(password: str, rounds: int | None = None) -> str:
+    """Hache au coût par défaut, ou à `rounds` (mots de passe générés, voir roster.py)."""
+    if rounds:
+        return pwd_context().handler().using(rounds=rounds).hash(password)
+    return pwd_context().hash(password)
+
+
+def needs_rehash(hashed: str) -> bool:
+    """Hash d'un coût inférieur au coût par défaut (à refaire à la prochaine connexion)."""
+    handler = pwd_context().handler()
+    return handler.from_string(hashed).rounds < handler.default_rounds
 
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+    return pwd_context().verify(plain, hashed)
+
+
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    with BCRYPT_TIME.time(op="hash"):
+        return await loop.run_in_executor(_bcrypt_executor, hash_password, password)
+
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    loop = asyncio.get_running_loop()
+    with BCRYPT_TIME.time(op="verify"):
+        return await loop.run_in_executor(_bcrypt_executor, verify_password, plain, hashed)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -30,32 +73,44 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expires_delta or timedelta(minutes=settings.access_token_expire_minutes)
     )
     to_encode.update({"exp": expire})
+    from jose import jwt
     return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
 
 
 def decode_token(token: str) -> TokenData:
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         user_id: int = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Token invalide")
-        return TokenData(user_id=int(user_id))
+        # Tokens émis avant l'introduction du claim "ver" : version 0
+        return TokenData(user_id=int(user_id), version=int(payload.get("ver", 0)))
     except JWTError:
         raise HTTPException(status_code=401, detail="Token invalide ou expiré")
 
 
-def get_current_user(
+async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
-) -> User:
+    db: AsyncSession = Depends(get_db),
+) -> AuthUser:
     token_data = decode_token(token)
-    user = db.query(User).filter(User.id == token_data.user_id).first()
+    user = user_cache.get(token_data.user_id)
+    # Entrée plus ancienne que le token (ex. reconnexion après révocation) : on relit
+    if user is None or user.token_version != token_data.version:
+        with db_stage("auth"):
+            row = await db.get(User, token_data.user_id)
+        user = AuthUser.model_validate(row) if row else None
+        if user:
+            user_cache.put(user)
     if not user or not user.is_active:
         raise HTTPException(status_code=401, detail="Utilisateur introuvable ou désactivé")
+    if user.token_version != token_data.version:
+        raise HTTPException(status_code=401, detail="Session révoquée, reconnecte-toi")
     return user
 
 
-def require_admin(current_user: User = Depends(get_current_user)) -> User:
+async def require_admin(current_user: AuthUser = Depends(get_current_user)) -> AuthUser:
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Accès réservé aux admins")
     return current_user
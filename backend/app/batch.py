@@ -0,0 +1,228 @@
+"""
+Génération groupée (POST /api/generate/batch).
+
+Les créneaux de quota (et les tokens estimés) de tous les exercices sont
+réservés en une seule transaction.
+Chaque exercice passe d'abord par le pool puis le cache ; les restants sont
+regroupés par type en paquets (un seul appel Gemini pour plusieurs thèmes ou
+niveaux, voir prompts.packed_exercises) et les appels partent en parallèle,
+avec au plus `batch_fanout` appels simultanés. Les exercices qu'une réponse
+groupée ne contient pas (tronquée, invalide) sont rejoués un par un ; les
+tokens de l'appel groupé restent facturés (répartis entre les exercices du
+paquet livrés). Les créneaux des exercices en échec sont rendus ensemble à la fin.
+"""
+import asyncio
+import json
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import pool, prompts
+from .cache import cache_key, generate_cached, response_cache
+from .claude_service import UpstreamUnavailable, call_claude, estimate_tokens
+from .structured import parse_json, parse_response, response_schema, validate
+from .config import get_settings
+from .model_router import model_router
+from .quota import QuotaReservation, charge_tokens, release_all, reserve_quota_batch
+from .schemas import AuthUser, BatchItem
+
+# Type d'exercice du lot → action (UsageLog, cache, pool)
+BATCH_ACTIONS = {
+    "writing": "writing_generate",
+    "fill_blanks": "fill_generate",
+    "reading": "reading_generate",
+    "flashcards": "flashcards_generate",
+}
+
+
+class _Work:
+    def __init__(self, index: int, item: BatchItem, reservation: QuotaReservation):
+        self.index = index
+        self.item = item
+        self.action = BATCH_ACTIONS[item.type]
+        self.reservation = reservation
+        self.result = None
+        self.tokens = 0
+        self.meta: dict = {}
+        self.error: HTTPException | None = None
+
+    def out(self) -> dict:
+        out = {
+            "index": self.index,
+            "type": self.item.type,
+            "theme": self.item.theme,
+            "level": self.item.level,
+            "ok": self.error is None,
+        }
+        if self.error is None:
+            out["result"] = self.result
+        else:
+            out["status"] = self.error.status_code
+            out["error"] = str(self.error.detail)
+        return out
+
+
+def _pack(pending: list[_Work]) -> list[list[_Work]]:
+    """Paquets d'un même type, bornés en nombre et en tokens de sortie."""
+    settings = get_settings()
+    groups: list[list[_Work]] = []
+    by_action: dict[str, list[_Work]] = {}
+    for work in pending:
+        by_action.setdefault(work.action, []).append(work)
+    for works in by_action.values():
+        group: list[_Work] = []
+        budget = 0
+        for work in works:
+            max_tokens = prompts.build_exercise(work.action, work.item.theme, work.item.level)[2]
+            if group and (
+                len(group) >= settings.batch_pack_size
+                or budget + max_tokens > settings.batch_max_output_tokens
+            ):
+                groups.append(group)
+                group, budget = [], 0
+            group.append(work)
+            budget += max_tokens
+        if group:
+            groups.append(group)
+    return groups
+
+
+class _BatchRun:
+    def __init__(self):
+        self.slots = asyncio.Semaphore(get_settings().batch_fanout)
+        self.upstream_calls = 0
+        self.unbilled_tokens = 0   # appels groupés dont aucun exercice n'a été livré
+
+    async def single(self, work: _Work) -> None:
+        system, user, max_tokens = prompts.build_exercise(
+            work.action, work.item.theme, work.item.level
+        )
+        try:
+            async with self.slots:
+                # Items identiques d'un même lot : un exercice chacun, pas de coalescence
+                work.result, work.tokens, cache, model = await generate_cached(
+                    work.action, system, user, max_tokens, coalesce=False
+                )
+        except HTTPException as exc:
+            if not isinstance(exc, UpstreamUnavailable):
+                self.upstream_calls += 1
+            work.error = exc
+            return
+        if cache in ("miss", "bypass"):
+            self.upstream_calls += 1
+        work.meta["cache"] = cache
+        if model:
+            work.meta["model"] = model
+
+    async def packed(self, group: list[_Work]) -> None:
+        if len(group) == 1:
+            return await self.single(group[0])
+        action = group[0].action
+        system, user, max_tokens = prompts.packed_exercises(
+            action, [(w.item.theme, w.item.level) for w in group]
+        )
+        results: list = []
+        tokens = 0
+        try:
+            async with self.slots:
+                self.upstream_calls += 1
+                text, tokens, served_by = await call_claude(
+                    system, user, max_tokens, action=action,
+                    schema=response_schema(action, len(group)),
+                )
+            results = parse_json(text, action)
+        except HTTPException:
+            pass
+        if not isinstance(results, list):
+            results = []
+
+        served: list[_Work] = []
+        for work, result in zip(group, results):
+            try:
+                work.result = validate(action, result)
+            except HTTPException:
+                continue
+            served.append(work)
+        # Exercices absents ou invalides (réponse tronquée…) : rejoués un par un
+        missing = [w for w in group if w not in served]
+        if missing:
+            await asyncio.gather(*(self.single(w) for w in missing))
+
+        # Tokens de l'appel groupé : aux exercices servis, sinon à ceux rejoués avec succès
+        billed = served or [w for w in missing if w.error is None]
+        if not billed:
+            self.unbilled_tokens += tokens
+        share, extra = divmod(tokens, max(1, len(billed)))
+        for i, work in enumerate(billed):
+            work.tokens += share + (extra if i == 0 else 0)
+
+        cached = response_cache.enabled_for(action)
+        model = model_router.model_for(action)
+        for work in served:
+            result = work.result
+            work.meta.update(
+                cache="miss" if cached else "bypass", packed=len(group), model=served_by
+            )
+            if cached:
+                s, u, m = prompts.build_exercise(action, work.item.theme, work.item.level)
+                await response_cache.put(
+                    action, cache_key(s, u, model, m), json.dumps(result, ensure_ascii=False)
+                )
+
+
+async def _from_pool_or_cache(work: _Work) -> bool:
+    settings = get_settings()
+    item = work.item
+    if settings.pool_enabled and work.action in settings.pool_actions_list:
+        pooled = await pool.take(work.action, item.theme, item.level)
+        if pooled is not None:
+            work.result, work.tokens = pooled
+            work.meta["pool"] = "hit"
+            return True
+        work.meta["pool"] = "miss"
+    if response_cache.enabled_for(work.action):
+        system, user, max_tokens = prompts.build_exercise(work.action, item.theme, item.level)
+        key = cache_key(system, user, model_router.model_for(work.action), max_tokens)
+        cached = await response_cache.get(work.action, key)
+        if cached is not None:
+            work.result = parse_response(work.action, cached)
+            work.meta["cache"] = "hit"
+            return True
+    return False
+
+
+async def generate_batch(db: AsyncSession, user: AuthUser, items: list[BatchItem]) -> dict:
+    settings = get_settings()
+    if len(items) > settings.batch_max_items:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Un lot contient au plus {settings.batch_max_items} exercices",
+        )
+    estimates = [
+        estimate_tokens(*prompts.build_exercise(BATCH_ACTIONS[item.type], item.theme, item.level))
+        for item in items
+    ]
+    reservations = await reserve_quota_batch(db, user, estimates)
+    works = [_Work(i, item, r) for i, (item, r) in enumerate(zip(items, reservations))]
+    run = _BatchRun()
+    try:
+        # Pool et cache : toutes les recherches en parallèle (une session chacune)
+        found = await asyncio.gather(*(_from_pool_or_cache(w) for w in works))
+        pending = [w for w, hit in zip(works, found) if not hit]
+        await asyncio.gather(*(run.packed(group) for group in _pack(pending)))
+
+        for work in works:
+            if work.error is None:
+                meta = {**work.meta, "batch": True, **prompts.template_meta(work.action)}
+                await work.reservation.commit(
+                    db, work.action, work.tokens,
+                    json.dumps({"theme": work.item.theme, "level": work.item.level, **meta},
+                               ensure_ascii=False),
+                )
+        await release_all(db, [w.reservation for w in works if w.error is not None])
+        if run.unbilled_tokens:
+            await charge_tokens(db, user.id, reservations[0].day, run.unbilled_tokens)
+    except BaseException:
+        await release_all(db, reservations)
+        raise
+    return {"items": [w.out() for w in works], "upstream_calls": run.upstream_calls}
@@ -0,0 +1,210 @@
+"""
+Cache des réponses de génération.
+
+La clé est un hash du prompt système, du prompt utilisateur, du modèle (routé
+selon l'action) et de max_tokens. Chaque clé conserve jusqu'à N variantes (réglage `cache_variety`
+par action) : tant que N variantes n'existent pas, on génère ; ensuite on les
+sert en rotation, sans appel à Gemini.
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+from .config import get_settings
+from .database import AsyncSessionLocal
+from .models import GenerationCache
+from .claude_service import UpstreamUnavailable, call_claude, prompt_hash
+from .structured import parse_response
+from .model_router import model_router
+
+# Même clé que la coalescence des appels en vol
+cache_key = prompt_hash
+
+
+class MemoryCacheBackend:
+    """Cache en mémoire du process : TTL + éviction LRU sur le nombre de clés."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, list[tuple[float, str]]] = OrderedDict()
+        self._cursor: dict[str, int] = {}
+
+    def _alive(self, key: str) -> list[tuple[float, str]]:
+        variants = self._entries.get(key)
+        if variants is None:
+            return []
+        now = time.monotonic()
+        alive = [(exp, payload) for exp, payload in variants if exp > now]
+        if not alive:
+            del self._entries[key]
+            self._cursor.pop(key, None)
+            return []
+        self._entries[key] = alive
+        self._entries.move_to_end(key)
+        return alive
+
+    async def pick(self, key: str, variety: int) -> str | None:
+        alive = self._alive(key)
+        if len(alive) < variety:
+            return None
+        idx = self._cursor.get(key, 0)
+        self._cursor[key] = idx + 1
+        return alive[idx % len(alive)][1]
+
+    async def add(self, key: str, action: str, payload: str, variety: int) -> None:
+        # Variante identique (ex. appels coalescés) : on ne la duplique pas
+        variants = [v for v in self._alive(key) if v[1] != payload]
+        variants.append((time.monotonic() + self.ttl_seconds, payload))
+        self._entries[key] = variants[-variety:]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._cursor.pop(evicted, None)
+
+
+class DBCacheBackend:
+    """Cache partagé entre workers via la table generation_cache."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+    async def pick(self, key: str, variety: int) -> str | None:
+        async with AsyncSessionLocal() as db:
+            now = datetime.utcnow()
+            rows = (
+                await db.scalars(
+                    select(GenerationCache)
+                    .where(GenerationCache.cache_key == key, GenerationCache.expires_at > now)
+                    .order_by(GenerationCache.last_used_at.asc())
+                )
+            ).all()
+            if len(rows) < variety:
+                return None
+            # La variante servie le moins récemment : rotation + LRU
+            row = rows[0]
+            row.last_used_at = now
+            await db.commit()
+            return row.payload
+
+    async def add(self, key: str, action: str, payload: str, variety: int) -> None:
+        async with AsyncSessionLocal() as db:
+            now = datetime.utcnow()
+            await db.execute(delete(GenerationCache).where(
+                GenerationCache.expires_at <= now
+                # Variante identique (ex. appels coalescés) : remplacée, pas dupliquée
+                | ((GenerationCache.cache_key == key) & (GenerationCache.payload == payload))
+            ))
+            db.add(GenerationCache(
+                cache_key=key,
+                action=action,
+                payload=payload,
+                created_at=now,
+                last_used_at=now,
+                expires_at=now + timedelta(seconds=self.ttl_seconds),
+            ))
+            await db.flush()
+            # Garder au plus `variety` variantes pour cette clé
+            stale = await db.scalars(
+                select(GenerationCache.id)
+                .where(GenerationCache.cache_key == key)
+                .order_by(GenerationCache.created_at.desc())
+                .offset(variety)
+            )
+            # Éviction LRU globale au-delà de max_entries lignes
+            overflow = await db.scalars(
+                select(GenerationCache.id)
+                .order_by(GenerationCache.last_used_at.desc())
+                .offset(self.max_entries)
+            )
+            ids = set(stale.all()) | set(overflow.all())
+            if ids:
+                await db.execute(delete(GenerationCache).where(GenerationCache.id.in_(ids)))
+            await db.commit()
+
+
+class ResponseCache:
+    def __init__(self):
+        settings = get_settings()
+        self.variety = settings.cache_variety_map
+        if settings.cache_backend == "db":
+            self.backend = DBCacheBackend(settings.cache_max_entries, settings.cache_ttl_seconds)
+        elif settings.cache_backend == "memory":
+            self.backend = MemoryCacheBackend(settings.cache_max_entries, settings.cache_ttl_seconds)
+        else:
+            self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def enabled_for(self, action: str) -> bool:
+        return self.backend is not None and self.variety.get(action, 0) > 0
+
+    async def get(self, action: str, key: str) -> str | None:
+        payload = await self.backend.pick(key, self.variety[action])
+        if payload is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return payload
+
+    async def fallback(self, action: str, key: str) -> str | None:
+        """N'importe quelle variante en cache, même incomplète (upstream indisponible)."""
+        payload = await self.backend.pick(key, 1)
+        if payload is not None:
+            self.fallbacks += 1
+        return payload
+
+    async def put(self, action: str, key: str, payload: str) -> None:
+        await self.backend.add(key, action, payload, self.variety[action])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "fallbacks": self.fallbacks,
+        }
+
+
+response_cache = ResponseCache()
+
+
+async def generate_cached(
+    action: str, system: str, user: str, max_tokens: int = 1200, coalesce: bool = True
+) -> tuple[dict | list, int, str, str | None]:
+    """
+    Génère via le cache et retourne (résultat_validé, tokens_utilisés, statut_cache, modèle).
+    statut_cache vaut "hit", "miss", "bypass" (action non mise en cache) ou
+    "fallback" (disjoncteur ouvert : variante en cache servie quand même).
+    Sur un hit ou un fallback, aucun appel upstream : tokens_utilisés vaut 0
+    et modèle None.
+    """
+    if not response_cache.enabled_for(action):
+        text, tokens, model = await call_claude(
+            system, user, max_tokens=max_tokens, action=action, coalesce=coalesce
+        )
+        return parse_response(action, text), tokens, "bypass", model
+
+    key = cache_key(system, user, model_router.model_for(action), max_tokens)
+    cached = await response_cache.get(action, key)
+    if cached is not None:
+        return parse_response(action, cached), 0, "hit", None
+
+    try:
+        text, tokens, model = await call_claude(
+            system, user, max_tokens=max_tokens, action=action, coalesce=coalesce
+        )
+    except UpstreamUnavailable:
+        fallback = await response_cache.fallback(action, key)
+        if fallback is None:
+            raise
+        return parse_response(action, fallback), 0, "fallback", None
+    result = parse_response(action, text)
+    # On ne met en cache qu'une réponse qui a été parsée avec succès
+    await response_cache.put(action, key, text)
+    return result, tokens, "miss", model
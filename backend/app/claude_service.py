@@ -1,51 +1,403 @@
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import asynccontextmanager
+
 import httpx
 from fastapi import HTTPException
 from .config import get_settings
+from .metrics import UPSTREAM_ERRORS, UPSTREAM_LATENCY, UPSTREAM_TOKENS
+from .model_router import model_router
+from .resilience import CircuitBreaker, TokenBucket, parse_retry_after, retry_delay
+from .singleflight import SingleFlight
+from .structured import response_schema
 
-MODEL = "gemini-2.5-flash-lite"
-GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+def _api_url(path: str) -> str:
+    """URL d'un endpoint Gemini sous `gemini_base_url` (ex. faux serveur du banc, bench/)."""
+    return f"{get_settings().gemini_base_url.rstrip('/')}/{path}"
 
 
-async def call_claude(system: str, user: str, max_tokens: int = 1200) -> tuple[str, int]:
-    """
-    Appelle l'API Gemini et retourne (texte_réponse, tokens_utilisés).
-    Lève une HTTPException en cas d'erreur.
-    """
+# Client partagé, ouvert/fermé par le lifespan de l'app (voir main.py)
+_client: httpx.AsyncClient | None = None
+
+# Compteurs de réutilisation des connexions
+_conn_stats = {"requests": 0, "connections_opened": 0}
+
+
+async def _trace(event_name: str, info: dict) -> None:
+    """Hook httpcore : compte les nouvelles connexions TCP ouvertes."""
+    if event_name == "connection.connect_tcp.complete":
+        _conn_stats["connections_opened"] += 1
+
+
+def _build_client() -> httpx.AsyncClient:
     settings = get_settings()
-    url = f"{GEMINI_BASE_URL}/{MODEL}:generateContent?key={settings.gemini_api_key}"
+    return httpx.AsyncClient(
+        http2=settings.gemini_http2,
+        limits=httpx.Limits(
+            max_connections=settings.gemini_max_connections,
+            max_keepalive_connections=settings.gemini_max_keepalive_connections,
+            keepalive_expiry=settings.gemini_keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(
+            settings.gemini_read_timeout,
+            connect=settings.gemini_connect_timeout,
+        ),
+    )
+
+
+async def start_http_client() -> None:
+    global _client
+    if _client is None:
+        _client = _build_client()
+    _reset_limits()
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def warm_up_http_client() -> None:
+    """Ouvre la connexion (TLS, HTTP/2) vers Gemini avec une requête légère (liste des modèles)."""
+    await get_http_client().get(
+        f"{_api_url('models')}?pageSize=1&key={get_settings().gemini_api_key}",
+        extensions={"trace": _trace},
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Retourne le client partagé (créé à la volée hors lifespan, ex. scripts)."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+def connection_stats() -> dict:
+    requests = _conn_stats["requests"]
+    opened = _conn_stats["connections_opened"]
+    return {
+        "requests": requests,
+        "connections_opened": opened,
+        "connections_reused": max(0, requests - opened),
+    }
 
-    payload = {
+
+def _payload(system: str, user: str, max_tokens: int, schema: dict | None = None) -> dict:
+    config = {"maxOutputTokens": max_tokens}
+    if schema is not None and get_settings().gemini_json_mode:
+        # Mode JSON : sortie contrainte par le schéma (voir structured.py)
+        config["responseMimeType"] = "application/json"
+        config["responseSchema"] = schema
+    return {
         "system_instruction": {"parts": [{"text": system}]},
         "contents": [{"role": "user", "parts": [{"text": user}]}],
-        "generationConfig": {"maxOutputTokens": max_tokens},
+        "generationConfig": config,
     }
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(url, json=payload)
 
-    if resp.status_code != 200:
-        raise HTTPException(
-            status_code=502,
-            detail=f"Erreur service de génération ({resp.status_code}): {resp.text[:300]}",
+def _extract_text(data: dict) -> str:
+    candidates = data.get("candidates", [])
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join(p.get("text", "") for p in parts)
+
+
+# ── Résilience : concurrence, débit, retry, disjoncteur ─────────────────
+
+# Statuts upstream transitoires : on réessaie, et ils comptent pour le disjoncteur
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailable(HTTPException):
+    """Disjoncteur ouvert : échec immédiat, sans appel upstream."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail="Service de génération momentanément indisponible, réessaie dans quelques instants",
+            headers={"Retry-After": str(retry_after)},
         )
 
+
+_breaker = CircuitBreaker(
+    get_settings().gemini_breaker_failure_threshold,
+    get_settings().gemini_breaker_reset_seconds,
+)
+_global_slots: asyncio.Semaphore | None = None
+_model_slots: dict[str, asyncio.Semaphore] = {}
+_rpm: TokenBucket | None = None
+_tpm: TokenBucket | None = None
+_resilience = {"retries": 0, "upstream_errors": 0}
+
+
+def _reset_limits() -> None:
+    """(Re)crée sémaphores et seaux, liés à la boucle asyncio courante."""
+    global _global_slots, _rpm, _tpm
+    settings = get_settings()
+    _global_slots = asyncio.Semaphore(settings.gemini_max_concurrency)
+    _model_slots.clear()
+    _rpm = TokenBucket(settings.gemini_rpm_limit)
+    _tpm = TokenBucket(settings.gemini_tpm_limit)
+
+
+def _model_semaphore(model: str) -> asyncio.Semaphore:
+    if model not in _model_slots:
+        _model_slots[model] = asyncio.Semaphore(get_settings().gemini_model_concurrency)
+    return _model_slots[model]
+
+
+def estimate_tokens(system: str, user: str, max_tokens: int) -> int:
+    # ~4 caractères par token en entrée, pire cas en sortie
+    return (len(system) + len(user)) // 4 + max_tokens
+
+
+@asynccontextmanager
+async def _upstream_slot(model: str, estimate: int, action: str | None = None):
+    """Disjoncteur, débit (RPM/TPM) puis créneaux de concurrence global et par modèle."""
+    if _global_slots is None:
+        _reset_limits()
+    if not _breaker.allow():
+        UPSTREAM_ERRORS.inc(action=str(action), reason="circuit_open")
+        raise UpstreamUnavailable(_breaker.retry_after())
+    try:
+        await _rpm.acquire(1)
+        await _tpm.acquire(estimate)
+        async with _global_slots, _model_semaphore(model):
+            yield
+    except BaseException:
+        # Appel de test annulé (client parti…) : le disjoncteur ne reste pas bloqué
+        if _breaker.state == "half_open":
+            _breaker.failure()
+        raise
+
+
+def _retry_or_raise(
+    attempt: int,
+    status: int | None,
+    detail: str,
+    retry_after: str | None,
+    action: str | None = None,
+) -> float:
+    """
+    Échec d'une tentative : retourne le délai avant la suivante, ou lève la 502.
+    status None = erreur réseau / timeout.
+    """
+    settings = get_settings()
+    UPSTREAM_ERRORS.inc(action=str(action), reason=str(status) if status else "network")
+    if status is not None and status not in RETRYABLE_STATUSES:
+        _breaker.success()   # le service répond : erreur de requête, pas une panne
+        raise HTTPException(status_code=502, detail=detail)
+    _breaker.failure()
+    _resilience["upstream_errors"] += 1
+    wait = parse_retry_after(retry_after)
+    if attempt >= settings.gemini_max_retries or (
+        wait is not None and wait > settings.gemini_retry_max_delay
+    ):
+        raise HTTPException(status_code=502, detail=detail)
+    _resilience["retries"] += 1
+    return retry_delay(
+        attempt, settings.gemini_retry_base_delay, settings.gemini_retry_max_delay, wait
+    )
+
+
+def resilience_stats() -> dict:
+    return {
+        **_resilience,
+        "breaker": _breaker.stats(),
+        "rpm_waits": _rpm.waits if _rpm else 0,
+        "tpm_waits": _tpm.waits if _tpm else 0,
+    }
+
+
+# ── Appels ───────────────────────────────────────────────────────────────
+
+def prompt_hash(system: str, user: str, model: str, max_tokens: int) -> str:
+    raw = "\x1f".join([system, user, model, str(max_tokens)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# Appels identiques en vol partagés (voir singleflight.py)
+_flights = SingleFlight()
+
+
+def coalescing_stats() -> dict:
+    return _flights.stats()
+
+
+async def call_claude(
+    system: str,
+    user: str,
+    max_tokens: int = 1200,
+    action: str | None = None,
+    schema: dict | None = None,
+    coalesce: bool = True,
+) -> tuple[str, int, str]:
+    """
+    Appelle l'API Gemini et retourne (texte_réponse, tokens_utilisés, modèle).
+    `modèle` est celui qui a répondu (modelVersion de la réponse), pas
+    seulement la route configurée.
+    Le modèle est choisi par le routeur selon l'action (voir model_router.py),
+    la sortie contrainte par le responseSchema de l'action sauf `schema` explicite.
+    Les appels concurrents au même prompt partagent une seule requête upstream ;
+    les suiveurs reçoivent tokens_utilisés = 0 (déjà comptés par le leader).
+    `coalesce=False` quand chaque appel doit produire un exercice distinct
+    (remplissage du pool, exercices identiques d'un lot).
+    Lève une HTTPException en cas d'erreur.
+    """
+    model = model_router.model_for(action)
+    schema = schema or response_schema(action)
+
+    def hedged():
+        return model_router.hedged(
+            model, lambda: _generate(system, user, max_tokens, model, schema, action)
+        )
+
+    if not (coalesce and get_settings().coalesce_enabled):
+        return await hedged()
+    key = prompt_hash(system, user, model, max_tokens)
+    (text, tokens, served_by), shared = await _flights.do(key, hedged)
+    return text, 0 if shared else tokens, served_by
+
+
+async def _generate(
+    system: str,
+    user: str,
+    max_tokens: int,
+    model: str,
+    schema: dict | None,
+    action: str | None = None,
+) -> tuple[str, int, str]:
+    settings = get_settings()
+    begin = time.perf_counter()
+    url = f"{_api_url(f'models/{model}:generateContent')}?key={settings.gemini_api_key}"
+    payload = _payload(system, user, max_tokens, schema)
+    estimate = estimate_tokens(system, user, max_tokens)
+    client = get_http_client()
+
+    attempt = 0
+    while True:
+        async with _upstream_slot(model, estimate, action):
+            _conn_stats["requests"] += 1
+            started = time.perf_counter()
+            try:
+                resp = await client.post(url, json=payload, extensions={"trace": _trace})
+            except httpx.TransportError as exc:
+                resp, error = None, f"Erreur réseau du service de génération: {exc!r}"
+        if resp is not None and resp.status_code == 200:
+            model_router.observe(model, (time.perf_counter() - started) * 1000)
+            break
+        if resp is not None:
+            error = f"Erreur service de génération ({resp.status_code}): {resp.text[:300]}"
+        delay = _retry_or_raise(
+            attempt,
+            resp.status_code if resp is not None else None,
+            error,
+            resp.headers.get("retry-after") if resp is not None else None,
+            action,
+        )
+        await asyncio.sleep(delay)
+        attempt += 1
+
+    _breaker.success()
     data = resp.json()
-    candidates = data.get("candidates", [])
-    text = ""
-    if candidates:
-        parts = candidates[0].get("content", {}).get("parts", [])
-        text = "".join(p.get("text", "") for p in parts)
+    text = _extract_text(data)
 
     usage = data.get("usageMetadata", {})
     tokens = usage.get("totalTokenCount", 0)
+    _tpm.adjust(tokens - estimate)
+    UPSTREAM_LATENCY.observe(
+        time.perf_counter() - begin, action=str(action), model=model, mode="sync"
+    )
+    UPSTREAM_TOKENS.observe(tokens, action=str(action))
 
-    return text, tokens
+    return text, tokens, data.get("modelVersion") or model
 
 
-def parse_json(text: str) -> dict | list:
-    import json, re
-    clean = re.sub(r"```json\s*|```", "", text).strip()
-    try:
-        return json.loads(clean)
-    except json.JSONDecodeError as e:
-        raise HTTPException(status_code=502, detail=f"Réponse JSON invalide: {e}")
+class GenerationStream:
+    """
+    Appel streamGenerateContent : itérer dessus produit les fragments de texte
+    au fil de l'eau. À la fin, `text` contient la réponse complète, `tokens`
+    le total de usageMetadata (envoyé dans le dernier fragment) et `served_by`
+    le modèle qui a répondu (modelVersion).
+    """
+
+    def __init__(
+        self,
+        system: str,
+        user: str,
+        max_tokens: int = 1200,
+        model: str | None = None,
+        schema: dict | None = None,
+        action: str | None = None,
+    ):
+        self.system = system
+        self.user = user
+        self.max_tokens = max_tokens
+        self.model = model or get_settings().gemini_default_model
+        self.schema = schema
+        self.action = action
+        self.text = ""
+        self.tokens = 0
+        self.served_by = self.model
+
+    async def __aiter__(self):
+        settings = get_settings()
+        url = (
+            f"{_api_url(f'models/{self.model}:streamGenerateContent')}"
+            f"?alt=sse&key={settings.gemini_api_key}"
+        )
+        payload = _payload(self.system, self.user, self.max_tokens, self.schema)
+        estimate = estimate_tokens(self.system, self.user, self.max_tokens)
+        client = get_http_client()
+        begin = time.perf_counter()
+
+        attempt = 0
+        while True:
+            status = retry_after = None
+            async with _upstream_slot(self.model, estimate, self.action):
+                _conn_stats["requests"] += 1
+                try:
+                    async with client.stream(
+                        "POST", url, json=payload, extensions={"trace": _trace}
+                    ) as resp:
+                        if resp.status_code == 200:
+                            async for line in resp.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = json.loads(line[5:])
+                                self.served_by = data.get("modelVersion") or self.served_by
+                                usage = data.get("usageMetadata")
+                                if usage:
+                                    self.tokens = usage.get("totalTokenCount", self.tokens)
+                                delta = _extract_text(data)
+                                if delta:
+                                    self.text += delta
+                                    yield delta
+                            _breaker.success()
+                            _tpm.adjust(self.tokens - estimate)
+                            UPSTREAM_LATENCY.observe(
+                                time.perf_counter() - begin,
+                                action=str(self.action), model=self.model, mode="stream",
+                            )
+                            UPSTREAM_TOKENS.observe(self.tokens, action=str(self.action))
+                            return
+                        status, retry_after = resp.status_code, resp.headers.get("retry-after")
+                        body = (await resp.aread()).decode(errors="replace")
+                        error = f"Erreur service de génération ({status}): {body[:300]}"
+                except httpx.TransportError as exc:
+                    error = f"Erreur réseau du service de génération: {exc!r}"
+                    if self.text:
+                        # Fragments déjà envoyés au client : pas de nouvelle tentative
+                        _breaker.failure()
+                        UPSTREAM_ERRORS.inc(action=str(self.action), reason="network")
+                        raise HTTPException(status_code=502, detail=error)
+            delay = _retry_or_raise(attempt, status, error, retry_after, self.action)
+            await asyncio.sleep(delay)
+            attempt += 1
+
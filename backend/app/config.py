@@ -7,18 +7,163 @@ class Settings(BaseSettings):
     # DATABASE_URL fournie par Supabase (format: postgresql://...)
     # Render l'injecte via les variables d'environnement du dashboard
     database_url: str = ""
+    # Démarrage : connexions ouvertes en tâche de fond, délai du contrôle /api/ready
+    db_warm_connections: int = 2
+    ready_timeout_seconds: float = 2.0
     gemini_api_key: str
     secret_key: str
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 1440
     default_daily_quota: int = 50
     admin_daily_quota: int = 9999
+    # Budgets de tokens (0 = illimité) ; surcharge possible par utilisateur (admin)
+    default_daily_token_budget: int = 100_000
+    default_monthly_token_budget: int = 1_500_000
+    global_daily_token_budget: int = 0
+    global_monthly_token_budget: int = 0
+    global_counter_shards: int = 16  # lignes par compteur global (moins de verrous partagés)
     allowed_origins: str = "http://localhost:8080"
+    metrics_token: str = ""          # Bearer exigé par /api/metrics (vide = accès libre)
+    bcrypt_max_workers: int = 2      # threads dédiés au hachage des mots de passe
+    auth_cache_ttl_seconds: int = 60   # cache des utilisateurs authentifiés (0 = désactivé)
+    auth_cache_max_entries: int = 2000
+    # Import groupé (POST /api/admin/users/bulk, create_admin.py --roster)
+    bulk_import_max_rows: int = 2000
+    bulk_import_workers: int = 0     # processus de hachage bcrypt (0 = un par cœur)
+    bulk_import_generated_rounds: int = 4   # coût bcrypt des mots de passe générés (0 = coût normal)
+
+    # Limitation de débit (voir ratelimit.py) : "politique:clé:requêtes/secondes,…"
+    # politiques login | register | generate, clés ip | email | user
+    rate_limit_enabled: bool = True
+    rate_limit_rules: str = (
+        "login:ip:20/60,login:email:5/60,register:ip:5/3600,generate:user:20/60,generate:ip:60/60"
+    )
+    rate_limit_backend: str = "memory"   # memory | db (compteurs partagés entre workers)
+    rate_limit_max_keys: int = 10_000    # backend mémoire : clés suivies au maximum
+    rate_limit_proxy_hops: int = 1       # proxys de confiance devant l'app (Render : 1, 0 = IP TCP)
+
+    # Racine de l'API Gemini (faux serveur local pour les benchmarks, voir bench/)
+    gemini_base_url: str = "https://generativelanguage.googleapis.com/v1beta"
+
+    # Client HTTP Gemini : un seul client partagé pour toute la vie de l'app
+    # (HTTP/2 + keep-alive, évite un handshake TLS par génération)
+    gemini_http2: bool = True
+    gemini_max_connections: int = 20
+    gemini_max_keepalive_connections: int = 10
+    gemini_keepalive_expiry: float = 30.0
+    gemini_connect_timeout: float = 5.0
+    gemini_read_timeout: float = 60.0
+
+    # Mode JSON Gemini : sortie contrainte par le responseSchema de chaque action
+    gemini_json_mode: bool = True
+
+    # Modèle par action ("action:modèle,…"), gemini_default_model sinon
+    gemini_default_model: str = "gemini-2.5-flash-lite"
+    gemini_model_routes: str = "writing_correct:gemini-2.5-flash"
+    # Requête couverte : 2e appel si pas de réponse après le p95 observé du modèle
+    hedge_enabled: bool = True
+    hedge_min_samples: int = 20       # échantillons de latence avant d'activer le hedging
+    hedge_min_delay_ms: int = 250     # plancher du délai de couverture
+
+    # Résilience des appels Gemini (valeurs par défaut : palier payant 1 de flash-lite)
+    gemini_max_concurrency: int = 16         # appels simultanés, tous modèles
+    gemini_model_concurrency: int = 8        # appels simultanés par modèle
+    gemini_rpm_limit: int = 4000             # requêtes / minute (0 = illimité)
+    gemini_tpm_limit: int = 4_000_000        # tokens / minute (0 = illimité)
+    gemini_max_retries: int = 3              # sur 429 / 5xx / erreur réseau
+    gemini_retry_base_delay: float = 0.5
+    gemini_retry_max_delay: float = 8.0      # Retry-After plus long : on abandonne
+    gemini_breaker_failure_threshold: int = 5    # échecs consécutifs avant ouverture (0 = off)
+    gemini_breaker_reset_seconds: float = 30.0
+
+    # Coalescence des appels Gemini identiques en vol (single-flight)
+    coalesce_enabled: bool = True
+
+    # Templates de prompts (prompts.py) : version épinglée par template
+    # ("id:version,…"), la plus récente sinon
+    prompt_template_versions: str = ""
+
+    # Cache des réponses générées : memory | db | off
+    cache_backend: str = "memory"
+    cache_ttl_seconds: int = 6 * 3600
+    cache_max_entries: int = 500
+    # Variantes conservées par clé, par action ("action:n,…"), servies en rotation
+    cache_variety: str = (
+        "writing_generate:3,fill_generate:3,reading_generate:3,flashcards_generate:3"
+    )
+
+    # Pool d'exercices pré-générés (workers asyncio lancés par le lifespan)
+    pool_enabled: bool = True
+    pool_workers: int = 2
+    pool_actions: str = "writing_generate,fill_generate,reading_generate,flashcards_generate"
+    pool_low_water: int = 2          # on recharge un bucket sous ce seuil…
+    pool_high_water: int = 6         # …jusqu'à ce niveau
+    pool_refill_interval_seconds: int = 60
+    pool_demand_window_hours: int = 24
+    pool_min_demand: int = 3         # demandes minimum pour qu'un bucket soit "populaire"
+    pool_max_buckets: int = 30
+
+    # Génération groupée (POST /api/generate/batch)
+    batch_max_items: int = 20
+    batch_pack_size: int = 4                 # exercices du même type par appel Gemini…
+    batch_max_output_tokens: int = 6000      # …dans la limite de ce budget de sortie
+    batch_fanout: int = 4                    # appels Gemini simultanés par lot
+
+    # Écriture des UsageLog : sync (commit dans la requête) | batched (write-behind)
+    usage_log_mode: str = "batched"
+    usage_log_batch_size: int = 200      # INSERT dès M lignes…
+    usage_log_flush_ms: int = 250        # …ou toutes les N ms
+    usage_log_queue_size: int = 5000     # au-delà, back-pressure sur les requêtes
+    # Rétention (archive_logs.py) : mois complets gardés en base, les plus anciens
+    # sont archivés puis supprimés (0 = aucune archive) ; partitions Postgres
+    # créées à l'avance par la boucle de maintenance
+    usage_log_retention_months: int = 12
+    usage_log_archive_dir: str = "archives"
+    usage_log_partitions_ahead: int = 2
+    # Export admin en flux (GET /api/admin/export/usage)
+    export_batch_size: int = 1000        # lignes lues par aller-retour du curseur
+    export_max_concurrent: int = 2       # exports simultanés (429 au-delà)
+    export_gzip_level: int = 5
+
+    # Rollups du dashboard admin : recalcul périodique des derniers jours
+    rollup_compaction_interval_seconds: int = 600
+    rollup_compaction_days: int = 2
 
     @property
     def origins_list(self) -> list[str]:
         return [o.strip() for o in self.allowed_origins.split(",")]
 
+    @property
+    def pool_actions_list(self) -> list[str]:
+        return [a.strip() for a in self.pool_actions.split(",") if a.strip()]
+
+    @property
+    def model_routes_map(self) -> dict[str, str]:
+        result = {}
+        for item in self.gemini_model_routes.split(","):
+            if ":" in item:
+                action, model = item.split(":", 1)
+                result[action.strip()] = model.strip()
+        return result
+
+    @property
+    def prompt_versions_map(self) -> dict[str, int]:
+        result = {}
+        for item in self.prompt_template_versions.split(","):
+            if ":" in item:
+                template, version = item.split(":", 1)
+                result[template.strip()] = int(version)
+        return result
+
+    @property
+    def cache_variety_map(self) -> dict[str, int]:
+        result = {}
+        for item in self.cache_variety.split(","):
+            if ":" in item:
+                action, n = item.split(":", 1)
+                result[action.strip()] = int(n)
+        return result
+
     def model_post_init(self, __context):
         # Supabase et certains hébergeurs utilisent postgres:// 
         # SQLAlchemy 2+ requiert postgresql://
@@ -1,22 +1,109 @@
-from sqlalchemy import create_engine
+"""
+Moteurs SQLAlchemy, créés au premier usage et non à l'import.
+
+Le schéma est géré uniquement par Alembic (`alembic upgrade head`) : l'app ne
+fait aucun DDL. Le lifespan crée le moteur asynchrone puis préchauffe le pool
+en tâche de fond (voir startup.py) : un démarrage à froid ne touche pas la base
+avant d'accepter du trafic.
+"""
+import asyncio
+
+from sqlalchemy import Engine, create_engine, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import get_settings
+from .metrics import DB_POOL_WAIT, instrument_engine
 
 settings = get_settings()
 
-engine = create_engine(
-    settings.database_url,
-    pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=10,
+_engine: Engine | None = None
+_async_engine: AsyncEngine | None = None
+
+# Sessions liées au moteur à sa création (get_engine / get_async_engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = async_sessionmaker(
+    class_=AsyncSession, autoflush=False, expire_on_commit=False
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+class _TimedPool(AsyncAdaptedQueuePool):
+    """Pool asynchrone dont l'obtention d'une connexion est chronométrée."""
+
+    def _do_get(self):
+        with DB_POOL_WAIT.time():
+            return super()._do_get()
+
+
+def get_engine() -> Engine:
+    """Moteur synchrone : scripts (create_admin.py)."""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(
+            settings.database_url,
+            pool_pre_ping=True,
+            pool_size=5,
+            max_overflow=10,
+        )
+        instrument_engine(_engine)
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def async_database_url(url: str) -> str:
+    """postgresql:// → postgresql+asyncpg://, sqlite:// → sqlite+aiosqlite://"""
+    if url.startswith("postgresql://"):
+        url = url.replace("postgresql://", "postgresql+asyncpg://", 1)
+        # asyncpg ne connaît pas sslmode (format des URL Supabase)
+        return url.replace("sslmode=", "ssl=")
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
+def get_async_engine() -> AsyncEngine:
+    """Moteur asynchrone : toutes les routes de l'API (ne bloque pas la boucle uvicorn)."""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(
+            async_database_url(settings.database_url),
+            poolclass=_TimedPool,
+            pool_pre_ping=True,
+            pool_size=5,
+            max_overflow=10,
+        )
+        instrument_engine(_async_engine.sync_engine)
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
 
-def get_db():
-    db = SessionLocal()
-    try:
+
+async def ping_db() -> None:
+    async with get_async_engine().connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def warm_up_pool(connections: int) -> None:
+    """Ouvre `connections` connexions en parallèle : elles restent dans le pool."""
+    await asyncio.gather(*(ping_db() for _ in range(max(1, connections))))
+
+
+async def dispose_engines() -> None:
+    global _engine, _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+def dialect_insert(db: AsyncSession):
+    """insert() du dialecte courant, pour les upserts ON CONFLICT (Postgres / SQLite)."""
+    return pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
@@ -0,0 +1,161 @@
+"""
+Export en continu des logs d'usage (GET /api/admin/export/usage).
+
+- Curseur côté serveur (stream + yield_per) : les lignes arrivent par paquets
+  de `export_batch_size`, la mémoire reste constante quel que soit le volume.
+- Filtre de période sur created_at : sur Postgres, seules les partitions
+  mensuelles concernées sont lues ; tri par id (index de clé primaire, pas de
+  tri en mémoire côté base).
+- NDJSON ou CSV, compressé en gzip à la volée en option.
+- Sans pénaliser les autres requêtes : une seule connexion par export, exports
+  simultanés limités (`export_max_concurrent`, 429 au-delà), encodage et
+  compression de chaque paquet dans un thread pour ne pas bloquer la boucle.
+"""
+import asyncio
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator
+
+from sqlalchemy import select
+
+from .config import get_settings
+from .database import AsyncSessionLocal
+from .metrics import EXPORTED_ROWS
+from .models import UsageLog, User
+from .streaming import ClosingStreamingResponse
+
+COLUMNS = ("id", "user_id", "email", "action", "tokens_used", "log_date", "created_at", "extra")
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+class ExportSlot:
+    """Place réservée parmi les exports simultanés ; release() est idempotent."""
+
+    def __init__(self, exporter: "UsageExporter"):
+        self._exporter = exporter
+        self._held = True
+
+    def release(self) -> None:
+        if self._held:
+            self._held = False
+            self._exporter.active -= 1
+
+
+class UsageExporter:
+    """Borne le nombre d'exports en cours et produit le flux d'octets."""
+
+    def __init__(self):
+        self.active = 0
+        self.exports = 0
+        self.rows = 0
+
+    def try_acquire(self) -> ExportSlot | None:
+        """Place libre, ou None si `export_max_concurrent` exports sont déjà en cours."""
+        if self.active >= max(1, get_settings().export_max_concurrent):
+            return None
+        self.active += 1
+        return ExportSlot(self)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "limit": max(1, get_settings().export_max_concurrent),
+            "exports": self.exports,
+            "rows": self.rows,
+        }
+
+    async def stream(
+        self,
+        fmt: str,
+        from_: date,
+        to: date,
+        action: str | None = None,
+        user_id: int | None = None,
+        compress: bool = False,
+    ) -> AsyncIterator[bytes]:
+        """Octets de l'export, produits paquet par paquet au fil du curseur."""
+        settings = get_settings()
+        encode = _ndjson_chunk if fmt == "ndjson" else _csv_chunk
+        gzipper = zlib.compressobj(settings.export_gzip_level, zlib.DEFLATED, 31) if compress else None
+
+        def encode_batch(rows) -> bytes:
+            chunk = encode(rows)
+            return gzipper.compress(chunk) if gzipper else chunk
+
+        self.exports += 1
+        if fmt == "csv":
+            yield encode_batch([COLUMNS])
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(
+                export_query(from_, to, action, user_id)
+                .execution_options(yield_per=settings.export_batch_size)
+            )
+            async for partition in result.partitions():
+                # Encodage et compression hors de la boucle : les autres requêtes passent entre deux paquets
+                chunk = await asyncio.to_thread(encode_batch, partition)
+                self.rows += len(partition)
+                EXPORTED_ROWS.inc(len(partition), format=fmt)
+                if chunk:
+                    yield chunk
+        if gzipper:
+            yield gzipper.flush()
+
+
+class ExportResponse(ClosingStreamingResponse):
+    """Réponse d'export : ferme le flux (connexion rendue) puis la place, quoi qu'il arrive."""
+
+    def __init__(self, content: AsyncIterator[bytes], slot: ExportSlot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.release()
+
+
+def export_query(from_: date, to: date, action: str | None, user_id: int | None):
+    """Logs créés entre from_ et to inclus (jours UTC), avec l'email de l'utilisateur."""
+    log = UsageLog.__table__
+    query = (
+        select(
+            log.c.id, log.c.user_id, User.email, log.c.action, log.c.tokens_used,
+            log.c.log_date, log.c.created_at, log.c.extra,
+        )
+        .outerjoin(User, User.id == log.c.user_id)
+        .where(
+            log.c.created_at >= datetime.combine(from_, time.min),
+            log.c.created_at < datetime.combine(to + timedelta(days=1), time.min),
+        )
+        .order_by(log.c.id)
+    )
+    if action:
+        query = query.where(log.c.action == action)
+    if user_id is not None:
+        query = query.where(log.c.user_id == user_id)
+    return query
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _ndjson_chunk(rows) -> bytes:
+    return "".join(
+        json.dumps(dict(zip(COLUMNS, map(_value, row))), ensure_ascii=False) + "\n"
+        for row in rows
+    ).encode()
+
+
+def _csv_chunk(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_value(v) for v in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+usage_exporter = UsageExporter()
@@ -1,16 +1,47 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import secrets
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from .config import get_settings
-from .database import engine
-from .models import Base
+from .database import dispose_engines, get_async_engine
+from . import metrics
 from .routers import auth, generate, admin
+from .claude_service import start_http_client, close_http_client
+from .prompts import compile_templates
+from .ratelimit import RateLimitMiddleware
+from .pool import start_pool_workers, stop_pool_workers
+from .rollups import start_rollup_compaction, stop_rollup_compaction
+from .startup import readiness, warm_up
+from .usage_writer import usage_writer
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    compile_templates()   # template invalide : échec au démarrage
+    # Aucun DDL (schéma : `alembic upgrade head` au déploiement) ; le moteur est
+    # créé sans connexion, le pool est préchauffé en tâche de fond
+    get_async_engine()
+    await start_http_client()
+    warming = asyncio.create_task(warm_up())
+    await usage_writer.start()
+    await start_pool_workers()
+    await start_rollup_compaction()
+    yield
+    warming.cancel()
+    await stop_rollup_compaction()
+    await stop_pool_workers()
+    await usage_writer.stop()   # flush des logs en file
+    await close_http_client()
+    await dispose_engines()
 
-# Créer les tables automatiquement au démarrage
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="Lexora API",
@@ -18,15 +49,23 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
+    lifespan=lifespan,
 )
 
+# Limitation de débit sous CORS : les 429 portent les en-têtes CORS
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.origins_list,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "Retry-After", "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy",
+    ],
 )
+# Ajouté en dernier : englobe les autres middlewares
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(generate.router)
@@ -35,21 +74,33 @@ app.include_router(admin.router)
 
 @app.get("/api/health")
 def health():
+    """Liveness : le process répond, sans dépendance externe."""
     return {"status": "ok", "version": "1.0.0"}
 
 
-@app.get("/api/init-db")
-def init_db():
-    """Route temporaire pour initialiser la DB et créer le premier admin."""
-    try:
-        Base.metadata.create_all(bind=engine)
-        return {"status": "Tables créées avec succès"}
-    except Exception as e:
-        return {"error": str(e)}
+@app.get("/api/ready")
+async def ready():
+    """Readiness : la base répond (503 pendant le préchauffage ou une panne)."""
+    ok, detail = await readiness()
+    return JSONResponse(status_code=200 if ok else 503, content=detail)
+
+
+@app.get("/api/metrics", include_in_schema=False)
+def prometheus_metrics(request: Request):
+    """Métriques Prometheus ; protégées par METRICS_TOKEN (Bearer) s'il est défini."""
+    if settings.metrics_token:
+        expected = f"Bearer {settings.metrics_token}"
+        if not secrets.compare_digest(request.headers.get("authorization", ""), expected):
+            return JSONResponse(status_code=401, content={"detail": "Token de métriques invalide"})
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
+    # Réponse générique pour le client, mais l'erreur reste visible côté serveur
+    route = metrics.route_label(request.scope)
+    metrics.UNHANDLED_ERRORS.inc(route=route)
+    logger.exception("Erreur non gérée sur %s %s", request.method, route, exc_info=exc)
     return JSONResponse(
         status_code=500,
         content={"detail": "Erreur interne du serveur"},
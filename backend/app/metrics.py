@@ -0,0 +1,290 @@
+"""
+Métriques Prometheus exposées par GET /api/metrics (format texte 0.0.4).
+
+Compteurs, jauges et histogrammes en mémoire, propres au process ; les étiquettes
+sont déclarées avec la métrique. Points d'instrumentation :
+- MetricsMiddleware (main.py) : latence des requêtes par route ;
+- claude_service : latence et tokens Gemini par action, erreurs upstream ;
+- quota : refus (quota journalier, budgets de tokens) ;
+- ratelimit : refus de la limitation de débit, par politique et clé ;
+- pool : profondeur par bucket, relevée à chaque lecture des profondeurs
+  (passage du planificateur, recharge, /api/admin/pool) ;
+- auth : durée de bcrypt (file d'attente du pool de threads comprise) ;
+- database : temps SQL par étape (auth, quota, log, voir db_stage) via les
+  événements SQLAlchemy, et attente d'une connexion du pool.
+"""
+import bisect
+import functools
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+_registry: list = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels.get(name, "") for name in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(zip(self.labels, key))} {_number(value)}")
+        return lines
+
+
+class Gauge:
+    """Valeur instantanée ; replace() remplace toutes les séries (buckets disparus compris)."""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[tuple(labels.get(name, "") for name in self.labels)] = value
+
+    def replace(self, values: dict[tuple, float]) -> None:
+        self._values = dict(values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(zip(self.labels, key))} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets) + (math.inf,)
+        # étiquettes → [compte par bucket…, somme]
+        self._series: dict[tuple, list[float]] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels.get(name, "") for name in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for le, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(
+                    f"{self.name}_bucket{_labels(pairs + [('le', _number(le))])} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(pairs)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+# ── Métriques ────────────────────────────────────────────────────────────
+
+REQUEST_LATENCY = Histogram(
+    "lexora_http_request_duration_seconds",
+    "Durée des requêtes HTTP par route (réponse complète, flux SSE compris).",
+    ("method", "route", "status"),
+)
+UNHANDLED_ERRORS = Counter(
+    "lexora_http_unhandled_errors_total",
+    "Exceptions non gérées (réponse 500), par route.",
+    ("route",),
+)
+UPSTREAM_LATENCY = Histogram(
+    "lexora_upstream_duration_seconds",
+    "Durée des appels Gemini réussis (retries compris), par action et modèle.",
+    ("action", "model", "mode"),
+)
+UPSTREAM_TOKENS = Histogram(
+    "lexora_upstream_tokens",
+    "Tokens facturés par appel Gemini (usageMetadata.totalTokenCount), par action.",
+    ("action",),
+    buckets=TOKEN_BUCKETS,
+)
+UPSTREAM_ERRORS = Counter(
+    "lexora_upstream_errors_total",
+    "Tentatives Gemini en échec, par action et motif (statut HTTP, network, circuit_open).",
+    ("action", "reason"),
+)
+QUOTA_REJECTIONS = Counter(
+    "lexora_quota_rejections_total",
+    "Réservations refusées (429), par motif.",
+    ("reason",),
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "lexora_rate_limit_rejections_total",
+    "Requêtes refusées (429) par la limitation de débit, par politique et clé (ip, email, user).",
+    ("policy", "key"),
+)
+POOL_DEPTH = Gauge(
+    "lexora_pool_depth",
+    "Exercices pré-générés en stock, par bucket (action, thème, niveau).",
+    ("action", "theme", "level"),
+)
+EXPORTED_ROWS = Counter(
+    "lexora_usage_export_rows_total",
+    "Lignes de usage_logs exportées par GET /api/admin/export/usage, par format.",
+    ("format",),
+)
+DB_QUERY_TIME = Histogram(
+    "lexora_db_query_duration_seconds",
+    "Durée des requêtes SQL, par étape (auth, quota, log, ratelimit, other).",
+    ("stage",),
+    buckets=DB_BUCKETS,
+)
+DB_POOL_WAIT = Histogram(
+    "lexora_db_pool_wait_seconds",
+    "Attente d'une connexion du pool SQLAlchemy (ouverture comprise).",
+    buckets=DB_BUCKETS,
+)
+BCRYPT_TIME = Histogram(
+    "lexora_bcrypt_duration_seconds",
+    "Durée de bcrypt par opération, attente du pool de threads comprise.",
+    ("op",),
+)
+
+
+# ── Étapes SQL ───────────────────────────────────────────────────────────
+
+_stage: ContextVar[str] = ContextVar("db_stage", default="other")
+
+
+@contextmanager
+def db_stage(name: str):
+    """Attribue les requêtes SQL exécutées dans le bloc à l'étape `name`."""
+    token = _stage.set(name)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+
+def staged(name: str):
+    """Décorateur : db_stage(name) autour d'une coroutine."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with db_stage(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    DB_QUERY_TIME.observe(
+        time.perf_counter() - conn.info["query_start"].pop(), stage=_stage.get()
+    )
+
+
+def _handle_error(context):
+    # Requête en échec : pas d'after_cursor_execute, on dépile quand même
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+def instrument_engine(sync_engine) -> None:
+    """Branche le chronométrage des requêtes sur un moteur (sync_engine pour l'async)."""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+# ── Middleware ───────────────────────────────────────────────────────────
+
+class MetricsMiddleware:
+    """Middleware ASGI : durée de chaque requête, étiquetée par le template de route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=route_label(scope),
+                status=str(status),
+            )
+
+
+def route_label(scope) -> str:
+    """Template de la route (/api/admin/users/{user_id}) : cardinalité bornée."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
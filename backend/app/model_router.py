@@ -0,0 +1,120 @@
+"""
+Routage des modèles Gemini par action et requêtes couvertes (hedging).
+
+Chaque action est servie par le modèle configuré dans `gemini_model_routes`
+(défaut : `gemini_default_model`). Le routeur tient un histogramme de latence
+par modèle ; quand assez d'échantillons existent, un appel qui n'a pas
+répondu après le p95 observé déclenche une seconde requête identique, et la
+première réponse valide l'emporte (l'autre est annulée).
+"""
+import asyncio
+import bisect
+import math
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+from .config import get_settings
+
+T = TypeVar("T")
+
+# Bornes supérieures des buckets de l'histogramme (ms)
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, math.inf)
+
+
+class LatencyHistogram:
+    """Histogramme cumulatif + fenêtre glissante des derniers appels pour les quantiles."""
+
+    def __init__(self, window: int = 512):
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.total = 0
+        self.sum_ms = 0.0
+        self._recent: deque[float] = deque(maxlen=window)
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.total += 1
+        self.sum_ms += ms
+        self._recent.append(ms)
+
+    def quantile(self, q: float) -> float | None:
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def samples(self) -> int:
+        return len(self._recent)
+
+    def stats(self) -> dict:
+        p50, p95 = self.quantile(0.50), self.quantile(0.95)
+        return {
+            "count": self.total,
+            "mean_ms": round(self.sum_ms / self.total, 1) if self.total else None,
+            "p50_ms": round(p50, 1) if p50 is not None else None,
+            "p95_ms": round(p95, 1) if p95 is not None else None,
+            "buckets": {
+                ("+Inf" if math.isinf(le) else str(le)): n
+                for le, n in zip(LATENCY_BUCKETS_MS, self.counts)
+            },
+        }
+
+
+class ModelRouter:
+    def __init__(self):
+        self.histograms: dict[str, LatencyHistogram] = {}
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def model_for(self, action: str | None) -> str:
+        settings = get_settings()
+        return settings.model_routes_map.get(action, settings.gemini_default_model)
+
+    def observe(self, model: str, ms: float) -> None:
+        self.histograms.setdefault(model, LatencyHistogram()).observe(ms)
+
+    def hedge_delay(self, model: str) -> float | None:
+        """Délai (s) avant la requête couverte, ou None (hedging off / pas assez d'échantillons)."""
+        settings = get_settings()
+        hist = self.histograms.get(model)
+        if not settings.hedge_enabled or hist is None or hist.samples < settings.hedge_min_samples:
+            return None
+        return max(hist.quantile(0.95), settings.hedge_min_delay_ms) / 1000
+
+    async def hedged(self, model: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Lance fn() ; si pas de réponse après le p95 du modèle, relance et garde la première."""
+        delay = self.hedge_delay(model)
+        primary = asyncio.ensure_future(fn())
+        if delay is None:
+            return await primary
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges += 1
+                tasks.add(asyncio.ensure_future(fn()))
+            first_error: BaseException | None = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        settings = get_settings()
+        return {
+            "routes": {"default": settings.gemini_default_model, **settings.model_routes_map},
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency": {model: h.stats() for model, h in sorted(self.histograms.items())},
+        }
+
+
+model_router = ModelRouter()
@@ -1,7 +1,7 @@
 from datetime import datetime, date
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime,
-    Date, ForeignKey, Text, Enum as SAEnum
+    Column, Integer, BigInteger, String, Boolean, DateTime,
+    Date, ForeignKey, Text, Index, Enum as SAEnum
 )
 from sqlalchemy.orm import relationship, DeclarativeBase
 import enum
@@ -26,20 +26,123 @@ class User(Base):
     role           = Column(SAEnum(UserRole), default=UserRole.user, nullable=False)
     is_active      = Column(Boolean, default=True)
     daily_quota    = Column(Integer, default=50)   # max générations / jour
+    daily_token_budget   = Column(Integer, nullable=True)   # None = valeur par défaut (Settings)
+    monthly_token_budget = Column(Integer, nullable=True)
+    token_version  = Column(Integer, default=0, server_default="0", nullable=False)  # claim "ver" des JWT
     created_at     = Column(DateTime, default=datetime.utcnow)
 
     usage_logs = relationship("UsageLog", back_populates="user", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_users_created_at_id", "created_at", "id"),   # pagination admin
+    )
+
 
 class UsageLog(Base):
+    """
+    Journal d'usage ; partitionné par mois de created_at sur Postgres (voir
+    partitions.py). La clé primaire (id, created_at) est celle de la table
+    partitionnée (migration 0008). Sur SQLite, la table créée par les
+    migrations Alembic garde id seul comme clé (INTEGER PRIMARY KEY, auto-
+    incrémenté) : le schéma vient toujours d'Alembic, un create_all depuis ce
+    modèle donnerait une clé composite sans auto-incrément.
+    """
     __tablename__ = "usage_logs"
 
-    id           = Column(Integer, primary_key=True, index=True)
+    id           = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id      = Column(Integer, ForeignKey("users.id"), nullable=False)
     action       = Column(String(50), nullable=False)   # writing|fill|reading|flashcards|correct_writing
     tokens_used  = Column(Integer, default=0)
     log_date     = Column(Date, default=date.today)
-    created_at   = Column(DateTime, default=datetime.utcnow)
+    created_at   = Column(DateTime, primary_key=True, default=datetime.utcnow)   # clé de partition
     extra        = Column(Text, nullable=True)           # JSON optionnel (thème, niveau…)
 
     user = relationship("User", back_populates="usage_logs")
+
+    __table_args__ = (
+        Index("ix_usage_logs_user_date_action", "user_id", "log_date", "action"),
+        Index("ix_usage_logs_log_date", "log_date"),   # compaction des rollups
+        Index("ix_usage_logs_user_created", user_id, created_at.desc()),   # logs d'un utilisateur (admin)
+    )
+
+
+class DailyUsageCounter(Base):
+    """Compteur journalier par utilisateur, mis à jour par upsert à chaque log."""
+    __tablename__ = "daily_usage_counters"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day     = Column(Date, primary_key=True)
+    count   = Column(Integer, nullable=False, default=0)   # générations comptées dans le quota
+    tokens  = Column(Integer, nullable=False, default=0)   # estimation réservée, corrigée après l'appel
+
+
+class MonthlyUsageCounter(Base):
+    """Tokens consommés par utilisateur et par mois (budget mensuel)."""
+    __tablename__ = "monthly_usage_counters"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    month   = Column(Date, primary_key=True)   # 1er du mois
+    tokens  = Column(BigInteger, nullable=False, default=0)
+
+
+class GlobalUsageCounter(Base):
+    """
+    Tokens consommés par toute l'application, par jour et par mois, répartis
+    sur GLOBAL_COUNTER_SHARDS lignes (user_id % n) : total = somme des shards.
+    """
+    __tablename__ = "global_usage_counters"
+
+    granularity  = Column(String(5), primary_key=True)   # day | month
+    period_start = Column(Date, primary_key=True)
+    shard        = Column(Integer, primary_key=True, default=0)
+    tokens       = Column(BigInteger, nullable=False, default=0)
+
+
+class GenerationCache(Base):
+    """Réponses Gemini mises en cache (plusieurs variantes par clé)."""
+    __tablename__ = "generation_cache"
+
+    id           = Column(Integer, primary_key=True, index=True)
+    cache_key    = Column(String(64), index=True, nullable=False)   # sha256 du prompt
+    action       = Column(String(50), nullable=False)
+    payload      = Column(Text, nullable=False)
+    created_at   = Column(DateTime, default=datetime.utcnow)
+    expires_at   = Column(DateTime, nullable=False)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class PooledExercise(Base):
+    """Exercice pré-généré, prêt à être servi (consommé une seule fois)."""
+    __tablename__ = "exercise_pool"
+
+    id          = Column(Integer, primary_key=True, index=True)
+    action      = Column(String(50), nullable=False)
+    theme       = Column(String(255), nullable=False)
+    level       = Column(String(20), nullable=False)
+    payload     = Column(Text, nullable=False)               # JSON déjà validé
+    tokens_used = Column(Integer, default=0)
+    created_at  = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_exercise_pool_bucket", "action", "theme", "level", "id"),
+    )
+
+
+class UsageDailyRollup(Base):
+    """Agrégats journaliers par action, pour le dashboard admin (sans scan des logs)."""
+    __tablename__ = "usage_daily_rollup"
+
+    day            = Column(Date, primary_key=True)
+    action         = Column(String(50), primary_key=True)
+    calls          = Column(Integer, nullable=False, default=0)
+    tokens         = Column(Integer, nullable=False, default=0)
+    distinct_users = Column(Integer, nullable=False, default=0)
+
+
+class RateLimitCounter(Base):
+    """Compteur de requêtes par clé et fenêtre fixe (limitation de débit partagée)."""
+    __tablename__ = "rate_limit_counters"
+
+    key          = Column(String(255), primary_key=True)    # règle + ip / email / user id
+    window_start = Column(BigInteger, primary_key=True)     # epoch (s), multiple de la fenêtre
+    count        = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,75 @@
+"""
+Partitions mensuelles de usage_logs (Postgres uniquement).
+
+Sur Postgres, usage_logs est partitionnée par plage de created_at (migration
+0008) : une table usage_logs_AAAA_MM par mois, plus usage_logs_default qui
+reçoit ce qui ne tombe dans aucune (elle doit rester vide). Les requêtes
+filtrées sur created_at ne lisent que les partitions concernées, et
+l'archivage (archive_logs.py) détache et supprime un mois entier d'un coup.
+
+La boucle de maintenance (rollups) crée à l'avance les partitions des
+`usage_log_partitions_ahead` prochains mois. Sur SQLite, rien à faire : la
+table n'est pas partitionnée.
+"""
+import re
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+from .config import get_settings
+from .database import get_async_engine
+
+_PARTITION_NAME = re.compile(r"^usage_logs_(\d{4})_(\d{2})$")
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"usage_logs_{month:%Y_%m}"
+
+
+def partition_month(name: str) -> date | None:
+    """Mois d'une partition d'après son nom (None pour usage_logs_default)."""
+    match = _PARTITION_NAME.match(name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+
+def create_partition_sql(month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF usage_logs "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+LIST_PARTITIONS_SQL = text(
+    "SELECT c.relname FROM pg_inherits i "
+    "JOIN pg_class c ON c.oid = i.inhrelid "
+    "JOIN pg_class p ON p.oid = i.inhparent "
+    "WHERE p.relname = 'usage_logs'"
+)
+
+
+async def ensure_partitions(ahead: int | None = None) -> list[str]:
+    """Crée les partitions du mois courant et des `ahead` suivants ; retourne celles créées."""
+    engine = get_async_engine()
+    if engine.dialect.name != "postgresql":
+        return []
+    if ahead is None:
+        ahead = get_settings().usage_log_partitions_ahead
+    current = month_start(datetime.utcnow().date())
+    async with engine.begin() as conn:
+        existing = set((await conn.execute(LIST_PARTITIONS_SQL)).scalars())
+        created = []
+        for n in range(ahead + 1):
+            month = add_months(current, n)
+            if partition_name(month) not in existing:
+                await conn.execute(text(create_partition_sql(month)))
+                created.append(partition_name(month))
+    return created
@@ -0,0 +1,198 @@
+"""
+Pool d'exercices pré-générés.
+
+Un planificateur regarde la demande récente (UsageLog) par bucket
+(action, thème, niveau) et met en file les buckets populaires dont la
+profondeur est passée sous `pool_low_water`. Des workers asyncio les
+rechargent jusqu'à `pool_high_water`. Les routes de génération prennent
+un exercice dans le pool et ne génèrent en direct qu'en cas de pool vide.
+"""
+import asyncio
+import json
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+
+from .config import get_settings
+from .database import AsyncSessionLocal
+from .metrics import POOL_DEPTH
+from .models import PooledExercise, UsageLog
+from .prompts import build_exercise
+from .claude_service import call_claude
+from .structured import parse_response
+
+logger = logging.getLogger(__name__)
+
+Bucket = tuple[str, str, str]   # (action, thème, niveau)
+
+_stats = {"served": 0, "misses": 0, "generated": 0, "generation_errors": 0, "tokens_spent": 0}
+_queue: asyncio.Queue | None = None
+_queued: set[Bucket] = set()
+_tasks: list[asyncio.Task] = []
+
+
+async def take(action: str, theme: str, level: str) -> tuple[dict | list, int] | None:
+    """
+    Retire le plus ancien exercice du bucket et retourne (résultat, tokens),
+    ou None si le bucket est vide. Lecture sur l'index (action, theme, level, id).
+    """
+    async with AsyncSessionLocal() as db:
+        for _ in range(3):
+            row = (
+                await db.execute(
+                    select(PooledExercise.id, PooledExercise.payload, PooledExercise.tokens_used)
+                    .where(
+                        PooledExercise.action == action,
+                        PooledExercise.theme == theme,
+                        PooledExercise.level == level,
+                    )
+                    .order_by(PooledExercise.id)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                )
+            ).first()
+            if row is None:
+                break
+            deleted = await db.execute(
+                delete(PooledExercise).where(PooledExercise.id == row.id)
+            )
+            await db.commit()
+            # Un autre worker a pu consommer la ligne entre-temps : on réessaie
+            if deleted.rowcount:
+                _stats["served"] += 1
+                return json.loads(row.payload), row.tokens_used or 0
+        _stats["misses"] += 1
+        return None
+
+
+async def depths() -> dict[Bucket, int]:
+    async with AsyncSessionLocal() as db:
+        rows = (
+            await db.execute(
+                select(
+                    PooledExercise.action, PooledExercise.theme, PooledExercise.level,
+                    func.count(PooledExercise.id),
+                )
+                .group_by(PooledExercise.action, PooledExercise.theme, PooledExercise.level)
+            )
+        ).all()
+    current = {(a, t, l): n for a, t, l, n in rows}
+    POOL_DEPTH.replace(current)
+    return current
+
+
+async def popular_buckets() -> list[Bucket]:
+    """Buckets les plus demandés sur la fenêtre récente (d'après UsageLog.extra)."""
+    settings = get_settings()
+    actions = settings.pool_actions_list
+    since = datetime.utcnow() - timedelta(hours=settings.pool_demand_window_hours)
+    async with AsyncSessionLocal() as db:
+        rows = (
+            await db.execute(
+                select(UsageLog.action, UsageLog.extra)
+                .where(UsageLog.created_at >= since, UsageLog.action.in_(actions))
+            )
+        ).all()
+
+    demand: Counter[Bucket] = Counter()
+    for action, extra in rows:
+        try:
+            meta = json.loads(extra or "")
+        except ValueError:
+            continue   # anciens logs : thème brut, sans niveau
+        if isinstance(meta, dict) and meta.get("theme") and meta.get("level"):
+            demand[(action, meta["theme"], meta["level"])] += 1
+    return [
+        bucket for bucket, n in demand.most_common(settings.pool_max_buckets)
+        if n >= settings.pool_min_demand
+    ]
+
+
+async def refill(bucket: Bucket) -> int:
+    """Recharge un bucket jusqu'au high-water. Retourne le nombre d'exercices ajoutés."""
+    settings = get_settings()
+    action, theme, level = bucket
+    missing = settings.pool_high_water - (await depths()).get(bucket, 0)
+    added = 0
+    for _ in range(max(0, missing)):
+        system, user, max_tokens = build_exercise(action, theme, level)
+        try:
+            # Pas de coalescence : chaque exercice du bucket doit être différent
+            text, tokens, _ = await call_claude(
+                system, user, max_tokens=max_tokens, action=action, coalesce=False
+            )
+            result = parse_response(action, text)
+        except Exception as exc:
+            _stats["generation_errors"] += 1
+            logger.warning("Pool: échec de génération pour %s: %s", bucket, exc)
+            break
+        async with AsyncSessionLocal() as db:
+            db.add(PooledExercise(
+                action=action, theme=theme, level=level,
+                payload=json.dumps(result, ensure_ascii=False),
+                tokens_used=tokens,
+            ))
+            await db.commit()
+        added += 1
+        _stats["generated"] += 1
+        _stats["tokens_spent"] += tokens
+    return added
+
+
+async def _planner() -> None:
+    settings = get_settings()
+    while True:
+        try:
+            current = await depths()
+            for bucket in await popular_buckets():
+                if current.get(bucket, 0) < settings.pool_low_water and bucket not in _queued:
+                    _queued.add(bucket)
+                    _queue.put_nowait(bucket)
+        except Exception as exc:
+            logger.warning("Pool: planification impossible: %s", exc)
+        await asyncio.sleep(settings.pool_refill_interval_seconds)
+
+
+async def _worker() -> None:
+    while True:
+        bucket = await _queue.get()
+        try:
+            await refill(bucket)
+        except Exception as exc:
+            logger.warning("Pool: recharge impossible pour %s: %s", bucket, exc)
+        finally:
+            _queued.discard(bucket)
+            _queue.task_done()
+
+
+async def start_pool_workers() -> None:
+    global _queue
+    settings = get_settings()
+    if not settings.pool_enabled or _tasks:
+        return
+    _queue = asyncio.Queue()
+    _tasks.append(asyncio.create_task(_planner()))
+    for _ in range(settings.pool_workers):
+        _tasks.append(asyncio.create_task(_worker()))
+
+
+async def stop_pool_workers() -> None:
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    _queued.clear()
+
+
+async def pool_stats() -> dict:
+    current = await depths()
+    return {
+        **_stats,
+        "queued_buckets": len(_queued),
+        "depth": [
+            {"action": a, "theme": t, "level": l, "depth": n}
+            for (a, t, l), n in sorted(current.items())
+        ],
+    }
@@ -0,0 +1,224 @@
+"""
+Prompts Gemini par type d'exercice : registre de templates versionnés.
+
+Chaque template (id, version) porte le prompt système, le prompt utilisateur
+(champs `{theme}`, `{level}`… façon str.format) et max_tokens. Plusieurs
+versions d'un même template peuvent coexister : la plus récente est active,
+sauf version épinglée dans `prompt_template_versions`. compile_templates()
+(appelé au démarrage) vérifie et découpe chaque template une fois pour toutes ;
+l'id et la version actifs sont enregistrés dans UsageLog.extra (template_meta).
+
+Chaque builder retourne (prompt_système, prompt_utilisateur, max_tokens).
+"""
+from string import Formatter
+
+from .config import get_settings
+
+
+class PromptTemplate:
+    def __init__(self, id: str, version: int, system: str, user: str, max_tokens: int):
+        self.id = id
+        self.version = version
+        self.system = system
+        self.user = user
+        self.max_tokens = max_tokens
+        self._parts: list[tuple[str, str | None]] = []
+        self.fields: frozenset[str] = frozenset()
+
+    def compile(self) -> None:
+        """Découpe le prompt utilisateur en (texte, champ) ; lève ValueError si invalide."""
+        parts = []
+        for literal, name, spec, conversion in Formatter().parse(self.user):
+            if name is not None and (not name.isidentifier() or spec or conversion):
+                raise ValueError(f"Template {self.ref} : champ invalide {{{name}}}")
+            parts.append((literal, name))
+        self._parts = parts
+        self.fields = frozenset(name for _, name in parts if name)
+
+    def render(self, **values: str) -> tuple[str, str, int]:
+        if not self._parts:
+            self.compile()
+        user = "".join(
+            literal + (str(values[name]) if name else "") for literal, name in self._parts
+        )
+        return self.system, user, self.max_tokens
+
+    @property
+    def ref(self) -> str:
+        return f"{self.id}@v{self.version}"
+
+
+# ── Templates ────────────────────────────────────────────────────────────
+# Nouvelle formulation = nouvelle version (les anciennes restent épinglables)
+
+TEMPLATES = [
+    PromptTemplate(
+        "writing_topic", 1,
+        system="You are an English language teacher. Always respond in valid JSON only, no markdown, no extra text.",
+        user='Generate a writing prompt for level {level} on the theme "{theme}". '
+        'Return JSON: {{"prompt": "the full writing prompt in English (2-3 sentences)", '
+        '"hints": ["hint1","hint2","hint3"], "min_words": number}}',
+        max_tokens=1200,
+    ),
+    PromptTemplate(
+        "correct_writing", 1,
+        system="You are an expert English teacher. Respond only with valid JSON, no markdown.",
+        user='Correct this {level} level writing. Prompt: "{prompt}"\n'
+        'Student text: "{text}"\n'
+        'Return JSON: {{'
+        '"score": number (0-100), "grammar_score": number (0-100), '
+        '"vocabulary_score": number (0-100), "coherence_score": number (0-100), '
+        '"strengths": ["strength1","strength2"], '
+        '"improvements": ["improvement1","improvement2","improvement3"], '
+        '"corrected_sentences": [{{"original":"...","corrected":"...","explanation":"..."}}], '
+        '"overall_comment": "encouraging overall comment in French"}}',
+        max_tokens=1500,
+    ),
+    PromptTemplate(
+        "fill_blanks", 1,
+        system="You are an English language teacher. Respond only with valid JSON, no markdown.",
+        user='Create 7 fill-in-the-blank sentences for level {level} focusing on {theme}. '
+        'Return JSON array: [{{"sentence":"The sentence with ___ for the blank",'
+        '"answer":"correct word or phrase","explanation":"why this is correct in French"}}] '
+        'Make sentences varied and natural.',
+        max_tokens=1200,
+    ),
+    PromptTemplate(
+        "reading", 1,
+        system="You are an English teacher creating reading comprehension exercises. Respond only with valid JSON, no markdown.",
+        user='Create a reading comprehension exercise about "{theme}" at level {level}. '
+        'Return JSON: {{"title":"article title","text":"article text (200-280 words, level {level})",'
+        '"questions":[{{"q":"question in English","options":["A","B","C","D"],"answer":number(0-3 index)}}]}} '
+        'Create exactly 4 questions.',
+        max_tokens=1500,
+    ),
+    PromptTemplate(
+        "flashcards", 1,
+        system="You are an English vocabulary teacher. Respond only with valid JSON, no markdown.",
+        user='Generate 10 flashcards for the theme "{theme}" at level {level}. '
+        'Return JSON array: [{{"word":"English word","pos":"noun/verb/etc","translation":"French translation",'
+        '"example":"example sentence in English","mnemonic":"memory tip in French or empty string"}}] '
+        'Make vocabulary authentic and useful for level {level}.',
+        max_tokens=1200,
+    ),
+    PromptTemplate(
+        # Enveloppe des appels groupés : le prompt système est celui de l'exercice
+        "packed_tasks", 1,
+        system="",
+        user="Complete the following {count} independent tasks. "
+        "Return a single JSON array with exactly {count} elements: element i is "
+        "the JSON answer to task i, in order.\n\n{tasks}",
+        max_tokens=0,
+    ),
+]
+
+# Champs attendus par template (vérifiés à la compilation)
+TEMPLATE_FIELDS = {
+    "writing_topic": {"theme", "level"},
+    "correct_writing": {"prompt", "text", "level"},
+    "fill_blanks": {"theme", "level"},
+    "reading": {"theme", "level"},
+    "flashcards": {"theme", "level"},
+    "packed_tasks": {"count", "tasks"},
+}
+
+# Action (UsageLog, cache, pool) → template
+ACTION_TEMPLATES = {
+    "writing_generate": "writing_topic",
+    "writing_correct": "correct_writing",
+    "fill_generate": "fill_blanks",
+    "reading_generate": "reading",
+    "flashcards_generate": "flashcards",
+}
+
+_active: dict[str, PromptTemplate] = {}
+
+
+def compile_templates() -> None:
+    """Compile tous les templates et fige la version active de chacun (ValueError si incohérent)."""
+    versions: dict[str, dict[int, PromptTemplate]] = {}
+    for tpl in TEMPLATES:
+        tpl.compile()
+        if tpl.fields != TEMPLATE_FIELDS.get(tpl.id):
+            raise ValueError(f"Template {tpl.ref} : champs {sorted(tpl.fields)} inattendus")
+        if tpl.version in versions.setdefault(tpl.id, {}):
+            raise ValueError(f"Template {tpl.ref} défini deux fois")
+        versions[tpl.id][tpl.version] = tpl
+
+    pinned = get_settings().prompt_versions_map
+    active = {}
+    for template_id, by_version in versions.items():
+        version = pinned.get(template_id, max(by_version))
+        if version not in by_version:
+            raise ValueError(f"Version épinglée inconnue : {template_id}@v{version}")
+        active[template_id] = by_version[version]
+    unknown = set(pinned) - set(active)
+    if unknown:
+        raise ValueError(f"Templates épinglés inconnus : {', '.join(sorted(unknown))}")
+    _active.clear()
+    _active.update(active)
+
+
+def template(template_id: str) -> PromptTemplate:
+    if not _active:
+        compile_templates()
+    return _active[template_id]
+
+
+def template_meta(action: str) -> dict:
+    """Champs UsageLog.extra identifiant le template utilisé pour l'action."""
+    tpl = template(ACTION_TEMPLATES[action])
+    return {"template": tpl.id, "template_version": tpl.version}
+
+
+def active_templates() -> dict[str, int]:
+    if not _active:
+        compile_templates()
+    return {template_id: tpl.version for template_id, tpl in sorted(_active.items())}
+
+
+# ── Builders ─────────────────────────────────────────────────────────────
+
+def writing_topic(theme: str, level: str) -> tuple[str, str, int]:
+    return template("writing_topic").render(theme=theme, level=level)
+
+
+def correct_writing(prompt: str, text: str, level: str) -> tuple[str, str, int]:
+    return template("correct_writing").render(prompt=prompt, text=text, level=level)
+
+
+def fill_blanks(theme: str, level: str) -> tuple[str, str, int]:
+    return template("fill_blanks").render(theme=theme, level=level)
+
+
+def reading(theme: str, level: str) -> tuple[str, str, int]:
+    return template("reading").render(theme=theme, level=level)
+
+
+def flashcards(theme: str, level: str) -> tuple[str, str, int]:
+    return template("flashcards").render(theme=theme, level=level)
+
+
+# Exercices paramétrés uniquement par (thème, niveau) : cache et pool possibles
+EXERCISE_PROMPTS = {
+    "writing_generate": writing_topic,
+    "fill_generate": fill_blanks,
+    "reading_generate": reading,
+    "flashcards_generate": flashcards,
+}
+
+
+def build_exercise(action: str, theme: str, level: str) -> tuple[str, str, int]:
+    return EXERCISE_PROMPTS[action](theme, level)
+
+
+def packed_exercises(action: str, items: list[tuple[str, str]]) -> tuple[str, str, int]:
+    """
+    Plusieurs exercices du même type en un seul appel : le prompt système est
+    commun, chaque consigne est numérotée et la réponse est un tableau JSON
+    (un élément par consigne, dans l'ordre).
+    """
+    built = [build_exercise(action, theme, level) for theme, level in items]
+    tasks = "\n\n".join(f"### Task {i + 1}\n{user}" for i, (_, user, _) in enumerate(built))
+    _, user, _ = template("packed_tasks").render(count=len(built), tasks=tasks)
+    return built[0][0], user, sum(max_tokens for _, _, max_tokens in built)
@@ -1,64 +1,366 @@
+"""
+Quota journalier de générations et budgets de tokens.
+
+Deux dimensions, vérifiées ensemble à la réservation (avant l'appel upstream),
+uniquement par lectures/écritures de compteurs par clé primaire :
+- le nombre de générations du jour (daily_usage_counters.count) ;
+- les tokens du jour et du mois, par utilisateur et pour toute l'application
+  (daily_usage_counters.tokens, monthly_usage_counters, global_usage_counters).
+  La réservation compte une estimation (prompt + max_tokens), corrigée au
+  commit avec le total réel de usageMetadata, ou rendue si l'appel échoue.
+
+Les compteurs globaux sont répartis sur GLOBAL_COUNTER_SHARDS lignes
+(user_id % n) pour que les réservations de deux utilisateurs ne se
+sérialisent pas sur un même verrou. Leur budget est donc vérifié sans verrou
+(somme des shards lue avant la réservation) : des réservations simultanées
+peuvent le dépasser au plus de leurs estimations en vol.
+"""
 from datetime import date
+
+import anyio
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select, update
 
-from .models import User, UsageLog
+from .config import get_settings
+from .database import dialect_insert
+from .metrics import QUOTA_REJECTIONS, staged
+from .models import DailyUsageCounter, MonthlyUsageCounter, GlobalUsageCounter
+from .usage_writer import record_usage, usage_row
+from .schemas import AuthUser
 
+# Actions décomptées du quota journalier
+QUOTA_ACTIONS = {
+    "writing_generate", "fill_generate",
+    "reading_generate", "flashcards_generate",
+    "writing_correct",
+}
 
-def get_usage_today(db: Session, user_id: int) -> int:
-    """Nombre de générations effectuées aujourd'hui par l'utilisateur."""
-    return (
-        db.query(func.count(UsageLog.id))
-        .filter(
-            UsageLog.user_id == user_id,
-            UsageLog.log_date == date.today(),
-            UsageLog.action.in_([
-                "writing_generate", "fill_generate",
-                "reading_generate", "flashcards_generate",
-                "writing_correct",
-            ]),
+
+# Portée du budget (message) → motif de la métrique de refus
+_REJECTION_REASONS = {
+    "journalier": "daily_tokens",
+    "mensuel": "monthly_tokens",
+    "global journalier": "global_daily_tokens",
+    "global mensuel": "global_monthly_tokens",
+}
+
+
+def _quota_exceeded(user: AuthUser) -> HTTPException:
+    QUOTA_REJECTIONS.inc(reason="daily_quota")
+    return HTTPException(
+        status_code=429,
+        detail=f"Quota journalier atteint ({user.daily_quota} générations/jour). "
+               f"Réessaie demain ou contacte un administrateur.",
+    )
+
+
+async def bump_counter(
+    db: AsyncSession, user_id: int, day: date, calls: int, tokens: int
+) -> None:
+    """Upsert atomique de daily_usage_counters (ON CONFLICT DO UPDATE)."""
+    stmt = dialect_insert(db)(DailyUsageCounter).values(
+        user_id=user_id, day=day, count=calls, tokens=tokens
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DailyUsageCounter.user_id, DailyUsageCounter.day],
+        set_={
+            "count": DailyUsageCounter.count + stmt.excluded.count,
+            "tokens": DailyUsageCounter.tokens + stmt.excluded.tokens,
+        },
+    )
+    await db.execute(stmt)
+
+
+def _budget_exceeded(scope: str) -> HTTPException:
+    QUOTA_REJECTIONS.inc(reason=_REJECTION_REASONS[scope])
+    return HTTPException(
+        status_code=429,
+        detail=f"Budget de tokens {scope} atteint. "
+               f"Réessaie plus tard ou contacte un administrateur.",
+    )
+
+
+def token_budgets(user: AuthUser) -> tuple[int, int]:
+    """Budgets (jour, mois) de l'utilisateur ; 0 = illimité (défaut des admins)."""
+    settings = get_settings()
+    if user.role == "admin":
+        default_daily = default_monthly = 0
+    else:
+        default_daily = settings.default_daily_token_budget
+        default_monthly = settings.default_monthly_token_budget
+    daily = user.daily_token_budget if user.daily_token_budget is not None else default_daily
+    monthly = user.monthly_token_budget if user.monthly_token_budget is not None else default_monthly
+    return daily, monthly
+
+
+async def _charge(db: AsyncSession, table, keys: dict, tokens: int, budget: int) -> bool:
+    """Upsert `tokens += n` si le budget le permet (0 = illimité). False si dépassé."""
+    if budget and tokens > budget:
+        return False
+    stmt = dialect_insert(db)(table).values(**keys, tokens=tokens)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={"tokens": table.tokens + tokens},
+        where=(table.tokens + tokens <= budget) if budget else None,
+    )
+    return (await db.execute(stmt)).rowcount == 1
+
+
+def _global_keys(user_id: int, granularity: str, start: date) -> dict:
+    """Clé du shard de compteur global où écrit cet utilisateur."""
+    shard = user_id % max(1, get_settings().global_counter_shards)
+    return {"granularity": granularity, "period_start": start, "shard": shard}
+
+
+async def global_tokens(db: AsyncSession, today: date | None = None) -> dict[str, int]:
+    """Tokens consommés par l'application ce jour et ce mois (somme des shards)."""
+    today = today or date.today()
+    rows = (
+        await db.execute(
+            select(GlobalUsageCounter.granularity, func.sum(GlobalUsageCounter.tokens))
+            .where(
+                ((GlobalUsageCounter.granularity == "day") & (GlobalUsageCounter.period_start == today))
+                | ((GlobalUsageCounter.granularity == "month")
+                   & (GlobalUsageCounter.period_start == today.replace(day=1)))
+            )
+            .group_by(GlobalUsageCounter.granularity)
         )
-        .scalar()
-        or 0
+    ).all()
+    return {"day": 0, "month": 0, **{granularity: int(tokens or 0) for granularity, tokens in rows}}
+
+
+async def _shift_tokens(db: AsyncSession, user_id: int, day: date, delta: int) -> None:
+    """Corrige les quatre compteurs de tokens (jour/mois, utilisateur/global)."""
+    if not delta:
+        return
+    month = day.replace(day=1)
+    await db.execute(
+        update(DailyUsageCounter)
+        .where(DailyUsageCounter.user_id == user_id, DailyUsageCounter.day == day)
+        .values(tokens=DailyUsageCounter.tokens + delta)
     )
+    await db.execute(
+        update(MonthlyUsageCounter)
+        .where(MonthlyUsageCounter.user_id == user_id, MonthlyUsageCounter.month == month)
+        .values(tokens=MonthlyUsageCounter.tokens + delta)
+    )
+    for granularity, start in (("day", day), ("month", month)):
+        # Upsert : le shard existe même si GLOBAL_COUNTER_SHARDS a changé depuis la réservation
+        await _charge(db, GlobalUsageCounter, _global_keys(user_id, granularity, start), delta, 0)
 
 
-def check_quota(db: Session, user: User) -> None:
-    """Lève une 429 si le quota journalier est atteint."""
-    used = get_usage_today(db, user.id)
-    if used >= user.daily_quota:
-        raise HTTPException(
-            status_code=429,
-            detail=f"Quota journalier atteint ({user.daily_quota} générations/jour). "
-                   f"Réessaie demain ou contacte un administrateur.",
+async def get_usage_today(db: AsyncSession, user_id: int) -> int:
+    """Nombre de générations effectuées aujourd'hui (lecture par clé primaire)."""
+    return (
+        await db.scalar(
+            select(DailyUsageCounter.count).where(
+                DailyUsageCounter.user_id == user_id,
+                DailyUsageCounter.day == date.today(),
+            )
         )
+        or 0
+    )
 
 
-def log_usage(
-    db: Session,
+@staged("quota")
+async def log_usage(
+    db: AsyncSession,
     user_id: int,
     action: str,
     tokens_used: int = 0,
     extra: str | None = None,
 ) -> None:
-    """Enregistre une utilisation en base."""
-    entry = UsageLog(
-        user_id=user_id,
-        action=action,
-        tokens_used=tokens_used,
-        log_date=date.today(),
-        extra=extra,
+    """Enregistre une utilisation hors réservation et la décompte immédiatement."""
+    today = date.today()
+    await bump_counter(db, user_id, today, int(action in QUOTA_ACTIONS), 0)
+    await _charge(db, MonthlyUsageCounter, {"user_id": user_id, "month": today.replace(day=1)}, 0, 0)
+    await _shift_tokens(db, user_id, today, tokens_used)
+    await db.commit()
+    await record_usage(db, usage_row(user_id, action, tokens_used, today, extra))
+
+
+class QuotaReservation:
+    """
+    Créneau de quota (et estimation de tokens) réservé avant l'appel upstream.
+    `commit` corrige les tokens avec le coût réel et écrit le UsageLog ;
+    `release` rend créneau et tokens si la génération a échoué.
+    L'un ou l'autre, une seule fois.
+    """
+
+    def __init__(self, user_id: int, day: date, estimate: int = 0):
+        self.user_id = user_id
+        self.day = day
+        self.estimate = estimate
+        self.done = False
+
+    @staged("quota")
+    async def commit(
+        self,
+        db: AsyncSession,
+        action: str,
+        tokens_used: int = 0,
+        extra: str | None = None,
+    ) -> None:
+        # Le créneau est déjà compté par reserve_quota : on corrige l'estimation
+        self.done = True
+        if tokens_used != self.estimate:
+            await _shift_tokens(db, self.user_id, self.day, tokens_used - self.estimate)
+            await db.commit()
+        await record_usage(
+            db, usage_row(self.user_id, action, tokens_used, self.day, extra)
+        )
+
+    async def release(self, db: AsyncSession) -> None:
+        await release_all(db, [self])
+
+
+@staged("quota")
+async def charge_tokens(db: AsyncSession, user_id: int, day: date, tokens: int) -> None:
+    """Tokens consommés sans exercice livré (appel groupé rejeté) : budgets seuls, sans créneau."""
+    await _shift_tokens(db, user_id, day, tokens)
+    await db.commit()
+
+
+@staged("quota")
+async def release_all(db: AsyncSession, reservations: list[QuotaReservation]) -> None:
+    """
+    Rend en une transaction les créneaux et tokens non encore consommés.
+    Appelé le plus souvent depuis une requête annulée : protégé de l'annulation.
+    """
+    pending = [r for r in reservations if not r.done]
+    if not pending:
+        return
+    for r in pending:
+        r.done = True
+    first = pending[0]
+    estimate = sum(r.estimate for r in pending)
+    with anyio.CancelScope(shield=True):
+        await db.rollback()
+        await db.execute(
+            update(DailyUsageCounter)
+            .where(
+                DailyUsageCounter.user_id == first.user_id,
+                DailyUsageCounter.day == first.day,
+                DailyUsageCounter.count >= len(pending),
+            )
+            .values(count=DailyUsageCounter.count - len(pending))
+        )
+        await _shift_tokens(db, first.user_id, first.day, -estimate)
+        await db.commit()
+
+
+async def reserve_quota(db: AsyncSession, user: AuthUser, estimate: int = 0) -> QuotaReservation:
+    """
+    Réserve un créneau et `estimate` tokens avant la génération, ou lève une 429.
+    Un seul UPDATE conditionnel (count < quota) : N requêtes parallèles
+    ne peuvent pas dépasser le quota.
+    """
+    return (await reserve_quota_batch(db, user, [estimate]))[0]
+
+
+@staged("quota")
+async def reserve_quota_batch(
+    db: AsyncSession, user: AuthUser, estimates: list[int]
+) -> list[QuotaReservation]:
+    """
+    Réserve un créneau par estimation (count + n <= quota) et leur somme sur
+    chaque budget de tokens, dans une seule transaction : tout ou rien.
+    Budgets globaux : vérification sans verrou avant la transaction.
+    """
+    settings = get_settings()
+    slots, tokens = len(estimates), sum(estimates)
+    today = date.today()
+    month = today.replace(day=1)
+    daily_budget, monthly_budget = token_budgets(user)
+
+    global_budgets = (
+        ("day", settings.global_daily_token_budget, "global journalier"),
+        ("month", settings.global_monthly_token_budget, "global mensuel"),
+    )
+    if any(budget for _, budget, _ in global_budgets):
+        used = await global_tokens(db, today)
+        for granularity, budget, scope in global_budgets:
+            if budget and used[granularity] + tokens > budget:
+                raise _budget_exceeded(scope)
+
+    await bump_counter(db, user.id, today, 0, 0)   # crée la ligne du jour si besoin
+    conditions = [DailyUsageCounter.count + slots <= user.daily_quota]
+    if daily_budget:
+        conditions.append(DailyUsageCounter.tokens + tokens <= daily_budget)
+    result = await db.execute(
+        update(DailyUsageCounter)
+        .where(DailyUsageCounter.user_id == user.id, DailyUsageCounter.day == today, *conditions)
+        .values(count=DailyUsageCounter.count + slots, tokens=DailyUsageCounter.tokens + tokens)
     )
-    db.add(entry)
-    db.commit()
+    if result.rowcount != 1:
+        await db.rollback()
+        used = await get_usage_today(db, user.id)
+        if used + slots <= user.daily_quota:
+            raise _budget_exceeded("journalier")
+        if slots > 1:
+            QUOTA_REJECTIONS.inc(reason="daily_quota")
+            raise HTTPException(
+                status_code=429,
+                detail=f"Quota insuffisant pour {slots} exercices "
+                       f"(il en reste {max(0, user.daily_quota - used)} aujourd'hui).",
+            )
+        raise _quota_exceeded(user)
+
+    monthly_keys = {"user_id": user.id, "month": month}
+    if not await _charge(db, MonthlyUsageCounter, monthly_keys, tokens, monthly_budget):
+        await db.rollback()
+        raise _budget_exceeded("mensuel")
+    for granularity, start in (("day", today), ("month", month)):
+        await _charge(db, GlobalUsageCounter, _global_keys(user.id, granularity, start), tokens, 0)
+    await db.commit()
+    return [QuotaReservation(user.id, today, estimate) for estimate in estimates]
+
+
+def _window(used: int, budget: int) -> dict:
+    return {
+        "used": used,
+        "budget": budget or None,
+        "remaining": max(0, budget - used) if budget else None,
+    }
+
+
+async def token_budget_status(db: AsyncSession, user: AuthUser) -> dict:
+    """État des budgets de tokens de l'utilisateur (deux lectures par clé primaire)."""
+    today = date.today()
+    daily_budget, monthly_budget = token_budgets(user)
+    daily = await db.scalar(
+        select(DailyUsageCounter.tokens).where(
+            DailyUsageCounter.user_id == user.id, DailyUsageCounter.day == today
+        )
+    )
+    monthly = await db.scalar(
+        select(MonthlyUsageCounter.tokens).where(
+            MonthlyUsageCounter.user_id == user.id,
+            MonthlyUsageCounter.month == today.replace(day=1),
+        )
+    )
+    return {
+        "daily": _window(daily or 0, daily_budget),
+        "monthly": _window(monthly or 0, monthly_budget),
+    }
+
+
+async def global_budget_status(db: AsyncSession) -> dict:
+    settings = get_settings()
+    used = await global_tokens(db)
+    return {
+        "daily": _window(used["day"], settings.global_daily_token_budget),
+        "monthly": _window(used["month"], settings.global_monthly_token_budget),
+    }
 
 
-def quota_status(db: Session, user: User) -> dict:
-    used = get_usage_today(db, user.id)
+async def quota_status(db: AsyncSession, user: AuthUser) -> dict:
+    used = await get_usage_today(db, user.id)
     return {
         "used_today": used,
         "daily_quota": user.daily_quota,
         "remaining": max(0, user.daily_quota - used),
         "reset_at": "minuit (UTC)",
+        "tokens": await token_budget_status(db, user),
     }
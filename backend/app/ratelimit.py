@@ -0,0 +1,363 @@
+"""
+Limitation de débit par route (middleware ASGI), avant toute dépendance FastAPI.
+
+Protège bcrypt (login, inscription) et la capacité Gemini (génération) contre
+les scripts : un client qui insiste reçoit des 429 bon marché au lieu
+d'occuper le worker.
+
+- Règles (RATE_LIMIT_RULES) : "politique:clé:requêtes/secondes,…". Les
+  politiques désignent des routes (POLICIES) ; la clé est l'adresse IP, l'email
+  du corps JSON (login) ou l'id utilisateur du JWT (signature vérifiée, sans
+  accès base).
+- Algorithme : fenêtre glissante approchée (compteur de la fenêtre fixe
+  courante + compteur précédent pondéré par le temps restant). Deux entiers
+  par clé, incrémentables de façon atomique par un backend partagé. Les
+  requêtes refusées comptent aussi : un script qui insiste reste bloqué.
+- Backends : mémoire du process (défaut) ou table rate_limit_counters
+  (RATE_LIMIT_BACKEND=db, partagée entre workers).
+- En-têtes RateLimit-Limit / -Remaining / -Reset / -Policy (brouillon IETF)
+  sur les routes limitées, Retry-After sur les 429 ; refus comptés dans
+  /api/metrics (lexora_rate_limit_rejections_total).
+"""
+import json
+import logging
+import math
+import time
+from collections import OrderedDict
+
+from sqlalchemy import delete, select
+
+from .config import get_settings
+from .database import AsyncSessionLocal, dialect_insert
+from .metrics import RATE_LIMIT_REJECTIONS, db_stage
+from .models import RateLimitCounter
+
+logger = logging.getLogger(__name__)
+
+# Politique → (méthode, chemins) ; un chemin terminé par "/" est un préfixe
+POLICIES = {
+    "login": ("POST", ("/api/auth/login",)),
+    "register": ("POST", ("/api/auth/register", "/api/auth/create-first-admin")),
+    "generate": ("POST", ("/api/generate/",)),
+}
+KEY_KINDS = ("ip", "email", "user")
+
+_MAX_BODY = 16 * 1024   # corps lu pour extraire l'email (formulaires de connexion)
+
+
+class Rule:
+    def __init__(self, policy: str, key: str, limit: int, window: int):
+        self.policy = policy
+        self.key = key
+        self.limit = limit
+        self.window = window
+
+    @property
+    def name(self) -> str:
+        return f"{self.policy}:{self.key}"
+
+    def __repr__(self) -> str:
+        return f"{self.name}:{self.limit}/{self.window}"
+
+
+def parse_rules(spec: str) -> list[Rule]:
+    """Lit RATE_LIMIT_RULES ; ValueError si une règle est invalide."""
+    rules = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        try:
+            policy, key, rate = (part.strip() for part in item.split(":"))
+            limit, window = (int(n) for n in rate.split("/"))
+        except ValueError:
+            raise ValueError(f"Règle de limitation invalide : {item.strip()!r} (politique:clé:n/secondes)")
+        if policy not in POLICIES:
+            raise ValueError(f"Politique de limitation inconnue : {policy}")
+        if key not in KEY_KINDS:
+            raise ValueError(f"Clé de limitation inconnue : {key} ({', '.join(KEY_KINDS)})")
+        if limit <= 0 or window <= 0:
+            raise ValueError(f"Règle de limitation invalide : {item.strip()!r} (valeurs > 0)")
+        rules.append(Rule(policy, key, limit, window))
+    return rules
+
+
+# ── Backends ─────────────────────────────────────────────────────────────
+
+class MemoryRateLimitBackend:
+    """Compteurs en mémoire du process ; les clés les moins récentes sont évincées au-delà de max_keys."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # clé → [début de la fenêtre courante, compte courant, compte précédent]
+        self._counters: OrderedDict[str, list[int]] = OrderedDict()
+
+    async def hit(self, key: str, window_start: int, window: int) -> tuple[int, int]:
+        """Compte une requête ; retourne (compte de la fenêtre courante, compte de la précédente)."""
+        counter = self._counters.get(key)
+        if counter is None or counter[0] < window_start - window:
+            counter = [window_start, 0, 0]
+        elif counter[0] < window_start:
+            counter = [window_start, 0, counter[1]]
+        counter[1] += 1
+        self._counters[key] = counter
+        self._counters.move_to_end(key)
+        while len(self._counters) > self.max_keys:
+            self._counters.popitem(last=False)
+        return counter[1], counter[2]
+
+    def stats(self) -> dict:
+        return {"keys": len(self._counters)}
+
+
+class DBRateLimitBackend:
+    """Compteurs partagés entre workers (table rate_limit_counters, upsert atomique)."""
+
+    _PURGE_EVERY = 500   # requêtes entre deux purges des fenêtres expirées
+
+    def __init__(self, max_window: int):
+        self.max_window = max_window
+        self._hits = 0
+
+    async def hit(self, key: str, window_start: int, window: int) -> tuple[int, int]:
+        with db_stage("ratelimit"):
+            async with AsyncSessionLocal() as db:
+                stmt = dialect_insert(db)(RateLimitCounter).values(
+                    key=key, window_start=window_start, count=1
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[RateLimitCounter.key, RateLimitCounter.window_start],
+                    set_={"count": RateLimitCounter.count + 1},
+                ).returning(RateLimitCounter.count)
+                current = (await db.execute(stmt)).scalar_one()
+                previous = await db.scalar(select(RateLimitCounter.count).where(
+                    RateLimitCounter.key == key,
+                    RateLimitCounter.window_start == window_start - window,
+                ))
+                self._hits += 1
+                if self._hits % self._PURGE_EVERY == 0:
+                    await db.execute(delete(RateLimitCounter).where(
+                        RateLimitCounter.window_start < int(time.time()) - 2 * self.max_window
+                    ))
+                await db.commit()
+        return current, previous or 0
+
+    def stats(self) -> dict:
+        return {"hits": self._hits}
+
+
+# ── Limiteur ─────────────────────────────────────────────────────────────
+
+class Decision:
+    def __init__(self, rule: Rule, allowed: bool, remaining: int, reset: int, retry_after: int):
+        self.rule = rule
+        self.allowed = allowed
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+
+    def headers(self) -> list[tuple[bytes, bytes]]:
+        rule = self.rule
+        headers = [
+            (b"ratelimit-limit", str(rule.limit).encode()),
+            (b"ratelimit-remaining", str(self.remaining).encode()),
+            (b"ratelimit-reset", str(self.reset).encode()),
+            (b"ratelimit-policy", f"{rule.limit};w={rule.window}".encode()),
+        ]
+        if not self.allowed:
+            headers.append((b"retry-after", str(self.retry_after).encode()))
+        return headers
+
+
+def evaluate(rule: Rule, current: int, previous: int, now: float, window_start: int) -> Decision:
+    """Décision de la fenêtre glissante pour les comptes (requête courante incluse)."""
+    window = rule.window
+    elapsed = (now - window_start) / window          # fraction écoulée de la fenêtre courante
+    estimated = previous * (1 - elapsed) + current
+    allowed = estimated <= rule.limit
+    reset = max(1, math.ceil(window_start + window - now))
+    # Attente avant qu'une requête de plus passe, sans nouvel appel entre-temps
+    room = rule.limit - 1
+    if current <= room:
+        wait = window * (1 - elapsed - _room_share(room - current, previous))
+    else:
+        # Fenêtre suivante : le compte courant devient le précédent
+        wait = (1 - elapsed) * window + window * (1 - room / current)
+    return Decision(
+        rule,
+        allowed=allowed,
+        remaining=max(0, math.floor(rule.limit - estimated)),
+        reset=reset,
+        retry_after=max(1, math.ceil(wait)),
+    )
+
+
+def _room_share(room: int, previous: int) -> float:
+    """Part de la fenêtre précédente encore tolérée (1 si elle ne compte plus)."""
+    return 1.0 if previous == 0 else min(1.0, room / previous)
+
+
+class RateLimiter:
+    def __init__(self):
+        settings = get_settings()
+        self.enabled = settings.rate_limit_enabled
+        self.proxy_hops = settings.rate_limit_proxy_hops
+        self.rules = parse_rules(settings.rate_limit_rules)
+        max_window = max((r.window for r in self.rules), default=60)
+        if settings.rate_limit_backend == "db":
+            self.backend = DBRateLimitBackend(max_window)
+        else:
+            self.backend = MemoryRateLimitBackend(settings.rate_limit_max_keys)
+        self.rejections: dict[str, int] = {}
+        self.backend_errors = 0
+
+    def rules_for(self, method: str, path: str) -> list[Rule]:
+        if not self.enabled:
+            return []
+        matched = []
+        for rule in self.rules:
+            policy_method, paths = POLICIES[rule.policy]
+            if method == policy_method and any(
+                path.startswith(p) if p.endswith("/") else path == p for p in paths
+            ):
+                matched.append(rule)
+        return matched
+
+    def client_ip(self, scope) -> str:
+        """Adresse du client : N-ième entrée de X-Forwarded-For en partant de la fin derrière N proxys."""
+        if self.proxy_hops > 0:
+            for name, value in scope.get("headers", []):
+                if name == b"x-forwarded-for":
+                    hops = [h.strip() for h in value.decode("latin-1").split(",") if h.strip()]
+                    if hops:
+                        return hops[-min(self.proxy_hops, len(hops))]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def check(self, rules: list[Rule], keys: dict[str, str]) -> Decision | None:
+        """Compte la requête pour chaque règle ; retourne un refus, ou la décision la plus serrée."""
+        tightest = None
+        for rule in rules:
+            value = keys.get(rule.key)
+            if not value:
+                continue
+            now = time.time()
+            window_start = int(now // rule.window * rule.window)
+            try:
+                current, previous = await self.backend.hit(
+                    f"{rule.name}:{rule.window}:{value}", window_start, rule.window
+                )
+            except Exception:
+                # Backend partagé indisponible : on laisse passer plutôt que bloquer l'API
+                self.backend_errors += 1
+                logger.exception("Limitation de débit : backend indisponible")
+                continue
+            decision = evaluate(rule, current, previous, now, window_start)
+            if not decision.allowed:
+                self.rejections[rule.name] = self.rejections.get(rule.name, 0) + 1
+                RATE_LIMIT_REJECTIONS.inc(policy=rule.policy, key=rule.key)
+                return decision
+            if tightest is None or decision.remaining < tightest.remaining:
+                tightest = decision
+        return tightest
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "rules": [repr(r) for r in self.rules],
+            "rejections": dict(self.rejections),
+            "backend_errors": self.backend_errors,
+            **self.backend.stats(),
+        }
+
+
+rate_limiter = RateLimiter()
+
+
+# ── Middleware ───────────────────────────────────────────────────────────
+
+def _bearer_user_id(scope) -> str | None:
+    from .auth import decode_token
+    from fastapi import HTTPException
+
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return str(decode_token(token).user_id)
+            except HTTPException:
+                return None   # token invalide : la route répondra 401
+    return None
+
+
+def _json_email(body: bytes) -> str | None:
+    try:
+        email = json.loads(body).get("email")
+    except (ValueError, AttributeError):
+        return None
+    return email.strip().lower() if isinstance(email, str) else None
+
+
+async def _read_body(receive) -> tuple[bytes, list[dict]]:
+    """Lit le corps (jusqu'à _MAX_BODY) ; retourne aussi les messages à rejouer."""
+    messages, body = [], b""
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body", False) or len(body) > _MAX_BODY:
+            break
+    return body, messages
+
+
+class RateLimitMiddleware:
+    """Middleware ASGI : applique les règles de rate_limiter avant le routage."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rules = rate_limiter.rules_for(scope["method"], scope["path"])
+        if not rules:
+            return await self.app(scope, receive, send)
+
+        keys = {"ip": rate_limiter.client_ip(scope)}
+        if any(r.key == "user" for r in rules):
+            keys["user"] = _bearer_user_id(scope)
+        if any(r.key == "email" for r in rules):
+            body, pending = await _read_body(receive)
+            keys["email"] = _json_email(body) if len(body) <= _MAX_BODY else None
+            upstream_receive = receive
+
+            async def receive():
+                # Rejoue le corps déjà lu, puis reprend le flux d'origine
+                return pending.pop(0) if pending else await upstream_receive()
+
+        decision = await rate_limiter.check(rules, keys)
+        if decision is not None and not decision.allowed:
+            body = json.dumps({
+                "detail": f"Trop de requêtes. Réessaie dans {decision.retry_after} s."
+            }).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    *decision.headers(),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and decision is not None:
+                message["headers"] = [*message.get("headers", []), *decision.headers()]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
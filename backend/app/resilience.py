@@ -0,0 +1,122 @@
+"""
+Briques de résilience pour les appels Gemini (utilisées par claude_service).
+
+- TokenBucket : limite de débit par minute (requêtes ou tokens), avec
+  correction a posteriori quand le coût réel est connu.
+- CircuitBreaker : après N échecs consécutifs, coupe les appels pendant
+  `reset_seconds`, puis laisse passer un seul appel de test (half-open).
+- retry_delay : backoff exponentiel avec jitter, qui respecte Retry-After.
+"""
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class TokenBucket:
+    """Seau de `per_minute` jetons rechargé en continu ; 0 = illimité."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waits = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, n: int = 1) -> None:
+        if self.capacity <= 0:
+            return
+        n = min(n, self.capacity)
+        # Le verrou sert les demandes dans l'ordre d'arrivée
+        async with self._lock:
+            self._refill()
+            if self.tokens < n:
+                self.waits += 1
+            while self.tokens < n:
+                await asyncio.sleep((n - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= n
+
+    def adjust(self, n: int) -> None:
+        """Corrige après coup (n > 0 : coût réel supérieur à l'estimation)."""
+        if self.capacity <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - n)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+
+    def retry_after(self) -> int:
+        return max(1, int(self.opened_at + self.reset_seconds - time.monotonic()) + 1)
+
+    def allow(self) -> bool:
+        if self.failure_threshold <= 0 or self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() >= self.opened_at + self.reset_seconds:
+            self.state = "half_open"   # un seul appel de test
+            return True
+        self.rejected += 1
+        return False
+
+    def success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or (
+            self.failure_threshold > 0 and self.failures >= self.failure_threshold
+        ):
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """En-tête Retry-After : délai en secondes ou date HTTP."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def retry_delay(attempt: int, base: float, cap: float, retry_after: float | None) -> float:
+    """Full jitter : uniforme dans [0, min(cap, base·2^attempt)], au moins Retry-After."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
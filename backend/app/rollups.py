@@ -0,0 +1,117 @@
+"""
+Rollups journaliers d'usage (table usage_daily_rollup).
+
+Mis à jour à chaque écriture de logs (calls, tokens, et distinct_users quand
+c'est le premier log du jour de l'utilisateur pour cette action, voir
+usage_writer.write_usage_rows), puis recalculés
+périodiquement depuis usage_logs sur les derniers jours pour corriger les
+écarts (courses entre requêtes concurrentes, logs supprimés…).
+
+La même boucle crée à l'avance les partitions mensuelles de usage_logs
+(Postgres, voir partitions.py).
+"""
+import asyncio
+import logging
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .database import AsyncSessionLocal, dialect_insert
+from .models import UsageLog, UsageDailyRollup
+from .partitions import ensure_partitions
+
+logger = logging.getLogger(__name__)
+
+_task: asyncio.Task | None = None
+
+
+async def bump_rollup(
+    db: AsyncSession, day: date, action: str, calls: int, tokens: int, new_users: int
+) -> None:
+    """Upsert incrémental d'une ligne de rollup (transaction courante)."""
+    stmt = dialect_insert(db)(UsageDailyRollup).values(
+        day=day, action=action, calls=calls, tokens=tokens, distinct_users=new_users
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UsageDailyRollup.day, UsageDailyRollup.action],
+        set_={
+            "calls": UsageDailyRollup.calls + stmt.excluded.calls,
+            "tokens": UsageDailyRollup.tokens + stmt.excluded.tokens,
+            "distinct_users": UsageDailyRollup.distinct_users + stmt.excluded.distinct_users,
+        },
+    )
+    await db.execute(stmt)
+
+
+def created_since(day: date) -> datetime:
+    """
+    Borne basse de created_at (UTC) des logs datés de `day` ou après (log_date
+    est en heure locale, d'où un jour de marge). Ajoutée aux requêtes filtrées
+    sur log_date : Postgres n'ouvre que les partitions récentes de usage_logs.
+    """
+    return datetime.combine(day, time.min) - timedelta(days=1)
+
+
+async def compact_rollups(days: int) -> int:
+    """Recalcule les rollups des `days` derniers jours depuis usage_logs."""
+    since = date.today() - timedelta(days=days - 1)
+    async with AsyncSessionLocal() as db:
+        rows = (
+            await db.execute(
+                select(
+                    UsageLog.log_date,
+                    UsageLog.action,
+                    func.count(UsageLog.id),
+                    func.coalesce(func.sum(UsageLog.tokens_used), 0),
+                    func.count(func.distinct(UsageLog.user_id)),
+                )
+                .where(UsageLog.log_date >= since, UsageLog.created_at >= created_since(since))
+                .group_by(UsageLog.log_date, UsageLog.action)
+            )
+        ).all()
+        for day, action, calls, tokens, users in rows:
+            stmt = dialect_insert(db)(UsageDailyRollup).values(
+                day=day, action=action, calls=calls, tokens=tokens, distinct_users=users
+            )
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=[UsageDailyRollup.day, UsageDailyRollup.action],
+                set_={
+                    "calls": stmt.excluded.calls,
+                    "tokens": stmt.excluded.tokens,
+                    "distinct_users": stmt.excluded.distinct_users,
+                },
+            ))
+        await db.commit()
+        return len(rows)
+
+
+async def _compaction_loop() -> None:
+    settings = get_settings()
+    while True:
+        try:
+            await compact_rollups(settings.rollup_compaction_days)
+        except Exception as exc:
+            logger.warning("Rollups: compaction impossible: %s", exc)
+        try:
+            created = await ensure_partitions()
+            if created:
+                logger.info("usage_logs: partitions créées: %s", ", ".join(created))
+        except Exception as exc:
+            logger.warning("usage_logs: création des partitions impossible: %s", exc)
+        await asyncio.sleep(settings.rollup_compaction_interval_seconds)
+
+
+async def start_rollup_compaction() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_compaction_loop())
+
+
+async def stop_rollup_compaction() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
@@ -0,0 +1,242 @@
+"""
+Import groupé d'utilisateurs (listes de classe), pour POST /api/admin/users/bulk
+et `python create_admin.py --roster classe.csv`.
+
+- Formats : CSV avec en-tête (séparateur , ; ou tabulation, BOM accepté) ou
+  JSON (liste d'objets, ou {"users": [...]}) ; colonnes email, username,
+  password (facultatif : généré et renvoyé une seule fois dans le rapport),
+  daily_quota (facultatif).
+- Chaque ligne est validée comme une inscription (UserRegister) ; doublons
+  détectés dans le fichier puis en base par des requêtes IN (par paquets),
+  jamais un SELECT par ligne.
+- Hachage bcrypt dans un pool de processus (tous les cœurs, sans bloquer la
+  boucle) puis INSERT multi-lignes par lots, dans une seule transaction.
+  Les mots de passe générés (72 bits aléatoires : inattaquables même à faible
+  coût) sont hachés à `bulk_import_generated_rounds` (~2 ms au lieu de
+  ~300 ms) ; le hash passe au coût normal à la première connexion.
+- Rapport ligne par ligne : created | valid (dry_run) | invalid | duplicate.
+"""
+import asyncio
+import csv
+import io
+import json
+import multiprocessing
+import os
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .auth import hash_password
+from .config import get_settings
+from .models import User, UserRole
+from .schemas import UserRegister
+
+_CHUNK = 500   # valeurs par clause IN et lignes par INSERT
+
+
+class RosterError(ValueError):
+    """Fichier illisible (format, en-tête, taille) : refusé en entier."""
+
+
+def parse_roster(content: bytes | str, fmt: str) -> list[dict]:
+    """Lignes brutes du fichier ; RosterError si le fichier est inexploitable."""
+    if isinstance(content, bytes):
+        try:
+            content = content.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise RosterError("Fichier non UTF-8")
+    if fmt == "json":
+        try:
+            data = json.loads(content)
+        except ValueError as exc:
+            raise RosterError(f"JSON invalide : {exc}")
+        if isinstance(data, dict):
+            data = data.get("users")
+        if not isinstance(data, list) or not all(isinstance(r, dict) for r in data):
+            raise RosterError('JSON attendu : liste d\'objets ou {"users": [...]}')
+        return data
+    if fmt == "csv":
+        header = content.split("\n", 1)[0]
+        delimiter = max(",;\t", key=header.count)
+        reader = csv.DictReader(io.StringIO(content), delimiter=delimiter)
+        if not reader.fieldnames or not {"email", "username"} <= {
+            (f or "").strip().lower() for f in reader.fieldnames
+        }:
+            raise RosterError("En-tête CSV attendu : email, username[, password, daily_quota]")
+        return [
+            {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+            for row in reader
+            if any((v or "").strip() for v in row.values() if isinstance(v, str))
+        ]
+    raise RosterError(f"Format inconnu : {fmt} (csv ou json)")
+
+
+def roster_format(content_type: str | None, filename: str | None = None) -> str:
+    """csv | json d'après le Content-Type ou l'extension du fichier."""
+    if filename:
+        return "json" if filename.lower().endswith(".json") else "csv"
+    return "json" if "json" in (content_type or "") else "csv"
+
+
+def _error_text(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in err['loc'])}: {err['msg'].removeprefix('Value error, ')}"
+        for err in exc.errors()
+    )
+
+
+def _validate(index: int, raw: dict) -> dict:
+    """Ligne du rapport ; les lignes valides portent aussi les champs à insérer."""
+    email = str(raw.get("email") or "").strip()
+    username = str(raw.get("username") or "").strip()
+    row = {"row": index, "email": email or None, "username": username or None}
+    password = str(raw.get("password") or "")
+    generated = not password
+    if generated:
+        password = secrets.token_urlsafe(9)
+    try:
+        user = UserRegister(email=email, username=username, password=password)
+        quota = raw.get("daily_quota")
+        quota = int(quota) if quota not in (None, "") else None
+        if quota is not None and quota < 0:
+            raise ValueError
+    except ValidationError as exc:
+        return {**row, "status": "invalid", "error": _error_text(exc)}
+    except (TypeError, ValueError):
+        return {**row, "status": "invalid", "error": "daily_quota: entier positif attendu"}
+    return {
+        **row,
+        "email": user.email,
+        "status": "valid",
+        "password": password if generated else None,
+        "_password": user.password,
+        "_quota": quota,
+    }
+
+
+async def _existing(db: AsyncSession, column, values: set[str]) -> set[str]:
+    found: set[str] = set()
+    values = list(values)
+    for i in range(0, len(values), _CHUNK):
+        found.update(await db.scalars(select(column).where(column.in_(values[i:i + _CHUNK]))))
+    return found
+
+
+async def _mark_duplicates(db: AsyncSession, rows: list[dict]) -> None:
+    """Doublons dans le fichier (première occurrence gardée) puis en base, en quelques requêtes."""
+    seen_emails: set[str] = set()
+    seen_usernames: set[str] = set()
+    for row in rows:
+        if row["status"] != "valid":
+            continue
+        if row["email"] in seen_emails:
+            row.update(status="duplicate", error="Email en double dans le fichier")
+        elif row["username"] in seen_usernames:
+            row.update(status="duplicate", error="Nom d'utilisateur en double dans le fichier")
+        seen_emails.add(row["email"])
+        seen_usernames.add(row["username"])
+
+    valid = [r for r in rows if r["status"] == "valid"]
+    taken_emails = await _existing(db, User.email, {r["email"] for r in valid})
+    taken_usernames = await _existing(db, User.username, {r["username"] for r in valid})
+    for row in valid:
+        if row["email"] in taken_emails:
+            row.update(status="duplicate", error="Email déjà utilisé")
+        elif row["username"] in taken_usernames:
+            row.update(status="duplicate", error="Nom d'utilisateur déjà pris")
+
+
+async def hash_passwords(passwords: list[str], rounds: int | None = None) -> list[str]:
+    """bcrypt en parallèle sur plusieurs processus (le GIL ne limite pas le débit)."""
+    if not passwords:
+        return []
+    if rounds:
+        # Coût réduit : quelques ms par hash, un thread suffit
+        return await asyncio.to_thread(lambda: [hash_password(p, rounds) for p in passwords])
+    workers = get_settings().bulk_import_workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(passwords)))
+    loop = asyncio.get_running_loop()
+    # spawn : pas de fork d'un process qui porte des threads et des connexions ouvertes
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return await asyncio.gather(
+            *(loop.run_in_executor(pool, hash_password, p) for p in passwords)
+        )
+
+
+async def import_roster(db: AsyncSession, raw_rows: list[dict], dry_run: bool = False) -> dict:
+    """Valide, déduplique, hache et insère ; retourne le rapport (voir BulkImportReport)."""
+    settings = get_settings()
+    if len(raw_rows) > settings.bulk_import_max_rows:
+        raise RosterError(f"{len(raw_rows)} lignes : maximum {settings.bulk_import_max_rows} par import")
+    started = time.perf_counter()
+    rows = [_validate(i, raw) for i, raw in enumerate(raw_rows, start=1)]
+    await _mark_duplicates(db, rows)
+
+    valid = [r for r in rows if r["status"] == "valid"]
+    if valid and not dry_run:
+        hashes = await _hash_rows(valid, settings.bulk_import_generated_rounds)
+        for attempt in range(2):
+            try:
+                await _insert(db, valid, hashes)
+                break
+            except IntegrityError:
+                # Inscription concurrente entre la vérification et l'INSERT : on revérifie
+                await db.rollback()
+                if attempt:
+                    raise
+                await _mark_duplicates(db, valid)
+                kept = [(r, h) for r, h in zip(valid, hashes) if r["status"] == "valid"]
+                valid, hashes = [r for r, _ in kept], [h for _, h in kept]
+
+    for row in rows:
+        row.pop("_password", None)
+        row.pop("_quota", None)
+        if row["status"] != "created":
+            row.pop("password", None)   # mot de passe généré : seulement pour les comptes créés
+    return {
+        "created": sum(r["status"] == "created" for r in rows),
+        "rejected": sum(r["status"] in ("invalid", "duplicate") for r in rows),
+        "dry_run": dry_run,
+        "seconds": round(time.perf_counter() - started, 3),
+        "rows": rows,
+    }
+
+
+async def _hash_rows(rows: list[dict], generated_rounds: int) -> list[str]:
+    """Hash de chaque ligne : coût réduit pour les mots de passe générés, normal sinon."""
+    hashes = [""] * len(rows)
+    generated = [i for i, r in enumerate(rows) if r["password"]]
+    chosen = [i for i, r in enumerate(rows) if not r["password"]]
+    for indices, rounds in ((generated, generated_rounds or None), (chosen, None)):
+        passwords = [rows[i]["_password"] for i in indices]
+        for i, hashed in zip(indices, await hash_passwords(passwords, rounds)):
+            hashes[i] = hashed
+    return hashes
+
+
+async def _insert(db: AsyncSession, rows: list[dict], hashes: list[str]) -> None:
+    default_quota = get_settings().default_daily_quota
+    ids: dict[str, int] = {}
+    for i in range(0, len(rows), _CHUNK):
+        values = [
+            {
+                "email": r["email"],
+                "username": r["username"],
+                "hashed_password": h,
+                "role": UserRole.user,
+                "is_active": True,
+                "daily_quota": r["_quota"] if r["_quota"] is not None else default_quota,
+                "token_version": 0,
+            }
+            for r, h in zip(rows[i:i + _CHUNK], hashes[i:i + _CHUNK])
+        ]
+        result = await db.execute(insert(User).returning(User.id, User.email), values)
+        ids.update({email: user_id for user_id, email in result.all()})
+    await db.commit()
+    for row in rows:
+        row.update(status="created", user_id=ids.get(row["email"]))
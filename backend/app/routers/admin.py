@@ -1,112 +1,398 @@
-from datetime import date
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+import base64
+from datetime import date, datetime, timedelta
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, case, func, not_, select, tuple_, update
 
 from ..database import get_db
-from ..models import User, UsageLog
-from ..schemas import UserAdminOut, UpdateQuota, UsageLogOut
+from ..models import (
+    User, UserRole, UsageLog, DailyUsageCounter, MonthlyUsageCounter, UsageDailyRollup,
+)
+from ..schemas import (
+    UserAdminOut, UserAdminPage, UpdateQuota, UpdateTokenBudget, UsageLogOut, AuthUser,
+    BulkImportReport,
+)
+from ..quota import global_budget_status
 from ..auth import require_admin
-from ..quota import get_usage_today
+from ..claude_service import (
+    coalescing_stats, connection_stats, resilience_stats,
+)
+from ..cache import response_cache
+from ..export import MEDIA_TYPES as EXPORT_MEDIA_TYPES, ExportResponse, usage_exporter
+from ..prompts import active_templates
+from ..pool import pool_stats
+from ..ratelimit import rate_limiter
+from ..roster import RosterError, import_roster, parse_roster, roster_format
+from ..user_cache import user_cache
+from ..model_router import model_router
+from ..structured import parse_stats
+from ..usage_writer import usage_writer
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
 
-@router.get("/users", response_model=list[UserAdminOut])
-def list_users(
-    db: Session = Depends(get_db),
-    _: User = Depends(require_admin),
+def _users_with_usage_today():
+    """Utilisateurs + usage du jour et tokens du mois en une seule requête (jointure sur les compteurs)."""
+    today = date.today()
+    return (
+        select(
+            User,
+            func.coalesce(DailyUsageCounter.count, 0),
+            func.coalesce(DailyUsageCounter.tokens, 0),
+            func.coalesce(MonthlyUsageCounter.tokens, 0),
+        )
+        .outerjoin(
+            DailyUsageCounter,
+            and_(
+                DailyUsageCounter.user_id == User.id,
+                DailyUsageCounter.day == today,
+            ),
+        )
+        .outerjoin(
+            MonthlyUsageCounter,
+            and_(
+                MonthlyUsageCounter.user_id == User.id,
+                MonthlyUsageCounter.month == today.replace(day=1),
+            ),
+        )
+    )
+
+
+def _admin_out(user: User, usage_today: int, tokens_today: int, tokens_month: int) -> UserAdminOut:
+    out = UserAdminOut.model_validate(user)
+    out.usage_today = usage_today
+    out.tokens_today = tokens_today
+    out.tokens_month = tokens_month
+    return out
+
+
+def _encode_cursor(user: User) -> str:
+    raw = f"{user.created_at.isoformat()}|{user.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, user_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(user_id)
+    except ValueError:
+        raise HTTPException(400, "Curseur invalide")
+
+
+async def _user_admin_out(db: AsyncSession, user_id: int) -> UserAdminOut:
+    row = (await db.execute(_users_with_usage_today().where(User.id == user_id))).first()
+    if row is None:
+        raise HTTPException(404, "Utilisateur introuvable")
+    return _admin_out(*row)
+
+
+@router.get("/users", response_model=UserAdminPage)
+async def list_users(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    role: Optional[UserRole] = None,
+    is_active: Optional[bool] = None,
+    email_prefix: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    _: AuthUser = Depends(require_admin),
 ):
-    users = db.query(User).order_by(User.created_at.desc()).all()
-    result = []
-    for u in users:
-        out = UserAdminOut.model_validate(u)
-        out.usage_today = get_usage_today(db, u.id)
-        result.append(out)
-    return result
+    """Pagination par curseur sur (created_at, id), du plus récent au plus ancien."""
+    query = _users_with_usage_today()
+    if role is not None:
+        query = query.where(User.role == role)
+    if is_active is not None:
+        query = query.where(User.is_active == is_active)
+    if email_prefix:
+        escaped = email_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.where(User.email.like(f"{escaped}%", escape="\\"))
+    if cursor:
+        query = query.where(tuple_(User.created_at, User.id) < _decode_cursor(cursor))
+    rows = (
+        await db.execute(
+            query.order_by(User.created_at.desc(), User.id.desc()).limit(limit + 1)
+        )
+    ).all()
+    items = [_admin_out(*row) for row in rows[:limit]]
+    next_cursor = _encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    return UserAdminPage(items=items, next_cursor=next_cursor)
+
+
+@router.post(
+    "/users/bulk",
+    response_model=BulkImportReport,
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "text/csv": {"schema": {"type": "string"}},
+        "application/json": {"schema": {"type": "array", "items": {"type": "object"}}},
+    }}},
+)
+async def bulk_import_users(
+    request: Request,
+    dry_run: bool = False,
+    db: AsyncSession = Depends(get_db),
+    _: AuthUser = Depends(require_admin),
+):
+    """
+    Import d'une liste de classe : corps CSV (text/csv) ou JSON (application/json),
+    colonnes email, username, password (facultatif, généré sinon), daily_quota.
+    Lignes invalides ou en double ignorées ; rapport ligne par ligne.
+    """
+    try:
+        rows = parse_roster(await request.body(), roster_format(request.headers.get("content-type")))
+        return await import_roster(db, rows, dry_run=dry_run)
+    except RosterError as exc:
+        raise HTTPException(400, str(exc))
 
 
 @router.patch("/users/{user_id}/quota", response_model=UserAdminOut)
-def update_quota(
+async def update_quota(
     user_id: int,
     payload: UpdateQuota,
-    db: Session = Depends(get_db),
-    _: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
+    _: AuthUser = Depends(require_admin),
 ):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    result = await db.execute(
+        update(User).where(User.id == user_id).values(daily_quota=payload.daily_quota)
+    )
+    if result.rowcount != 1:
         raise HTTPException(404, "Utilisateur introuvable")
-    user.daily_quota = payload.daily_quota
-    db.commit()
-    db.refresh(user)
-    out = UserAdminOut.model_validate(user)
-    out.usage_today = get_usage_today(db, user.id)
-    return out
+    await db.commit()
+    user_cache.invalidate(user_id)
+    return await _user_admin_out(db, user_id)
+
+
+@router.patch("/users/{user_id}/token-budget", response_model=UserAdminOut)
+async def update_token_budget(
+    user_id: int,
+    payload: UpdateTokenBudget,
+    db: AsyncSession = Depends(get_db),
+    _: AuthUser = Depends(require_admin),
+):
+    """Budgets de tokens de l'utilisateur : null = défaut, 0 = illimité."""
+    result = await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(
+            daily_token_budget=payload.daily_token_budget,
+            monthly_token_budget=payload.monthly_token_budget,
+        )
+    )
+    if result.rowcount != 1:
+        raise HTTPException(404, "Utilisateur introuvable")
+    await db.commit()
+    user_cache.invalidate(user_id)
+    return await _user_admin_out(db, user_id)
+
+
+@router.get("/token-budget")
+async def token_budget(
+    db: AsyncSession = Depends(get_db),
+    _: AuthUser = Depends(require_admin),
+):
+    """Tokens consommés par toute l'application (jour, mois) face aux budgets globaux."""
+    return await global_budget_status(db)
 
 
 @router.patch("/users/{user_id}/toggle-active", response_model=UserAdminOut)
-def toggle_active(
+async def toggle_active(
     user_id: int,
-    db: Session = Depends(get_db),
-    admin: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
+    admin: AuthUser = Depends(require_admin),
 ):
     if user_id == admin.id:
         raise HTTPException(400, "Impossible de désactiver son propre compte")
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    result = await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(
+            is_active=not_(User.is_active),
+            # Une désactivation révoque les tokens déjà émis (claim "ver" périmé)
+            token_version=case(
+                (User.is_active == True, User.token_version + 1),
+                else_=User.token_version,
+            ),
+        )
+    )
+    if result.rowcount != 1:
         raise HTTPException(404, "Utilisateur introuvable")
-    user.is_active = not user.is_active
-    db.commit()
-    db.refresh(user)
-    out = UserAdminOut.model_validate(user)
-    out.usage_today = get_usage_today(db, user.id)
-    return out
+    await db.commit()
+    user_cache.invalidate(user_id)
+    return await _user_admin_out(db, user_id)
 
 
 @router.get("/users/{user_id}/logs", response_model=list[UsageLogOut])
-def user_logs(
+async def user_logs(
     user_id: int,
     limit: int = 50,
-    db: Session = Depends(get_db),
-    _: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
+    _: AuthUser = Depends(require_admin),
 ):
     return (
-        db.query(UsageLog)
-        .filter(UsageLog.user_id == user_id)
-        .order_by(UsageLog.created_at.desc())
-        .limit(limit)
-        .all()
-    )
+        await db.scalars(
+            select(UsageLog)
+            .where(UsageLog.user_id == user_id)
+            .order_by(UsageLog.created_at.desc())
+            .limit(limit)
+        )
+    ).all()
 
 
 @router.get("/stats")
-def global_stats(
-    db: Session = Depends(get_db),
-    _: User = Depends(require_admin),
+async def global_stats(
+    db: AsyncSession = Depends(get_db),
+    _: AuthUser = Depends(require_admin),
 ):
-    total_users = db.query(func.count(User.id)).scalar()
-    active_users = db.query(func.count(User.id)).filter(User.is_active == True).scalar()
-    total_calls = db.query(func.count(UsageLog.id)).scalar()
-    calls_today = (
-        db.query(func.count(UsageLog.id))
-        .filter(UsageLog.log_date == date.today())
-        .scalar()
-    )
-    tokens_today = (
-        db.query(func.coalesce(func.sum(UsageLog.tokens_used), 0))
-        .filter(UsageLog.log_date == date.today())
-        .scalar()
-    )
+    """Lit les rollups journaliers : aucun scan de usage_logs."""
+    total_users, active_users = (
+        await db.execute(
+            select(func.count(User.id), func.count(User.id).filter(User.is_active == True))
+        )
+    ).one()
     by_action = (
-        db.query(UsageLog.action, func.count(UsageLog.id))
-        .group_by(UsageLog.action)
-        .all()
-    )
+        await db.execute(
+            select(UsageDailyRollup.action, func.sum(UsageDailyRollup.calls))
+            .group_by(UsageDailyRollup.action)
+        )
+    ).all()
+    calls_today, tokens_today = (
+        await db.execute(
+            select(
+                func.coalesce(func.sum(UsageDailyRollup.calls), 0),
+                func.coalesce(func.sum(UsageDailyRollup.tokens), 0),
+            )
+            .where(UsageDailyRollup.day == date.today())
+        )
+    ).one()
     return {
         "total_users": total_users,
         "active_users": active_users,
-        "total_calls": total_calls,
+        "total_calls": sum(c for _, c in by_action),
         "calls_today": calls_today,
         "tokens_today": tokens_today,
         "by_action": {a: c for a, c in by_action},
     }
+
+
+def _period_start(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _next_period(start: date, granularity: str) -> date:
+    if granularity == "week":
+        return start + timedelta(days=7)
+    if granularity == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+@router.get("/stats/timeseries")
+async def stats_timeseries(
+    from_: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    granularity: Literal["day", "week", "month"] = "day",
+    db: AsyncSession = Depends(get_db),
+    _: AuthUser = Depends(require_admin),
+):
+    """
+    Séries pour les graphiques, depuis les rollups (30 derniers jours par défaut).
+    `user_days` = somme des utilisateurs distincts par jour (exact en granularité jour).
+    """
+    to = to or date.today()
+    from_ = from_ or to - timedelta(days=29)
+    if from_ > to:
+        raise HTTPException(400, "Période invalide : from > to")
+    if (to - from_).days > 731:
+        raise HTTPException(400, "Période limitée à 2 ans")
+
+    series: dict[date, dict] = {}
+    period = _period_start(from_, granularity)
+    while period <= to:
+        series[period] = {
+            "period": period.isoformat(), "calls": 0, "tokens": 0, "user_days": 0, "by_action": {},
+        }
+        period = _next_period(period, granularity)
+
+    rows = (
+        await db.execute(
+            select(
+                UsageDailyRollup.day, UsageDailyRollup.action, UsageDailyRollup.calls,
+                UsageDailyRollup.tokens, UsageDailyRollup.distinct_users,
+            )
+            .where(UsageDailyRollup.day >= from_, UsageDailyRollup.day <= to)
+        )
+    ).all()
+    for day, action, calls, tokens, users in rows:
+        point = series[_period_start(day, granularity)]
+        point["calls"] += calls
+        point["tokens"] += tokens
+        point["user_days"] += users
+        point["by_action"][action] = point["by_action"].get(action, 0) + calls
+
+    return {
+        "from": from_.isoformat(),
+        "to": to.isoformat(),
+        "granularity": granularity,
+        "series": list(series.values()),
+    }
+
+
+@router.get("/export/usage")
+async def export_usage(
+    from_: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    action: Optional[str] = None,
+    user_id: Optional[int] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+    db: AsyncSession = Depends(get_db),
+    _: AuthUser = Depends(require_admin),
+):
+    """
+    Logs d'usage bruts en flux (NDJSON ou CSV, gzip en option), filtrés par jour
+    de création (30 derniers jours par défaut), action et utilisateur.
+    """
+    to = to or date.today()
+    from_ = from_ or to - timedelta(days=29)
+    if from_ > to:
+        raise HTTPException(400, "Période invalide : from > to")
+    slot = usage_exporter.try_acquire()
+    if slot is None:
+        raise HTTPException(429, "Trop d'exports en cours, réessayez plus tard")
+    # La session de l'authentification rend sa connexion : l'export ouvre la sienne
+    await db.close()
+
+    filename = f"usage_{from_.isoformat()}_{to.isoformat()}.{format}" + (".gz" if gzip else "")
+    return ExportResponse(
+        usage_exporter.stream(format, from_, to, action, user_id, compress=gzip),
+        slot,
+        media_type="application/gzip" if gzip else EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/upstream")
+async def upstream_stats(_: AuthUser = Depends(require_admin)):
+    """Compteurs internes des composants (client Gemini, files, limites) par section."""
+    return {
+        **connection_stats(),
+        "coalescing": coalescing_stats(),
+        "resilience": resilience_stats(),
+        "models": model_router.stats(),
+        "response_cache": response_cache.stats(),
+        "auth_cache": user_cache.stats(),
+        "prompts": {"templates": active_templates()},
+        "parsing": parse_stats(),
+        "usage_log": usage_writer.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "export": usage_exporter.stats(),
+    }
+
+
+@router.get("/pool")
+async def exercise_pool(_: AuthUser = Depends(require_admin)):
+    """Profondeur du pool d'exercices pré-générés, par bucket."""
+    return await pool_stats()
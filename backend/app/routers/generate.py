@@ -1,116 +1,153 @@
+import json
+
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..database import get_db
-from ..models import User
+from ..schemas import AuthUser
 from ..auth import get_current_user
-from ..quota import check_quota, log_usage
-from ..claude_service import call_claude, parse_json
+from ..quota import reserve_quota
+from ..cache import generate_cached
+from ..claude_service import estimate_tokens
+from ..streaming import stream_generation
+from ..batch import generate_batch
+from .. import pool, prompts
+from ..config import get_settings
 from ..schemas import (
     GenerateWritingRequest, GenerateFillRequest,
     GenerateReadingRequest, GenerateFlashcardsRequest,
-    CorrectWritingRequest,
+    CorrectWritingRequest, BatchGenerateRequest, BatchGenerateResponse,
+    WritingTopic, FillBlank, ReadingExercise, Flashcard, WritingCorrection,
 )
 
 router = APIRouter(prefix="/api/generate", tags=["generate"])
+settings = get_settings()
+
+
+def _extra(**fields) -> str:
+    """Contenu JSON de UsageLog.extra (thème, niveau, statut cache…)."""
+    return json.dumps(fields, ensure_ascii=False)
 
 
-@router.post("/writing-topic")
+async def _exercise(
+    db: AsyncSession, user: AuthUser, action: str, theme: str, level: str, stream: bool = False
+):
+    """Pool d'abord (O(1)), puis génération via le cache en cas de pool vide."""
+    system, prompt, max_tokens = prompts.build_exercise(action, theme, level)
+    reservation = await reserve_quota(db, user, estimate_tokens(system, prompt, max_tokens))
+    try:
+        pooled = None
+        use_pool = settings.pool_enabled and action in settings.pool_actions_list
+        if use_pool:
+            pooled = await pool.take(action, theme, level)
+        if stream:
+            fields = {"theme": theme, "level": level}
+            if use_pool:
+                fields["pool"] = "miss"
+            # Le flux SSE prend la réservation en charge (commit ou release)
+            return stream_generation(
+                reservation, action, system, prompt, max_tokens, fields, pooled
+            )
+        if pooled is not None:
+            result, tokens = pooled
+            meta = {"pool": "hit"}
+        else:
+            result, tokens, cache, model = await generate_cached(action, system, prompt, max_tokens)
+            meta = {"pool": "miss", "cache": cache} if use_pool else {"cache": cache}
+            if model:
+                meta["model"] = model
+        meta.update(prompts.template_meta(action))
+        await reservation.commit(db, action, tokens, _extra(theme=theme, level=level, **meta))
+        return result
+    except BaseException:
+        await reservation.release(db)
+        raise
+
+
+@router.post("/writing-topic", response_model=WritingTopic)
 async def writing_topic(
     payload: GenerateWritingRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    stream: bool = False,
+    current_user: AuthUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    check_quota(db, current_user)
-    text, tokens = await call_claude(
-        "You are an English language teacher. Always respond in valid JSON only, no markdown, no extra text.",
-        f'Generate a writing prompt for level {payload.level} on the theme "{payload.theme}". '
-        f'Return JSON: {{"prompt": "the full writing prompt in English (2-3 sentences)", '
-        f'"hints": ["hint1","hint2","hint3"], "min_words": number}}',
+    return await _exercise(
+        db, current_user, "writing_generate", payload.theme, payload.level, stream
     )
-    result = parse_json(text)
-    log_usage(db, current_user.id, "writing_generate", tokens, payload.theme)
-    return result
 
 
-@router.post("/correct-writing")
+@router.post("/correct-writing", response_model=WritingCorrection)
 async def correct_writing(
     payload: CorrectWritingRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    stream: bool = False,
+    current_user: AuthUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    check_quota(db, current_user)
-    text, tokens = await call_claude(
-        "You are an expert English teacher. Respond only with valid JSON, no markdown.",
-        f'Correct this {payload.level} level writing. Prompt: "{payload.prompt}"\n'
-        f'Student text: "{payload.text}"\n'
-        f'Return JSON: {{'
-        f'"score": number (0-100), "grammar_score": number (0-100), '
-        f'"vocabulary_score": number (0-100), "coherence_score": number (0-100), '
-        f'"strengths": ["strength1","strength2"], '
-        f'"improvements": ["improvement1","improvement2","improvement3"], '
-        f'"corrected_sentences": [{{"original":"...","corrected":"...","explanation":"..."}}], '
-        f'"overall_comment": "encouraging overall comment in French"}}',
-        max_tokens=1500,
+    system, prompt, max_tokens = prompts.correct_writing(payload.prompt, payload.text, payload.level)
+    reservation = await reserve_quota(
+        db, current_user, estimate_tokens(system, prompt, max_tokens)
     )
-    result = parse_json(text)
-    log_usage(db, current_user.id, "writing_correct", tokens, payload.level)
-    return result
+    if stream:
+        return stream_generation(
+            reservation, "writing_correct", system, prompt, max_tokens,
+            {"level": payload.level},
+        )
+    try:
+        result, tokens, cache, model = await generate_cached(
+            "writing_correct", system, prompt, max_tokens
+        )
+        meta = {"cache": cache, **({"model": model} if model else {})}
+        await reservation.commit(
+            db, "writing_correct", tokens,
+            _extra(level=payload.level, **meta, **prompts.template_meta("writing_correct")),
+        )
+        return result
+    except BaseException:
+        await reservation.release(db)
+        raise
 
 
-@router.post("/fill-blanks")
+@router.post("/fill-blanks", response_model=list[FillBlank])
 async def fill_blanks(
     payload: GenerateFillRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    stream: bool = False,
+    current_user: AuthUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    check_quota(db, current_user)
-    text, tokens = await call_claude(
-        "You are an English language teacher. Respond only with valid JSON, no markdown.",
-        f'Create 7 fill-in-the-blank sentences for level {payload.level} focusing on {payload.theme}. '
-        f'Return JSON array: [{{"sentence":"The sentence with ___ for the blank",'
-        f'"answer":"correct word or phrase","explanation":"why this is correct in French"}}] '
-        f'Make sentences varied and natural.',
+    return await _exercise(
+        db, current_user, "fill_generate", payload.theme, payload.level, stream
     )
-    result = parse_json(text)
-    log_usage(db, current_user.id, "fill_generate", tokens, payload.theme)
-    return result
 
 
-@router.post("/reading")
+@router.post("/reading", response_model=ReadingExercise)
 async def reading(
     payload: GenerateReadingRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    stream: bool = False,
+    current_user: AuthUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    check_quota(db, current_user)
-    text, tokens = await call_claude(
-        "You are an English teacher creating reading comprehension exercises. Respond only with valid JSON, no markdown.",
-        f'Create a reading comprehension exercise about "{payload.theme}" at level {payload.level}. '
-        f'Return JSON: {{"title":"article title","text":"article text (200-280 words, level {payload.level})",'
-        f'"questions":[{{"q":"question in English","options":["A","B","C","D"],"answer":number(0-3 index)}}]}} '
-        f'Create exactly 4 questions.',
-        max_tokens=1500,
+    return await _exercise(
+        db, current_user, "reading_generate", payload.theme, payload.level, stream
     )
-    result = parse_json(text)
-    log_usage(db, current_user.id, "reading_generate", tokens, payload.theme)
-    return result
 
 
-@router.post("/flashcards")
+@router.post("/flashcards", response_model=list[Flashcard])
 async def flashcards(
     payload: GenerateFlashcardsRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    stream: bool = False,
+    current_user: AuthUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    check_quota(db, current_user)
-    text, tokens = await call_claude(
-        "You are an English vocabulary teacher. Respond only with valid JSON, no markdown.",
-        f'Generate 10 flashcards for the theme "{payload.theme}" at level {payload.level}. '
-        f'Return JSON array: [{{"word":"English word","pos":"noun/verb/etc","translation":"French translation",'
-        f'"example":"example sentence in English","mnemonic":"memory tip in French or empty string"}}] '
-        f'Make vocabulary authentic and useful for level {payload.level}.',
+    return await _exercise(
+        db, current_user, "flashcards_generate", payload.theme, payload.level, stream
     )
-    result = parse_json(text)
-    log_usage(db, current_user.id, "flashcards_generate", tokens, payload.theme)
-    return result
+
+
+@router.post("/batch", response_model=BatchGenerateResponse)
+async def batch(
+    payload: BatchGenerateRequest,
+    current_user: AuthUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Plusieurs exercices en une requête : un créneau de quota par exercice, résultat ou erreur par exercice."""
+    return await generate_batch(db, current_user, payload.items)
@@ -1,6 +1,6 @@
 from datetime import datetime, date
-from typing import Optional
-from pydantic import BaseModel, EmailStr, field_validator
+from typing import Any, Literal, Optional
+from pydantic import BaseModel, EmailStr, Field, field_validator
 
 
 # ── Auth ─────────────────────────────────────────────────────────────
@@ -39,6 +39,20 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     user_id: Optional[int] = None
+    version: int = 0
+
+
+class AuthUser(BaseModel):
+    """Champs nécessaires à l'autorisation (mis en cache par user id)."""
+    id: int
+    role: str
+    is_active: bool
+    daily_quota: int
+    token_version: int = 0
+    daily_token_budget: Optional[int] = None     # None = valeur par défaut (Settings)
+    monthly_token_budget: Optional[int] = None
+
+    model_config = {"from_attributes": True}
 
 
 class UserOut(BaseModel):
@@ -55,11 +69,23 @@ class UserOut(BaseModel):
 
 # ── Quota ─────────────────────────────────────────────────────────────
 
+class BudgetWindow(BaseModel):
+    used: int
+    budget: Optional[int]       # None = illimité
+    remaining: Optional[int]
+
+
+class TokenBudgetStatus(BaseModel):
+    daily: BudgetWindow
+    monthly: BudgetWindow
+
+
 class QuotaStatus(BaseModel):
     used_today: int
     daily_quota: int
     remaining: int
     reset_at: str   # "midnight"
+    tokens: TokenBudgetStatus
 
 
 # ── Generation requests ───────────────────────────────────────────────
@@ -90,12 +116,99 @@ class CorrectWritingRequest(BaseModel):
     level: str
 
 
+# ── Generation responses ──────────────────────────────────────────────
+# Aussi utilisés pour le responseSchema Gemini (mode JSON, voir structured.py)
+
+class WritingTopic(BaseModel):
+    prompt: str
+    hints: list[str]
+    min_words: int
+
+
+class FillBlank(BaseModel):
+    sentence: str
+    answer: str
+    explanation: str
+
+
+class ReadingQuestion(BaseModel):
+    q: str
+    options: list[str] = Field(min_length=4, max_length=4)
+    answer: int = Field(ge=0, le=3)
+
+
+class ReadingExercise(BaseModel):
+    title: str
+    text: str
+    questions: list[ReadingQuestion]
+
+
+class Flashcard(BaseModel):
+    word: str
+    pos: str
+    translation: str
+    example: str
+    mnemonic: str = ""
+
+
+class CorrectedSentence(BaseModel):
+    original: str
+    corrected: str
+    explanation: str
+
+
+class WritingCorrection(BaseModel):
+    score: int = Field(ge=0, le=100)
+    grammar_score: int = Field(ge=0, le=100)
+    vocabulary_score: int = Field(ge=0, le=100)
+    coherence_score: int = Field(ge=0, le=100)
+    strengths: list[str]
+    improvements: list[str]
+    corrected_sentences: list[CorrectedSentence]
+    overall_comment: str
+
+
+ExerciseType = Literal["writing", "fill_blanks", "reading", "flashcards"]
+
+
+class BatchItem(BaseModel):
+    type: ExerciseType
+    theme: str
+    level: str
+
+
+class BatchGenerateRequest(BaseModel):
+    items: list[BatchItem] = Field(min_length=1)
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    type: ExerciseType
+    theme: str
+    level: str
+    ok: bool
+    result: Optional[Any] = None
+    status: Optional[int] = None     # code d'erreur HTTP si ok = False
+    error: Optional[str] = None
+
+
+class BatchGenerateResponse(BaseModel):
+    items: list[BatchItemResult]
+    upstream_calls: int
+
+
 # ── Admin ─────────────────────────────────────────────────────────────
 
 class UpdateQuota(BaseModel):
     daily_quota: int
 
 
+class UpdateTokenBudget(BaseModel):
+    # None = revenir à la valeur par défaut, 0 = illimité
+    daily_token_budget: Optional[int] = Field(None, ge=0)
+    monthly_token_budget: Optional[int] = Field(None, ge=0)
+
+
 class UsageLogOut(BaseModel):
     id: int
     action: str
@@ -109,3 +222,30 @@ class UsageLogOut(BaseModel):
 
 class UserAdminOut(UserOut):
     usage_today: int = 0
+    tokens_today: int = 0
+    tokens_month: int = 0
+    daily_token_budget: Optional[int] = None
+    monthly_token_budget: Optional[int] = None
+
+
+class UserAdminPage(BaseModel):
+    items: list[UserAdminOut]
+    next_cursor: Optional[str] = None
+
+
+class BulkImportRow(BaseModel):
+    row: int                                  # numéro de ligne (1 = première ligne de données)
+    email: Optional[str] = None
+    username: Optional[str] = None
+    status: Literal["created", "valid", "invalid", "duplicate"]
+    user_id: Optional[int] = None
+    password: Optional[str] = None            # mot de passe généré, affiché une seule fois
+    error: Optional[str] = None
+
+
+class BulkImportReport(BaseModel):
+    created: int
+    rejected: int
+    dry_run: bool
+    seconds: float
+    rows: list[BulkImportRow]
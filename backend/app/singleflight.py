@@ -0,0 +1,45 @@
+"""
+Coalescence des appels identiques en vol (single-flight).
+
+Les appels concurrents avec la même clé partagent une seule tâche upstream :
+le premier (leader) la lance, les suivants attendent son résultat. Seuls
+les appels encore en vol sont partagés : un appel lancé après la fin du
+précédent repart upstream (pool, « régénérer » : on veut un autre exercice).
+
+La tâche upstream est protégée par asyncio.shield : un client qui se
+déconnecte n'annule pas l'appel des autres.
+"""
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """Retourne (résultat, partagé) ; partagé vaut True pour les suiveurs."""
+        task = self._flights.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+        task = asyncio.ensure_future(fn())
+        self._flights[key] = task
+        task.add_done_callback(lambda t: self._forget(key, t))
+        self.leaders += 1
+        return await asyncio.shield(task), False
+
+    def stats(self) -> dict:
+        return {
+            "upstream_calls": self.leaders,
+            "calls_saved": self.coalesced,
+            "in_flight": sum(1 for t in self._flights.values() if not t.done()),
+        }
@@ -0,0 +1,81 @@
+"""
+Démarrage à froid et sondes.
+
+L'import de l'app ne touche ni la base ni le réseau : le lifespan lance
+warm_up() en tâche de fond et l'app accepte le trafic aussitôt. Le
+préchauffage ouvre les connexions du pool (réessayé avec backoff tant que la
+base ne répond pas), la connexion HTTP vers Gemini et charge passlib/bcrypt
+et jose dans un thread.
+
+/api/health (liveness) ne dépend de rien ; /api/ready (readiness) répond 503
+tant que la base n'a pas répondu une première fois, puis vérifie à chaque
+appel qu'elle répond toujours. Sans authentification, elle ne renvoie que
+l'état et le nombre de tentatives : les erreurs de connexion (hôte, nom
+d'utilisateur…) restent dans les logs du serveur.
+"""
+import asyncio
+import logging
+import time
+
+from .auth import warm_up_auth
+from .claude_service import warm_up_http_client
+from .config import get_settings
+from .database import ping_db, warm_up_pool
+
+logger = logging.getLogger(__name__)
+
+_started = time.monotonic()
+_state: dict = {"db": False, "db_attempts": 0}
+
+
+async def _warm_db() -> None:
+    settings = get_settings()
+    delay = 0.5
+    while True:
+        _state["db_attempts"] += 1
+        try:
+            await asyncio.wait_for(
+                warm_up_pool(settings.db_warm_connections), settings.ready_timeout_seconds * 5
+            )
+        except Exception:
+            logger.warning(
+                "Base injoignable (tentative %d), nouvel essai dans %.1f s",
+                _state["db_attempts"], delay, exc_info=True,
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 15.0)
+            continue
+        _state["db"] = True
+        logger.info("Base prête après %d ms", round((time.monotonic() - _started) * 1000))
+        return
+
+
+async def _warm_http() -> None:
+    try:
+        await warm_up_http_client()
+    except Exception:
+        pass   # facultatif : la première génération ouvrira la connexion
+
+
+async def _warm_auth() -> None:
+    await asyncio.to_thread(warm_up_auth)
+
+
+async def warm_up() -> None:
+    global _started
+    _started = time.monotonic()
+    _state.update(db=False, db_attempts=0)
+    await asyncio.gather(_warm_db(), _warm_http(), _warm_auth(), return_exceptions=True)
+
+
+async def readiness() -> tuple[bool, dict]:
+    """(prêt, détail) : la base doit avoir été préchauffée et répondre maintenant."""
+    ready = _state["db"]
+    if ready:
+        try:
+            await asyncio.wait_for(ping_db(), get_settings().ready_timeout_seconds)
+        except Exception:
+            ready = False
+            logger.warning("Readiness : la base ne répond plus", exc_info=True)
+    status = "ready" if ready else "unavailable" if _state["db"] else "starting"
+    return ready, {"status": status, "db_attempts": _state["db_attempts"]}
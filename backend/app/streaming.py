@@ -0,0 +1,241 @@
+"""
+Variantes SSE (?stream=true) des routes de génération.
+
+Le texte de streamGenerateContent passe dans un parseur JSON incrémental qui
+émet chaque élément dès qu'il est complet (une flashcard, une entrée de
+corrected_sentences…). Le créneau de quota est réservé avant ; l'usage est
+journalisé une seule fois quand le flux est terminé, le créneau rendu sinon,
+y compris quand le client se déconnecte (ClosingStreamingResponse).
+"""
+import json
+from typing import AsyncIterator
+
+import anyio
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from . import prompts
+from .cache import response_cache, cache_key
+from .claude_service import GenerationStream, UpstreamUnavailable
+from .structured import parse_response, response_schema
+from .database import AsyncSessionLocal
+from .model_router import model_router
+from .quota import QuotaReservation
+
+
+class IncrementalJSONParser:
+    """
+    Parseur JSON incrémental (un caractère à la fois, sans retour arrière).
+
+    Événements émis par `feed` :
+      - racine tableau : {"index": i, "item": …} pour chaque élément
+      - racine objet   : {"field": clé, "index": i, "item": …} pour chaque élément
+                         d'un tableau de premier niveau, et {"field": clé, "value": …}
+                         pour les autres valeurs de premier niveau
+    Le texte avant la racine (clôtures markdown, prose) est ignoré.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key: str | None = None
+        self._key_start: int | None = None
+        self._starts: dict[int, int] = {}
+        self._counts: dict[int, int] = {}
+        self.done = False
+
+    def _is_target(self) -> bool:
+        if self._stack == ["["] or self._stack == ["{", "["]:
+            return True
+        return self._stack == ["{"] and not self._expect_key
+
+    def _emit(self, end: int, events: list[dict]) -> None:
+        depth = len(self._stack)
+        start = self._starts.pop(depth, None)
+        if start is None:
+            return
+        try:
+            value = json.loads(self._text[start:end])
+        except ValueError:
+            return
+        if self._stack == ["["]:
+            index = self._counts.get(depth, 0)
+            self._counts[depth] = index + 1
+            events.append({"index": index, "item": value})
+        elif self._stack == ["{", "["]:
+            index = self._counts.get(depth, 0)
+            self._counts[depth] = index + 1
+            events.append({"field": self._key, "index": index, "item": value})
+        elif not isinstance(value, list):
+            # Les tableaux de premier niveau ont déjà été émis élément par élément
+            events.append({"field": self._key, "value": value})
+
+    def feed(self, chunk: str) -> list[dict]:
+        events: list[dict] = []
+        offset = len(self._text)
+        self._text += chunk
+        for i in range(offset, len(self._text)):
+            if self.done:
+                break
+            c = self._text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = json.loads(self._text[self._key_start:i + 1])
+                        self._key_start = None
+                    elif self._is_target() and self._starts.get(len(self._stack)) is not None \
+                            and self._text[self._starts[len(self._stack)]] == '"':
+                        self._emit(i + 1, events)
+                continue
+
+            if not self._stack:
+                if c in "[{":
+                    self._stack.append(c)
+                    self._expect_key = c == "{"
+                continue
+
+            if c in " \t\r\n":
+                continue
+
+            if c not in ",:]}" and self._is_target() and len(self._stack) not in self._starts:
+                self._starts[len(self._stack)] = i
+
+            if c == '"':
+                self._in_string = True
+                if self._stack == ["{"] and self._expect_key:
+                    self._key_start = i
+            elif c in "[{":
+                self._stack.append(c)
+            elif c in "]}":
+                if self._is_target():
+                    self._emit(i, events)             # scalaire terminé par la fermeture
+                self._stack.pop()
+                if c == "]" and self._stack == ["{"]:
+                    self._counts.pop(2, None)          # tableau de champ terminé
+                if not self._stack:
+                    self.done = True
+                elif self._is_target():
+                    self._emit(i + 1, events)         # conteneur terminé
+            elif c == ",":
+                if self._is_target():
+                    self._emit(i, events)             # scalaire terminé par la virgule
+                if self._stack == ["{"]:
+                    self._expect_key = True
+            elif c == ":" and self._stack == ["{"]:
+                self._expect_key = False
+        return events
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _events(
+    reservation: QuotaReservation,
+    action: str,
+    system: str,
+    prompt: str,
+    max_tokens: int,
+    fields: dict,
+    pooled: tuple[dict | list, int] | None,
+) -> AsyncIterator[str]:
+    parser = IncrementalJSONParser()
+    tokens = 0
+    meta = dict(fields)
+    model = model_router.model_for(action)
+    try:
+        if pooled is not None:
+            result, tokens = pooled
+            meta["pool"] = "hit"
+            for event in parser.feed(json.dumps(result, ensure_ascii=False)):
+                yield sse("item", event)
+        else:
+            cached = key = None
+            if response_cache.enabled_for(action):
+                key = cache_key(system, prompt, model, max_tokens)
+                cached = await response_cache.get(action, key)
+            if cached is not None:
+                text = cached
+                meta["cache"] = "hit"
+                for event in parser.feed(text):
+                    yield sse("item", event)
+            else:
+                stream = GenerationStream(
+                    system, prompt, max_tokens, model, response_schema(action), action
+                )
+                try:
+                    async for delta in stream:
+                        for event in parser.feed(delta):
+                            yield sse("item", event)
+                    text, tokens = stream.text, stream.tokens
+                    meta["cache"] = "miss" if key else "bypass"
+                    meta["model"] = stream.served_by
+                except UpstreamUnavailable:
+                    # Disjoncteur ouvert : variante en cache s'il y en a une
+                    text = await response_cache.fallback(action, key) if key else None
+                    if text is None:
+                        raise
+                    meta["cache"] = "fallback"
+                    for event in parser.feed(text):
+                        yield sse("item", event)
+            result = parse_response(action, text)
+            if key and meta["cache"] == "miss":
+                await response_cache.put(action, key, text)
+
+        meta["stream"] = True
+        meta.update(prompts.template_meta(action))
+        async with AsyncSessionLocal() as db:
+            await reservation.commit(db, action, tokens, json.dumps(meta, ensure_ascii=False))
+    except HTTPException as exc:
+        yield sse("error", {"status": exc.status_code, "detail": exc.detail})
+        return
+    finally:
+        # Erreur, timeout ou client déconnecté : le créneau est rendu, même
+        # pendant l'annulation du flux (sinon chaque await lèverait CancelledError)
+        if not reservation.done:
+            with anyio.CancelScope(shield=True):
+                async with AsyncSessionLocal() as db:
+                    await reservation.release(db)
+    yield sse("done", result)
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse qui ferme son générateur quoi qu'il arrive. Un client qui
+    se déconnecte annule la tâche pendant que le générateur attend au `yield` :
+    sans aclose() explicite, son `finally` ne s'exécuterait qu'au passage du
+    ramasse-miettes.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+
+
+def stream_generation(
+    reservation: QuotaReservation,
+    action: str,
+    system: str,
+    prompt: str,
+    max_tokens: int,
+    fields: dict,
+    pooled: tuple[dict | list, int] | None = None,
+) -> StreamingResponse:
+    """Réponse SSE : événements `item`, puis `done` (résultat complet) ou `error`."""
+    return ClosingStreamingResponse(
+        _events(reservation, action, system, prompt, max_tokens, fields, pooled),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
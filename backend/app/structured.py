@@ -0,0 +1,199 @@
+"""
+Sorties structurées des générations.
+
+Chaque action a un modèle de réponse Pydantic (schemas.py) qui sert deux fois :
+- côté Gemini, il devient le `responseSchema` du mode JSON
+  (responseMimeType = application/json), converti au sous-ensemble OpenAPI
+  accepté par l'API (pas de $ref, types en majuscules) ;
+- côté serveur, il valide la réponse, qui est renvoyée typée.
+
+Le parsing tolère les clôtures markdown, la prose autour du JSON et les
+tableaux tronqués (max_tokens atteint) : on garde les éléments complets.
+orjson accélère le parsing s'il est installé (optionnel, hors de
+requirements.txt : `pip install orjson`). Les échecs et réparations sont
+comptés par action.
+"""
+import json
+import re
+from collections import Counter
+from typing import Any
+
+from fastapi import HTTPException
+from pydantic import TypeAdapter, ValidationError
+
+from .schemas import FillBlank, Flashcard, ReadingExercise, WritingCorrection, WritingTopic
+
+try:
+    import orjson
+except ImportError:   # backend optionnel
+    orjson = None
+
+RESPONSE_MODELS: dict[str, Any] = {
+    "writing_generate": WritingTopic,
+    "fill_generate": list[FillBlank],
+    "reading_generate": ReadingExercise,
+    "flashcards_generate": list[Flashcard],
+    "writing_correct": WritingCorrection,
+}
+
+_adapters = {action: TypeAdapter(model) for action, model in RESPONSE_MODELS.items()}
+_item_adapters = {
+    action: TypeAdapter(model.__args__[0])
+    for action, model in RESPONSE_MODELS.items()
+    if getattr(model, "__origin__", None) is list
+}
+
+_failures: Counter[str] = Counter()
+_repairs: Counter[str] = Counter()
+
+_FENCE = re.compile(r"```(?:json)?\s*|```")
+
+# Clés JSON Schema reprises telles quelles dans le responseSchema Gemini
+_SCHEMA_KEYS = ("description", "enum", "format", "minimum", "maximum", "minItems", "maxItems")
+
+
+# ── responseSchema ───────────────────────────────────────────────────────
+
+def _to_gemini(node: dict, defs: dict) -> dict:
+    if "$ref" in node:
+        return _to_gemini(defs[node["$ref"].rsplit("/", 1)[-1]], defs)
+    if "anyOf" in node:
+        options = [o for o in node["anyOf"] if o.get("type") != "null"]
+        out = _to_gemini(options[0], defs)
+        if len(options) < len(node["anyOf"]):
+            out["nullable"] = True
+        return out
+    kind = node.get("type", "string")
+    out = {"type": kind.upper()}
+    for key in _SCHEMA_KEYS:
+        if key in node:
+            out[key] = node[key]
+    if kind == "object":
+        props = node.get("properties", {})
+        out["properties"] = {name: _to_gemini(sub, defs) for name, sub in props.items()}
+        out["required"] = node.get("required", [])
+        out["propertyOrdering"] = list(props)
+    elif kind == "array":
+        out["items"] = _to_gemini(node.get("items", {}), defs)
+    return out
+
+
+def response_schema(action: str | None, count: int | None = None) -> dict | None:
+    """
+    responseSchema Gemini de l'action, ou None (action sans modèle).
+    `count` : tableau d'exactement `count` réponses (appels groupés du batch).
+    """
+    adapter = _adapters.get(action)
+    if adapter is None:
+        return None
+    raw = adapter.json_schema()
+    schema = _to_gemini(raw, raw.get("$defs", {}))
+    if count is not None:
+        schema = {"type": "ARRAY", "items": schema, "minItems": count, "maxItems": count}
+    return schema
+
+
+# ── Parsing ──────────────────────────────────────────────────────────────
+
+def _loads(text: str):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def _complete_items(text: str, start: int) -> list | None:
+    """Tableau tronqué : garde les éléments complets (None s'il n'y en a aucun)."""
+    depth = 0
+    in_string = escape = False
+    end = None
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "[{":
+            depth += 1
+        elif c in "]}":
+            depth -= 1
+            if depth == 1:
+                end = i + 1       # élément conteneur terminé
+        elif c == "," and depth == 1:
+            end = i               # élément scalaire terminé
+    if end is None:
+        return None
+    try:
+        items = _loads(text[start:end] + "]")
+    except ValueError:
+        return None
+    return items or None
+
+
+def parse_json(text: str, action: str | None = None) -> dict | list:
+    """JSON de la réponse, en ignorant clôtures et prose ; lève une 502 sinon."""
+    label = action or "unknown"
+    clean = _FENCE.sub("", text).strip()
+    starts = [i for i in (clean.find("{"), clean.find("[")) if i >= 0]
+    if starts:
+        start = min(starts)
+        try:
+            return _loads(clean[start:])
+        except ValueError:
+            pass
+        try:
+            # Prose après le JSON : on s'arrête à la fin de la valeur
+            return json.JSONDecoder().raw_decode(clean, start)[0]
+        except ValueError:
+            pass
+        if clean[start] == "[":
+            items = _complete_items(clean, start)
+            if items is not None:
+                _repairs[label] += 1
+                return items
+    _failures[label] += 1
+    raise HTTPException(status_code=502, detail="Réponse JSON invalide du service de génération")
+
+
+def validate(action: str, data) -> dict | list:
+    """
+    Valide contre le modèle de l'action et retourne la forme JSON normalisée.
+    Pour une liste, les éléments invalides sont écartés (au moins un doit rester).
+    """
+    adapter = _adapters.get(action)
+    if adapter is None:
+        return data
+    try:
+        return adapter.dump_python(adapter.validate_python(data), mode="json")
+    except ValidationError as exc:
+        item_adapter = _item_adapters.get(action)
+        if item_adapter is not None and isinstance(data, list):
+            kept = []
+            for item in data:
+                try:
+                    kept.append(item_adapter.dump_python(item_adapter.validate_python(item), mode="json"))
+                except ValidationError:
+                    continue
+            if kept:
+                _repairs[action] += 1
+                return kept
+        _failures[action] += 1
+        raise HTTPException(
+            status_code=502,
+            detail=f"Réponse du service de génération non conforme: {exc.errors()[0]['msg']}",
+        )
+
+
+def parse_response(action: str, text: str) -> dict | list:
+    """Parse puis valide la réponse d'une action (voir RESPONSE_MODELS)."""
+    return validate(action, parse_json(text, action))
+
+
+def parse_stats() -> dict:
+    return {
+        "orjson": orjson is not None,
+        "failures": dict(_failures),
+        "repaired": dict(_repairs),
+    }
@@ -0,0 +1,166 @@
+"""
+Écriture des UsageLog, synchrone ou différée (write-behind).
+
+En mode "batched", les lignes passent par une file bornée en mémoire ; une
+tâche asyncio la vide par INSERT multi-lignes toutes les N ms ou tous les M
+logs, et la file est vidée à l'arrêt (lifespan). File pleine : le
+producteur attend qu'une place se libère (back-pressure).
+
+Les compteurs de quota et de tokens (voir quota.py) ne passent jamais par
+la file : ils sont tenus à la réservation, donc restent exacts tant que des
+lignes attendent d'être écrites. Seuls les logs et les rollups sont différés.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .database import AsyncSessionLocal
+from .metrics import staged
+from .models import UsageLog
+from .rollups import bump_rollup, created_since
+
+logger = logging.getLogger(__name__)
+
+
+def usage_row(
+    user_id: int, action: str, tokens_used: int, day: date, extra: str | None
+) -> dict:
+    # created_at fixé à la soumission, pas à l'écriture différée
+    return {
+        "user_id": user_id,
+        "action": action,
+        "tokens_used": tokens_used,
+        "log_date": day,
+        "created_at": datetime.utcnow(),
+        "extra": extra,
+    }
+
+
+@staged("log")
+async def write_usage_rows(db: AsyncSession, rows: list[dict]) -> None:
+    """
+    Écrit un lot de logs dans la transaction courante : INSERT multi-lignes,
+    rollups agrégés par (jour, action) (une upsert par clé).
+    """
+    keys = {(r["user_id"], r["log_date"], r["action"]) for r in rows}
+    # Premier log du jour pour (utilisateur, action) ? sondage sur l'index composite
+    seen = set(
+        (
+            await db.execute(
+                select(UsageLog.user_id, UsageLog.log_date, UsageLog.action)
+                .where(
+                    tuple_(UsageLog.user_id, UsageLog.log_date, UsageLog.action).in_(keys),
+                    UsageLog.created_at >= created_since(min(day for _, day, _ in keys)),
+                )
+                .distinct()
+            )
+        ).all()
+    )
+
+    rollups: dict[tuple, list[int]] = defaultdict(lambda: [0, 0, 0])
+    for r in rows:
+        agg = rollups[(r["log_date"], r["action"])]
+        agg[0] += 1
+        agg[1] += r["tokens_used"]
+    for user_id, day, action in keys - seen:
+        rollups[(day, action)][2] += 1
+
+    await db.execute(insert(UsageLog), rows)
+    for (day, action), (calls, toks, new_users) in rollups.items():
+        await bump_rollup(db, day, action, calls, toks, new_users)
+
+
+class UsageLogWriter:
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def submit(self, row: dict) -> None:
+        # Back-pressure : attend une place si la file est pleine
+        await self._queue.put(row)
+
+    async def _write_batch(self, batch: list[dict]) -> None:
+        for attempt in range(3):
+            try:
+                async with AsyncSessionLocal() as db:
+                    await write_usage_rows(db, batch)
+                    await db.commit()
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except Exception as exc:
+                logger.warning("UsageLog: échec d'écriture du lot (%s), essai %d", exc, attempt + 1)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        self.dropped += len(batch)
+        logger.error("UsageLog: %d logs perdus après 3 essais", len(batch))
+
+    async def _run(self) -> None:
+        settings = get_settings()
+        flush_s = settings.usage_log_flush_ms / 1000
+        while True:
+            row = await self._queue.get()
+            if row is None:   # sentinelle d'arrêt
+                return
+            batch = [row]
+            deadline = time.monotonic() + flush_s
+            while len(batch) < settings.usage_log_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    await self._write_batch(batch)
+                    return
+                batch.append(row)
+            await self._write_batch(batch)
+
+    async def start(self) -> None:
+        settings = get_settings()
+        if settings.usage_log_mode != "batched" or self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=settings.usage_log_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Vide la file (flush) puis arrête la tâche ; appelé par le lifespan."""
+        if self._task is None:
+            return
+        task, self._task = self._task, None   # les nouveaux logs repassent en synchrone
+        await self._queue.put(None)
+        await task
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+        }
+
+
+usage_writer = UsageLogWriter()
+
+
+async def record_usage(db: AsyncSession, row: dict) -> None:
+    """Écrit le log tout de suite (mode sync) ou le met en file (mode batched)."""
+    if usage_writer.running:
+        await usage_writer.submit(row)
+    else:
+        await write_usage_rows(db, [row])
+        await db.commit()
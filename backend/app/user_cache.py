@@ -0,0 +1,55 @@
+"""
+Cache des utilisateurs authentifiés (TTL + LRU, par process).
+
+Ne contient que les champs utiles à l'autorisation : un hit évite le
+SELECT sur users à chaque requête authentifiée. Invalidé par les mutations
+admin ; le claim `ver` du JWT fait rejeter une entrée plus ancienne que le token.
+"""
+import time
+from collections import OrderedDict
+
+from .config import get_settings
+from .schemas import AuthUser
+
+
+class UserCache:
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[int, tuple[float, AuthUser]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> AuthUser | None:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user: AuthUser) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        self._entries[user.id] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(user.id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "size": len(self._entries),
+        }
+
+
+_settings = get_settings()
+user_cache = UserCache(_settings.auth_cache_max_entries, _settings.auth_cache_ttl_seconds)
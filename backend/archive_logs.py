@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Archive les logs d'usage antérieurs à la rétention, mois par mois (created_at).
+
+Pour chaque mois complet plus ancien que USAGE_LOG_RETENTION_MONTHS :
+1. complète les rollups journaliers depuis les logs du mois (le dashboard admin
+   ne relit jamais les logs archivés) ;
+2. écrit les logs dans USAGE_LOG_ARCHIVE_DIR/usage_logs_AAAA_MM.ndjson.gz
+   (ou .parquet, pyarrow requis) et vérifie le nombre de lignes ;
+3. les supprime de la base : DETACH + DROP de la partition sur Postgres,
+   DELETE par lots sur SQLite (et pour la partition par défaut).
+
+Usage : python archive_logs.py [--months 12] [--format ndjson|parquet] [--dry-run]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from sqlalchemy import delete, func, select, text
+
+from app.config import get_settings
+from app.database import AsyncSessionLocal, dialect_insert, dispose_engines, get_async_engine
+from app.models import UsageDailyRollup, UsageLog
+from app.partitions import LIST_PARTITIONS_SQL, add_months, month_start, partition_name
+
+settings = get_settings()
+
+_BATCH = 5000
+_table = UsageLog.__table__
+
+
+def _bounds(month: date) -> tuple[datetime, datetime]:
+    return datetime.combine(month, time.min), datetime.combine(add_months(month, 1), time.min)
+
+
+def _in_month(month: date):
+    start, end = _bounds(month)
+    return (UsageLog.created_at >= start) & (UsageLog.created_at < end)
+
+
+async def months_to_archive(retention: int) -> list[date]:
+    """Mois (1er du mois) dont tous les logs sont antérieurs à la fenêtre de rétention."""
+    cutoff = add_months(month_start(datetime.utcnow().date()), -retention)
+    async with AsyncSessionLocal() as db:
+        oldest = await db.scalar(select(func.min(UsageLog.created_at)))
+    if oldest is None:
+        return []
+    months, month = [], month_start(oldest.date())
+    while month < cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+async def refresh_rollups(month: date) -> int:
+    """
+    Complète les rollups des jours du mois depuis les logs encore en base.
+    Jamais à la baisse : un jour à cheval sur un mois déjà archivé garde ses
+    compteurs.
+    """
+    start, end = _bounds(month)
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(
+                UsageLog.log_date,
+                UsageLog.action,
+                func.count(UsageLog.id),
+                func.coalesce(func.sum(UsageLog.tokens_used), 0),
+                func.count(func.distinct(UsageLog.user_id)),
+            )
+            .where(
+                UsageLog.log_date >= month, UsageLog.log_date < add_months(month, 1),
+                UsageLog.created_at >= start - timedelta(days=1),
+                UsageLog.created_at < end + timedelta(days=1),
+            )
+            .group_by(UsageLog.log_date, UsageLog.action)
+        )).all()
+        existing = {
+            (r.day, r.action): r.calls
+            for r in await db.scalars(select(UsageDailyRollup).where(
+                UsageDailyRollup.day >= month, UsageDailyRollup.day < add_months(month, 1)
+            ))
+        }
+        fixed = 0
+        for day, action, calls, tokens, users in rows:
+            if existing.get((day, action), -1) >= calls:
+                continue
+            stmt = dialect_insert(db)(UsageDailyRollup).values(
+                day=day, action=action, calls=calls, tokens=tokens, distinct_users=users
+            )
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=[UsageDailyRollup.day, UsageDailyRollup.action],
+                set_={
+                    "calls": stmt.excluded.calls,
+                    "tokens": stmt.excluded.tokens,
+                    "distinct_users": stmt.excluded.distinct_users,
+                },
+            ))
+            fixed += 1
+        await db.commit()
+    return fixed
+
+
+def _json_row(row) -> str:
+    return json.dumps(
+        {k: v.isoformat() if isinstance(v, (date, datetime)) else v for k, v in row._mapping.items()},
+        ensure_ascii=False,
+    )
+
+
+async def export_month(month: date, directory: Path, fmt: str) -> tuple[Path, int]:
+    """Écrit les logs du mois dans un fichier d'archive ; retourne (chemin, lignes écrites)."""
+    suffix = ".ndjson.gz" if fmt == "ndjson" else ".parquet"
+    path = directory / f"{partition_name(month)}{suffix}"
+    tmp = path.with_name(path.name + ".tmp")
+    written = 0
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            select(_table).where(_in_month(month)).order_by(UsageLog.created_at, UsageLog.id)
+            .execution_options(yield_per=_BATCH)
+        )
+        if fmt == "ndjson":
+            with gzip.open(tmp, "wt", encoding="utf-8") as out:
+                async for row in result:
+                    out.write(_json_row(row) + "\n")
+                    written += 1
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = pa.schema([
+                ("id", pa.int64()), ("user_id", pa.int64()), ("action", pa.string()),
+                ("tokens_used", pa.int64()), ("log_date", pa.date32()),
+                ("created_at", pa.timestamp("us")), ("extra", pa.string()),
+            ])
+            with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+                async for partition in result.partitions():
+                    batch = [dict(row._mapping) for row in partition]
+                    writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                    written += len(batch)
+    os.replace(tmp, path)
+    return path, written
+
+
+async def purge_month(month: date) -> int:
+    """Supprime les logs du mois : partition entière sur Postgres, puis DELETE par lots."""
+    engine = get_async_engine()
+    removed = 0
+    if engine.dialect.name == "postgresql":
+        async with engine.begin() as conn:
+            partitions = set((await conn.execute(LIST_PARTITIONS_SQL)).scalars())
+            name = partition_name(month)
+            if name in partitions:
+                removed = (await conn.execute(text(f"SELECT count(*) FROM {name}"))).scalar()
+                await conn.execute(text(f"ALTER TABLE usage_logs DETACH PARTITION {name}"))
+                await conn.execute(text(f"DROP TABLE {name}"))
+    # SQLite, ou lignes tombées dans la partition par défaut
+    while True:
+        async with AsyncSessionLocal() as db:
+            batch = select(UsageLog.id).where(_in_month(month)).limit(_BATCH).scalar_subquery()
+            deleted = (await db.execute(delete(UsageLog).where(UsageLog.id.in_(batch)))).rowcount
+            await db.commit()
+        removed += deleted
+        if deleted < _BATCH:
+            return removed
+
+
+async def archive(retention: int, directory: Path, fmt: str, dry_run: bool) -> None:
+    months = await months_to_archive(retention)
+    if not months:
+        print(f"✅ Rien à archiver (rétention : {retention} mois).")
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    for month in months:
+        async with AsyncSessionLocal() as db:
+            expected = await db.scalar(select(func.count()).select_from(_table).where(_in_month(month)))
+        if dry_run:
+            print(f"{month:%Y-%m} : {expected} logs à archiver")
+            continue
+        fixed = await refresh_rollups(month)
+        path, written = await export_month(month, directory, fmt)
+        if written != expected:
+            print(f"❌ {month:%Y-%m} : {written} lignes écrites pour {expected} attendues, base inchangée.")
+            sys.exit(1)
+        removed = await purge_month(month)
+        print(f"✅ {month:%Y-%m} : {written} logs → {path} ({removed} supprimés, {fixed} rollups complétés)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--months", type=int, default=settings.usage_log_retention_months,
+                        help="mois complets conservés en base (défaut : USAGE_LOG_RETENTION_MONTHS)")
+    parser.add_argument("--output-dir", default=settings.usage_log_archive_dir)
+    parser.add_argument("--format", choices=("ndjson", "parquet"), default="ndjson")
+    parser.add_argument("--dry-run", action="store_true", help="liste les mois sans rien modifier")
+    args = parser.parse_args()
+
+    if args.months <= 0:
+        print("❌ Rétention désactivée (USAGE_LOG_RETENTION_MONTHS=0) : rien à archiver.")
+        sys.exit(1)
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("❌ Le format parquet nécessite pyarrow (pip install pyarrow).")
+            sys.exit(1)
+
+    async def run():
+        get_async_engine()   # lie AsyncSessionLocal
+        try:
+            await archive(args.months, Path(args.output_dir), args.format, args.dry_run)
+        finally:
+            await dispose_engines()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
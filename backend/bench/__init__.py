@@ -0,0 +1,4 @@
+"""
+Banc de charge hors ligne : faux serveur Gemini, base de test peuplée et
+scénarios qui pilotent la vraie app FastAPI (voir run.py).
+"""
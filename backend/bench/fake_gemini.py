@@ -0,0 +1,203 @@
+"""
+Faux serveur Gemini pour les benchmarks : aucun token réel dépensé.
+
+Implémente generateContent, streamGenerateContent (SSE) et la liste des
+modèles, sous /v1beta (GEMINI_BASE_URL=http://127.0.0.1:<port>/v1beta).
+La réponse est fabriquée depuis le responseSchema de la requête (mode JSON,
+GEMINI_JSON_MODE=true par défaut) : elle est donc valide pour toutes les
+actions, appels groupés du batch compris.
+
+Réglages (options en ligne de commande) :
+- latence : log-normale de médiane --latency-ms et de dispersion --latency-sigma
+  (0 = fixe), bornée par --latency-max-ms ;
+- erreurs : --error-rate (503) et --rate-limit-rate (429 avec Retry-After) ;
+- tokens : entrée ≈ longueur du prompt / 4, sortie --output-tokens ;
+- réponses groupées du batch (schéma à minItems) : --packed-keep, part du texte
+  renvoyée (< 1 : tableau tronqué, comme une sortie coupée par maxOutputTokens).
+Les réglages se modifient aussi à chaud : POST /config {"error_rate": 0.3} (tests).
+
+Usage : python -m bench.fake_gemini --port 8765 --latency-ms 800 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class FakeConfig:
+    def __init__(
+        self,
+        latency_ms: float = 800.0,
+        latency_sigma: float = 0.4,
+        latency_max_ms: float = 30_000.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        output_tokens: int = 600,
+        stream_chunks: int = 8,
+        packed_keep: float = 1.0,
+        seed: int | None = None,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.latency_max_ms = latency_max_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.output_tokens = output_tokens
+        self.stream_chunks = stream_chunks
+        self.packed_keep = packed_keep
+        self.random = random.Random(seed)
+
+    def latency(self) -> float:
+        """Latence d'un appel (s)."""
+        ms = self.latency_ms
+        if self.latency_sigma > 0:
+            ms = self.random.lognormvariate(math.log(max(ms, 1.0)), self.latency_sigma)
+        return min(ms, self.latency_max_ms) / 1000
+
+    def failure(self) -> JSONResponse | None:
+        draw = self.random.random()
+        if draw < self.error_rate:
+            return JSONResponse({"error": {"code": 503, "status": "UNAVAILABLE"}}, status_code=503)
+        if draw < self.error_rate + self.rate_limit_rate:
+            return JSONResponse(
+                {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}},
+                status_code=429,
+                headers={"Retry-After": "1"},
+            )
+        return None
+
+
+# ── Réponses ─────────────────────────────────────────────────────────────
+
+_WORDS = ("apple", "river", "journey", "quiet", "bright", "window", "garden", "travel")
+
+
+def fake_value(schema: dict, rnd: random.Random):
+    """Valeur conforme à un responseSchema Gemini (sous-ensemble OpenAPI)."""
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type", "STRING").upper()
+    if kind == "OBJECT":
+        return {name: fake_value(sub, rnd) for name, sub in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        count = schema.get("minItems", min(3, schema.get("maxItems", 3)))
+        return [fake_value(schema.get("items", {}), rnd) for _ in range(count)]
+    if kind in ("INTEGER", "NUMBER"):
+        low = schema.get("minimum", 0)
+        high = schema.get("maximum", low + 100)
+        value = rnd.uniform(low, high)
+        return int(value) if kind == "INTEGER" else round(value, 2)
+    if kind == "BOOLEAN":
+        return rnd.random() < 0.5
+    return " ".join(rnd.choice(_WORDS) for _ in range(4))
+
+
+def _prompt_text(payload: dict) -> str:
+    parts = [p.get("text", "") for c in payload.get("contents", []) for p in c.get("parts", [])]
+    system = payload.get("system_instruction") or payload.get("systemInstruction") or {}
+    parts += [p.get("text", "") for p in system.get("parts", [])]
+    return "".join(parts)
+
+
+def _usage(config: FakeConfig, payload: dict) -> dict:
+    prompt = len(_prompt_text(payload)) // 4
+    return {
+        "promptTokenCount": prompt,
+        "candidatesTokenCount": config.output_tokens,
+        "totalTokenCount": prompt + config.output_tokens,
+    }
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="Faux Gemini (benchmarks)")
+    stats = {"calls": 0, "errors": 0}
+
+    @app.get("/v1beta/models")
+    async def list_models():
+        return {"models": [{"name": "models/fake"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/config")
+    async def update_config(request: Request):
+        for name, value in (await request.json()).items():
+            if name != "random" and hasattr(config, name):
+                setattr(config, name, value)
+        return {name: value for name, value in vars(config).items() if name != "random"}
+
+    @app.post("/v1beta/models/{model_action}")
+    async def generate(model_action: str, request: Request):
+        payload = await request.json()
+        stats["calls"] += 1
+        await asyncio.sleep(config.latency())
+        failure = config.failure()
+        if failure is not None:
+            stats["errors"] += 1
+            return failure
+
+        schema = payload.get("generationConfig", {}).get("responseSchema") or {"type": "OBJECT"}
+        text = json.dumps(fake_value(schema, config.random))
+        if "minItems" in schema and config.packed_keep < 1:
+            text = text[:int(len(text) * config.packed_keep)]
+        usage = _usage(config, payload)
+        version = model_action.split(":", 1)[0]
+        if not model_action.endswith(":streamGenerateContent"):
+            return {
+                "candidates": [{"content": {"parts": [{"text": text}]}}],
+                "usageMetadata": usage,
+                "modelVersion": version,
+            }
+
+        async def events():
+            size = max(1, math.ceil(len(text) / config.stream_chunks))
+            for i in range(0, len(text), size):
+                chunk = {
+                    "candidates": [{"content": {"parts": [{"text": text[i:i + size]}]}}],
+                    "modelVersion": version,
+                }
+                if i + size >= len(text):
+                    chunk["usageMetadata"] = usage
+                yield f"data: {json.dumps(chunk)}\r\n\r\n"
+                await asyncio.sleep(0)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.4)
+    parser.add_argument("--latency-max-ms", type=float, default=30_000.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--output-tokens", type=int, default=600)
+    parser.add_argument("--packed-keep", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    config = FakeConfig(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        latency_max_ms=args.latency_max_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        output_tokens=args.output_tokens,
+        packed_keep=args.packed_keep,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Scénarios de charge contre la vraie app FastAPI, Gemini remplacé par bench.fake_gemini.
+
+Par défaut : peuple une base SQLite dédiée (bench.seed), démarre le faux Gemini
+et l'app (uvicorn) en sous-process, attend /api/ready puis joue les scénarios :
+- login_storm : connexions simultanées d'élèves différents (bcrypt + auth) ;
+- classroom_burst : une classe entière demande /api/generate/flashcards au même
+  moment, sur le même thème (déduplication, cache, pool, quotas) ;
+- admin_polling : tableau de bord admin (stats, users, upstream) rafraîchi en boucle.
+
+Chaque scénario rapporte p50/p95/p99/max, débit et codes HTTP. Les résultats
+sont écrits en JSON dans bench/results/ (réglages et commit git compris) ;
+--compare <fichier.json> affiche l'écart avec une exécution précédente et
+sort en erreur si une latence ou le débit régresse au-delà de --threshold.
+
+Usage :
+    python -m bench.run --users 500 --logs 50000 --concurrency 30
+    python -m bench.run --scenarios classroom_burst --app-env POOL_ENABLED=false \\
+        --compare bench/results/20261018-101500.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from .seed import ADMIN_EMAIL, BACKEND_DIR, BENCH_PASSWORD, seed, student_email
+
+RESULTS_DIR = BACKEND_DIR / "bench" / "results"
+SCENARIOS = ("login_storm", "classroom_burst", "admin_polling")
+ADMIN_PATHS = ("/api/admin/stats", "/api/admin/users", "/api/admin/upstream")
+COMPARED = ("p50", "p95", "p99")
+
+
+# ── Mesures ──────────────────────────────────────────────────────────────
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Percentile au rang le plus proche (valeurs triées)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    """Latences et statuts d'un scénario."""
+
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.statuses: dict[str, int] = {}
+        self.started = self.finished = 0.0
+
+    async def call(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = str(response.status_code)
+        except httpx.HTTPError as exc:
+            response, status = None, type(exc).__name__
+        self.latencies.append(time.perf_counter() - start)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        return response
+
+    def summary(self) -> dict:
+        values = sorted(self.latencies)
+        elapsed = max(self.finished - self.started, 1e-9)
+        errors = sum(n for status, n in self.statuses.items() if not status.startswith("2"))
+        return {
+            "requests": len(values),
+            "errors": errors,
+            "statuses": dict(sorted(self.statuses.items())),
+            "seconds": round(elapsed, 3),
+            "throughput": round(len(values) / elapsed, 2),
+            **{f"p{q}": round(percentile(values, q) * 1000, 1) for q in (50, 95, 99)},
+            "max": round(values[-1] * 1000, 1) if values else 0.0,
+        }
+
+
+async def _run(recorder: Recorder, jobs: list, concurrency: int) -> dict:
+    """Exécute les coroutines `jobs` (fabriques sans argument) avec au plus `concurrency` en vol."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(job):
+        async with semaphore:
+            await job()
+
+    recorder.started = time.perf_counter()
+    await asyncio.gather(*(limited(job) for job in jobs))
+    recorder.finished = time.perf_counter()
+    return recorder.summary()
+
+
+async def _login(client: httpx.AsyncClient, email: str) -> str:
+    response = await client.post("/api/auth/login", json={"email": email, "password": BENCH_PASSWORD})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+# ── Scénarios ────────────────────────────────────────────────────────────
+
+async def login_storm(client: httpx.AsyncClient, args) -> dict:
+    recorder = Recorder()
+    payloads = [
+        {"email": student_email(i % args.users), "password": BENCH_PASSWORD}
+        for i in range(args.requests)
+    ]
+    jobs = [
+        (lambda p=p: recorder.call(client, "POST", "/api/auth/login", json=p)) for p in payloads
+    ]
+    return await _run(recorder, jobs, args.concurrency)
+
+
+async def classroom_burst(client: httpx.AsyncClient, args) -> dict:
+    # Connexion des élèves hors chronométrage
+    class_size = min(args.concurrency, args.users)
+    tokens = await asyncio.gather(*(_login(client, student_email(i)) for i in range(class_size)))
+    recorder = Recorder()
+    jobs = []
+    for n in range(args.requests):
+        headers = {"Authorization": f"Bearer {tokens[n % class_size]}"}
+        body = {"theme": f"bench theme {n % args.distinct_themes}", "level": "B1"}
+        jobs.append(lambda h=headers, b=body: recorder.call(
+            client, "POST", "/api/generate/flashcards", json=b, headers=h
+        ))
+    return await _run(recorder, jobs, class_size)
+
+
+async def admin_polling(client: httpx.AsyncClient, args) -> dict:
+    headers = {"Authorization": f"Bearer {await _login(client, ADMIN_EMAIL)}"}
+    recorder = Recorder()
+    jobs = [
+        (lambda path=ADMIN_PATHS[n % len(ADMIN_PATHS)]: recorder.call(client, "GET", path, headers=headers))
+        for n in range(args.requests)
+    ]
+    return await _run(recorder, jobs, args.admin_concurrency)
+
+
+# ── Processus ────────────────────────────────────────────────────────────
+
+def _spawn(module_args: list[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", *module_args], cwd=BACKEND_DIR, env=env)
+
+
+async def _wait_ready(url: str, processes: list[subprocess.Popen], timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if any(p.poll() is not None for p in processes):
+                raise RuntimeError(f"un sous-process s'est arrêté avant que {url} ne réponde")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} ne répond pas après {timeout:.0f}s")
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ── Comparaison ──────────────────────────────────────────────────────────
+
+def compare(current: dict, previous: dict, threshold: float) -> list[str]:
+    """Affiche les écarts par scénario ; retourne la liste des régressions."""
+    regressions = []
+    for name, now in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        print(f"\n{name} (avant → après)")
+        for key in COMPARED + ("throughput",):
+            old, new = before.get(key, 0), now.get(key, 0)
+            delta = (new - old) / old if old else 0.0
+            print(f"  {key:<10} {old:>10} → {new:<10} {delta:+.1%}")
+            worse = delta < -threshold if key == "throughput" else delta > threshold
+            if worse:
+                regressions.append(f"{name}.{key} {delta:+.1%}")
+    return regressions
+
+
+# ── CLI ──────────────────────────────────────────────────────────────────
+
+async def _scenarios(args) -> dict:
+    results = {}
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.admin_concurrency) + 10)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        for name in args.scenarios:
+            results[name] = await globals()[name](client, args)
+            print(f"{name}: {json.dumps(results[name])}")
+        try:
+            fake = await client.get(f"http://127.0.0.1:{args.fake_port}/stats")
+            results_fake = fake.json()
+        except httpx.HTTPError:
+            results_fake = None
+    return {"scenarios": results, "fake_gemini": results_fake}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="requêtes par scénario")
+    parser.add_argument("--concurrency", type=int, default=30, help="taille de la classe / connexions simultanées")
+    parser.add_argument("--admin-concurrency", type=int, default=4)
+    parser.add_argument("--distinct-themes", type=int, default=1, help="thèmes différents dans classroom_burst")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    # Base de test
+    parser.add_argument("--database-url", default=f"sqlite:///{RESULTS_DIR / 'bench.sqlite'}")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--logs", type=int, default=50_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--skip-seed", action="store_true", help="réutilise la base existante")
+    # Processus
+    parser.add_argument("--url", default=None, help="app déjà démarrée (pas de sous-process)")
+    parser.add_argument("--app-port", type=int, default=8010)
+    parser.add_argument("--fake-port", type=int, default=8765)
+    parser.add_argument("--app-env", action="append", default=[], metavar="CLE=VALEUR",
+                        help="variable d'environnement de l'app (répétable)")
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.4)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--output-tokens", type=int, default=600)
+    # Résultats
+    parser.add_argument("--output", default=None, help="fichier JSON (défaut : bench/results/<horodatage>.json)")
+    parser.add_argument("--compare", default=None, help="JSON d'une exécution précédente")
+    parser.add_argument("--threshold", type=float, default=0.10, help="régression tolérée (0.10 = 10 %%)")
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"scénarios inconnus : {', '.join(sorted(unknown))}")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    seeded = None
+    processes: list[subprocess.Popen] = []
+    try:
+        if args.url is None:
+            if not args.skip_seed:
+                if args.database_url.startswith("sqlite:///"):
+                    Path(args.database_url.removeprefix("sqlite:///")).unlink(missing_ok=True)
+                seeded = seed(args.database_url, args.users, args.logs, args.days)
+                print(f"seed: {json.dumps(seeded)}")
+            env = {
+                **os.environ,
+                "DATABASE_URL": args.database_url,
+                "GEMINI_BASE_URL": f"http://127.0.0.1:{args.fake_port}/v1beta",
+                "GEMINI_API_KEY": "bench",
+                "SECRET_KEY": os.environ.get("SECRET_KEY", "bench-secret-key"),
+                # Tout le trafic vient d'une seule IP : à réactiver via --app-env pour le mesurer
+                "RATE_LIMIT_ENABLED": "false",
+            }
+            env.update(item.split("=", 1) for item in args.app_env)
+            processes.append(_spawn([
+                "bench.fake_gemini", "--port", str(args.fake_port),
+                "--latency-ms", str(args.latency_ms), "--latency-sigma", str(args.latency_sigma),
+                "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+                "--output-tokens", str(args.output_tokens),
+            ], env))
+            processes.append(_spawn([
+                "uvicorn", "app.main:app", "--port", str(args.app_port), "--log-level", "warning",
+            ], env))
+            args.url = f"http://127.0.0.1:{args.app_port}"
+            asyncio.run(_wait_ready(f"http://127.0.0.1:{args.fake_port}/stats", processes))
+        asyncio.run(_wait_ready(f"{args.url}/api/ready", processes))
+        report = asyncio.run(_scenarios(args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "seed": seeded,
+        **report,
+    }
+    output = Path(args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    output.write_text(json.dumps(report, indent=2))
+    print(f"résultats : {output}")
+
+    if args.compare:
+        regressions = compare(report, json.loads(Path(args.compare).read_text()), args.threshold)
+        if regressions:
+            print(f"\nRégressions (> {args.threshold:.0%}) : {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
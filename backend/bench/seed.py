@@ -0,0 +1,156 @@
+"""
+Base de benchmark : schéma Alembic puis N utilisateurs et M logs d'usage.
+
+Les logs sont répartis sur les `days` derniers jours ; compteurs journaliers
+et mensuels, compteurs globaux et rollups sont calculés à partir des mêmes
+logs, comme si l'app les avait écrits. Tous les comptes partagent le mot de
+passe BENCH_PASSWORD (un seul hachage bcrypt).
+
+Usage : python -m bench.seed --database-url sqlite:///bench.sqlite --users 2000 --logs 200000
+(SQLite ou Postgres local ; la base est supposée dédiée au banc.)
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BENCH_PASSWORD = "bench-password"
+ADMIN_EMAIL = "admin@bench.example.com"
+
+ACTIONS = ("writing_generate", "fill_generate", "reading_generate", "flashcards_generate", "writing_correct")
+THEMES = ("travel", "food", "work", "sports", "music", "environment", "technology", "family")
+LEVELS = ("A2", "B1", "B2", "C1")
+
+
+def student_email(i: int) -> str:
+    return f"student{i}@bench.example.com"
+
+
+def _migrate(database_url: str) -> None:
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(str(BACKEND_DIR / "alembic.ini"))
+    config.set_main_option("script_location", str(BACKEND_DIR / "alembic"))
+    config.set_main_option("sqlalchemy.url", database_url)
+    command.upgrade(config, "head")
+
+
+def seed(database_url: str, users: int, logs: int, days: int = 30, seed: int = 42) -> dict:
+    """Crée le schéma et peuple la base ; retourne un résumé."""
+    # Les réglages de l'app sont lus à l'import : l'URL doit être posée avant
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from sqlalchemy import insert
+
+    from app.auth import hash_password
+    from app.database import get_engine
+    from app.models import (
+        DailyUsageCounter, GlobalUsageCounter, MonthlyUsageCounter,
+        UsageDailyRollup, UsageLog, User, UserRole,
+    )
+    from app.quota import QUOTA_ACTIONS
+
+    started = time.perf_counter()
+    _migrate(database_url)
+    rnd = random.Random(seed)
+    hashed = hash_password(BENCH_PASSWORD)
+    now = datetime.utcnow()
+    today = date.today()
+
+    engine = get_engine()
+    with engine.begin() as conn:
+        rows = [{
+            "email": ADMIN_EMAIL, "username": "bench-admin", "hashed_password": hashed,
+            "role": UserRole.admin, "is_active": True, "daily_quota": 9999,
+            "token_version": 0, "created_at": now - timedelta(days=days + 1),
+        }]
+        rows += [{
+            "email": student_email(i), "username": f"student{i}", "hashed_password": hashed,
+            "role": UserRole.user, "is_active": True, "daily_quota": 50,
+            "token_version": 0, "created_at": now - timedelta(minutes=users - i),
+        } for i in range(users)]
+        conn.execute(insert(User), rows)
+        first_id = conn.scalar(User.__table__.select().with_only_columns(User.id).where(
+            User.email == student_email(0)
+        ))
+
+    daily: dict[tuple, list[int]] = defaultdict(lambda: [0, 0])
+    monthly: dict[tuple, int] = defaultdict(int)
+    global_tokens: dict[tuple, int] = defaultdict(int)
+    rollups: dict[tuple, list] = defaultdict(lambda: [0, 0, set()])
+    batch: list[dict] = []
+
+    with engine.begin() as conn:
+        for n in range(logs):
+            user_id = first_id + rnd.randrange(users)
+            day = today - timedelta(days=rnd.randrange(days))
+            action = rnd.choice(ACTIONS)
+            tokens = rnd.randint(300, 1500)
+            created = datetime.combine(day, datetime.min.time()) + timedelta(seconds=rnd.randrange(86400))
+            batch.append({
+                "user_id": user_id, "action": action, "tokens_used": tokens, "log_date": day,
+                "created_at": created,
+                "extra": f'{{"theme": "{rnd.choice(THEMES)}", "level": "{rnd.choice(LEVELS)}"}}',
+            })
+            counter = daily[(user_id, day)]
+            counter[0] += int(action in QUOTA_ACTIONS)
+            counter[1] += tokens
+            month = day.replace(day=1)
+            monthly[(user_id, month)] += tokens
+            global_tokens[("day", day)] += tokens
+            global_tokens[("month", month)] += tokens
+            rollup = rollups[(day, action)]
+            rollup[0] += 1
+            rollup[1] += tokens
+            rollup[2].add(user_id)
+            if len(batch) >= 5000:
+                conn.execute(insert(UsageLog), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(UsageLog), batch)
+
+        if daily:
+            conn.execute(insert(DailyUsageCounter), [
+                {"user_id": u, "day": d, "count": c, "tokens": t} for (u, d), (c, t) in daily.items()
+            ])
+            conn.execute(insert(MonthlyUsageCounter), [
+                {"user_id": u, "month": m, "tokens": t} for (u, m), t in monthly.items()
+            ])
+            conn.execute(insert(GlobalUsageCounter), [
+                {"granularity": g, "period_start": p, "tokens": t} for (g, p), t in global_tokens.items()
+            ])
+            conn.execute(insert(UsageDailyRollup), [
+                {"day": d, "action": a, "calls": c, "tokens": t, "distinct_users": len(us)}
+                for (d, a), (c, t, us) in rollups.items()
+            ])
+    engine.dispose()
+    return {
+        "users": users,
+        "logs": logs,
+        "days": days,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite:///bench.sqlite")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--logs", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    print(seed(args.database_url, args.users, args.logs, args.days, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,17 @@
 """
 Script d'initialisation : crée le premier compte admin.
 Usage : python create_admin.py
+
+Import d'une liste de classe (CSV ou JSON, voir app/roster.py) :
+        python create_admin.py --roster classe.csv [--dry-run] [--report rapport.json]
 """
+import argparse
+import asyncio
+import json
 import sys, os
 sys.path.insert(0, os.path.dirname(__file__))
 
-from app.database import SessionLocal
+from app.database import SessionLocal, get_engine
 from app.models import User, UserRole
 from app.auth import hash_password
 from app.config import get_settings
@@ -14,7 +20,39 @@ from app.config import get_settings
 settings = get_settings()
 
 
-def main():
+def import_roster_file(path: str, dry_run: bool, report_path: str | None):
+    from app.database import AsyncSessionLocal, dispose_engines, get_async_engine
+    from app.roster import RosterError, import_roster, parse_roster, roster_format
+
+    async def run():
+        get_async_engine()
+        try:
+            async with AsyncSessionLocal() as db:
+                with open(path, "rb") as f:
+                    rows = parse_roster(f.read(), roster_format(None, path))
+                return await import_roster(db, rows, dry_run=dry_run)
+        finally:
+            await dispose_engines()
+
+    try:
+        report = asyncio.run(run())
+    except RosterError as exc:
+        print(f"❌ {exc}")
+        sys.exit(1)
+    for row in report["rows"]:
+        if row["status"] in ("invalid", "duplicate"):
+            print(f"⚠️  ligne {row['row']} ({row['email'] or '?'}) : {row['error']}")
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    verb = "valides (dry-run)" if dry_run else "créés"
+    valid = sum(r["status"] in ("created", "valid") for r in report["rows"])
+    print(f"✅ {valid} comptes {verb}, {report['rejected']} rejetés en {report['seconds']} s")
+    if not report_path and any(r.get("password") for r in report["rows"]):
+        print("ℹ️  Mots de passe générés : relancer avec --report pour les conserver")
+
+
+def create_admin():
     email    = input("Email admin : ").strip()
     username = input("Username   : ").strip()
     password = input("Mot de passe (min 8 car.) : ").strip()
@@ -23,7 +61,7 @@ def main():
         print("❌ Mot de passe trop court.")
         sys.exit(1)
 
-    db = SessionLocal()
+    db = SessionLocal(bind=get_engine())
     try:
         if db.query(User).filter(User.email == email).first():
             print("❌ Email déjà utilisé.")
@@ -45,5 +83,17 @@ def main():
         db.close()
 
 
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--roster", help="liste de classe à importer (.csv ou .json)")
+    parser.add_argument("--dry-run", action="store_true", help="valide sans rien créer")
+    parser.add_argument("--report", help="rapport JSON ligne par ligne (mots de passe générés compris)")
+    args = parser.parse_args()
+    if args.roster:
+        import_roster_file(args.roster, args.dry_run, args.report)
+    else:
+        create_admin()
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,121 @@
+"""
+Fixtures communes : base SQLite temporaire migrée par Alembic et faux Gemini
+(bench.fake_gemini) en sous-process : aucun token réel dépensé.
+
+Les réglages de l'app sont lus à l'import : l'environnement de test est posé
+ici, avant tout import de `app`.
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+_TMP_DIR = Path(tempfile.mkdtemp(prefix="lexora-tests-"))
+FAKE_GEMINI_PORT = free_port()
+DATABASE_URL = f"sqlite:///{_TMP_DIR / 'test.sqlite'}"
+
+TEST_ENV = {
+    "DATABASE_URL": DATABASE_URL,
+    "GEMINI_API_KEY": "test",
+    "SECRET_KEY": "test-secret-key",
+    "GEMINI_BASE_URL": f"http://127.0.0.1:{FAKE_GEMINI_PORT}/v1beta",
+    "GEMINI_MAX_RETRIES": "0",          # une erreur upstream = un échec, sans attente
+    "GEMINI_BREAKER_FAILURE_THRESHOLD": "1000",   # disjoncteur jamais ouvert d'un test à l'autre
+    "HEDGE_ENABLED": "false",           # nombre d'appels upstream exact
+    "POOL_ENABLED": "false",
+    "USAGE_LOG_MODE": "sync",           # UsageLog écrit avant la fin de la requête
+    "RATE_LIMIT_ENABLED": "false",
+}
+os.environ.update(TEST_ENV)
+
+
+def run(coro):
+    """Exécute `coro` dans une boucle neuve ; moteur et client HTTP sont fermés après."""
+    from app.claude_service import close_http_client, start_http_client
+    from app.database import dispose_engines, get_async_engine
+
+    async def scoped():
+        get_async_engine()
+        await start_http_client()
+        try:
+            return await coro
+        finally:
+            await close_http_client()
+            await dispose_engines()
+
+    return asyncio.run(scoped())
+
+
+def asgi_client(client_ip: str = "127.0.0.1") -> httpx.AsyncClient:
+    """Client HTTP branché sur l'app en ASGI (middlewares compris, sans lifespan) ; à utiliser dans run()."""
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app, client=(client_ip, 50000))
+    return httpx.AsyncClient(transport=transport, base_url="http://testserver")
+
+
+@pytest.fixture(scope="session")
+def database():
+    """Schéma Alembic complet sur la base temporaire."""
+    from bench.seed import _migrate
+
+    _migrate(DATABASE_URL)
+    return DATABASE_URL
+
+
+def configure_fake(url: str, **config) -> None:
+    """Change à chaud les réglages du faux Gemini (error_rate, latency_ms…)."""
+    httpx.post(f"{url}/config", json=config).raise_for_status()
+
+
+def upstream_calls(url: str) -> int:
+    return httpx.get(f"{url}/stats").json()["calls"]
+
+
+@pytest.fixture(scope="session")
+def fake_gemini():
+    """Faux Gemini : 150 ms par appel, sans erreur (tirages reproductibles)."""
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "bench.fake_gemini", "--port", str(FAKE_GEMINI_PORT),
+            "--latency-ms", "150", "--latency-sigma", "0", "--seed", "7",
+        ],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{FAKE_GEMINI_PORT}"
+    deadline = time.monotonic() + 30
+    try:
+        while True:
+            if process.poll() is not None:
+                pytest.fail("le faux Gemini s'est arrêté au démarrage")
+            try:
+                if httpx.get(f"{url}/stats").status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                pytest.fail("le faux Gemini ne répond pas")
+            time.sleep(0.1)
+        yield url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
@@ -0,0 +1,75 @@
+"""
+Archivage des logs d'usage sur SQLite (archive_logs.py) : rollups complétés,
+export NDJSON compressé, puis DELETE par lots ; les mois récents restent.
+"""
+import gzip
+import json
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import func, insert, select
+
+from conftest import run
+from test_quota_reservation import _create_user
+
+RETENTION = 12
+
+
+def test_archive_old_months(database, tmp_path, monkeypatch):
+    import archive_logs
+    from app.database import AsyncSessionLocal
+    from app.models import UsageDailyRollup, UsageLog
+    from app.partitions import add_months, month_start
+
+    monkeypatch.setattr(archive_logs, "_BATCH", 7)   # plusieurs lots de DELETE
+    old_month = add_months(month_start(date.today()), -(RETENTION + 2))
+    old_days = [old_month + timedelta(days=d) for d in range(20)]
+
+    async def scenario():
+        user_id = await _create_user("archive", 10)
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(UsageLog), [
+                {
+                    "user_id": user_id, "action": "fill_generate", "tokens_used": 10,
+                    "log_date": day, "created_at": datetime.combine(day, time(12)), "extra": "{}",
+                }
+                for day in old_days
+            ] + [{
+                "user_id": user_id, "action": "fill_generate", "tokens_used": 10,
+                "log_date": date.today(), "created_at": datetime.utcnow(), "extra": "{}",
+            }])
+            await db.commit()
+
+        await archive_logs.archive(RETENTION, tmp_path, "ndjson", dry_run=False)
+
+        async with AsyncSessionLocal() as db:
+            remaining = await db.scalar(
+                select(func.count()).select_from(UsageLog).where(UsageLog.user_id == user_id)
+            )
+            rollups = await db.scalar(
+                select(func.sum(UsageDailyRollup.calls)).where(
+                    UsageDailyRollup.day >= old_month,
+                    UsageDailyRollup.day < add_months(old_month, 1),
+                    UsageDailyRollup.action == "fill_generate",
+                )
+            )
+        return remaining, rollups
+
+    remaining, rollups = run(scenario())
+    assert remaining == 1            # seul le log du jour reste en base
+    assert rollups == len(old_days)  # le dashboard garde les mois archivés
+
+    archive = tmp_path / f"usage_logs_{old_month:%Y_%m}.ndjson.gz"
+    with gzip.open(archive, "rt", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert len(rows) == len(old_days)
+    assert {r["log_date"] for r in rows} == {d.isoformat() for d in old_days}
+
+
+def test_partitions_are_postgres_only(database):
+    from app.partitions import create_partition_sql, ensure_partitions, partition_month, partition_name
+
+    month = date(2026, 12, 1)
+    assert partition_month(partition_name(month)) == month
+    assert partition_month("usage_logs_default") is None
+    assert "FROM ('2026-12-01') TO ('2027-01-01')" in create_partition_sql(month)
+    assert run(ensure_partitions(2)) == []
@@ -0,0 +1,91 @@
+"""
+Génération groupée (POST /api/generate/batch) contre le faux Gemini : paquets,
+réponses groupées tronquées rejouées un par un, tokens de chaque appel
+upstream facturés, créneaux des exercices en échec rendus.
+"""
+from sqlalchemy import func, select
+
+from conftest import configure_fake, run, upstream_calls
+from test_quota_reservation import _auth_user, _create_user
+from test_reservation_release import _counter
+
+OUTPUT_TOKENS = 600   # sortie de chaque appel du faux Gemini (--output-tokens par défaut)
+
+
+def _items(prefix: str, n: int) -> list:
+    from app.schemas import BatchItem
+
+    return [BatchItem(type="writing", theme=f"{prefix} {i}", level="B1") for i in range(n)]
+
+
+def _batch(name: str, items: list):
+    """(réponse, compteur avant, compteur après, tokens des UsageLog, appels upstream vus)."""
+    from app.batch import generate_batch
+    from app.database import AsyncSessionLocal
+    from app.models import UsageLog
+
+    async def scenario():
+        user_id = await _create_user(name, 20)
+        before = await _counter(user_id)
+        async with AsyncSessionLocal() as db:
+            response = await generate_batch(db, _auth_user(user_id, 20), items)
+        async with AsyncSessionLocal() as db:
+            logged = await db.scalar(
+                select(func.coalesce(func.sum(UsageLog.tokens_used), 0)).where(UsageLog.user_id == user_id)
+            )
+        return response, before, await _counter(user_id), logged
+
+    return run(scenario())
+
+
+def test_batch_packs_items_in_one_call(database, fake_gemini):
+    calls = upstream_calls(fake_gemini)
+    response, before, after, logged = _batch("batchpacked", _items("packed", 3))
+
+    assert all(item["ok"] for item in response["items"])
+    assert response["upstream_calls"] == 1
+    assert upstream_calls(fake_gemini) - calls == 1
+    assert after[0] - before[0] == 3
+    assert after[1] - before[1] == logged >= OUTPUT_TOKENS
+
+
+def test_truncated_packed_response_is_replayed_and_billed(database, fake_gemini):
+    """Tableau coupé avant son premier élément complet : rien de servi, tout est rejoué."""
+    configure_fake(fake_gemini, packed_keep=0.05)
+    try:
+        response, before, after, logged = _batch("batchtruncated", _items("truncated", 3))
+    finally:
+        configure_fake(fake_gemini, packed_keep=1.0)
+
+    assert all(item["ok"] for item in response["items"])
+    assert response["upstream_calls"] == 4   # appel groupé + 3 rejeux
+    # Chaque appel upstream est facturé, appel groupé rejeté compris
+    assert after[1] - before[1] == logged >= 4 * OUTPUT_TOKENS
+
+
+def test_partially_truncated_packed_response(database, fake_gemini):
+    """Éléments complets gardés, le reste rejoué un par un."""
+    configure_fake(fake_gemini, packed_keep=0.6)
+    try:
+        response, before, after, logged = _batch("batchpartial", _items("partial", 4))
+    finally:
+        configure_fake(fake_gemini, packed_keep=1.0)
+
+    replays = response["upstream_calls"] - 1
+    assert all(item["ok"] for item in response["items"])
+    assert 1 <= replays < 4
+    assert after[0] - before[0] == 4
+    assert after[1] - before[1] == logged >= (1 + replays) * OUTPUT_TOKENS
+
+
+def test_failed_items_release_their_reservations(database, fake_gemini):
+    configure_fake(fake_gemini, error_rate=1.0)
+    try:
+        response, before, after, logged = _batch("batchfailed", _items("failed", 3))
+    finally:
+        configure_fake(fake_gemini, error_rate=0.0)
+
+    assert not any(item["ok"] for item in response["items"])
+    assert {item["status"] for item in response["items"]} == {502}
+    assert after == before
+    assert logged == 0
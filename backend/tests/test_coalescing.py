@@ -0,0 +1,80 @@
+"""
+Coalescence (single-flight) : seuls les appels identiques encore en vol
+partagent une requête upstream ; un appel lancé après la fin du précédent,
+un remplissage de pool ou `coalesce=False` repartent upstream.
+"""
+import asyncio
+
+from sqlalchemy import select
+
+from conftest import run, upstream_calls
+
+ACTION = "flashcards_generate"
+
+
+async def _gather(n: int, call):
+    return await asyncio.gather(*(call() for _ in range(n)))
+
+
+def _prompt(theme: str):
+    from app.prompts import build_exercise
+
+    return build_exercise(ACTION, theme, "B1")
+
+
+def test_concurrent_identical_calls_share_one_upstream_call(fake_gemini):
+    from app.claude_service import call_claude
+
+    system, user, max_tokens = _prompt("coalescing concurrent")
+    before = upstream_calls(fake_gemini)
+    results = run(_gather(5, lambda: call_claude(system, user, max_tokens, action=ACTION)))
+    assert upstream_calls(fake_gemini) - before == 1
+    assert len({text for text, _, _ in results}) == 1
+    assert sorted(tokens > 0 for _, tokens, _ in results) == [False] * 4 + [True]
+
+
+def test_finished_calls_are_not_reused(fake_gemini):
+    from app.claude_service import call_claude
+
+    system, user, max_tokens = _prompt("coalescing sequential")
+
+    async def sequential():
+        return [await call_claude(system, user, max_tokens, action=ACTION) for _ in range(3)]
+
+    before = upstream_calls(fake_gemini)
+    results = run(sequential())
+    assert upstream_calls(fake_gemini) - before == 3
+    assert all(tokens > 0 for _, tokens, _ in results)
+
+
+def test_coalesce_false_always_calls_upstream(fake_gemini):
+    from app.claude_service import call_claude
+
+    system, user, max_tokens = _prompt("coalescing disabled")
+    before = upstream_calls(fake_gemini)
+    results = run(_gather(3, lambda: call_claude(system, user, max_tokens, action=ACTION, coalesce=False)))
+    assert upstream_calls(fake_gemini) - before == 3
+    assert all(tokens > 0 for _, tokens, _ in results)
+
+
+def test_pool_refill_generates_distinct_exercises(database, fake_gemini):
+    from app.config import get_settings
+    from app.database import AsyncSessionLocal
+    from app.models import PooledExercise
+    from app.pool import refill
+
+    bucket = (ACTION, "coalescing pool", "B1")
+
+    async def scenario():
+        added = await refill(bucket)
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(PooledExercise.payload, PooledExercise.tokens_used)
+                .where(PooledExercise.theme == bucket[1])
+            )).all()
+        return added, rows
+
+    added, rows = run(scenario())
+    assert added == get_settings().pool_high_water
+    assert len({payload for payload, _ in rows}) == added
+    assert all(tokens > 0 for _, tokens in rows)
@@ -0,0 +1,128 @@
+"""
+Export des logs d'usage (GET /api/admin/export/usage) : nombre de lignes en
+NDJSON et CSV, compressés ou non, lus en plusieurs paquets du curseur ;
+filtres action et user_id ; place d'export rendue après le flux.
+"""
+import csv
+import gzip
+import io
+import json
+from datetime import date
+
+import pytest
+from sqlalchemy import insert
+
+from conftest import asgi_client, run
+from test_quota_reservation import _create_user
+
+ROWS = 25
+BATCH_SIZE = 7   # plusieurs paquets du curseur par export
+
+
+async def _admin_headers(name: str) -> dict:
+    from app.auth import create_access_token
+    from app.database import AsyncSessionLocal
+    from app.models import User, UserRole
+
+    async with AsyncSessionLocal() as db:
+        user_id = await db.scalar(
+            insert(User).returning(User.id),
+            [{
+                "email": f"{name}@test.example.com", "username": name, "hashed_password": "x",
+                "role": UserRole.admin, "is_active": True, "daily_quota": 5, "token_version": 0,
+            }],
+        )
+        await db.commit()
+    return {"authorization": f"Bearer {create_access_token({'sub': str(user_id), 'ver': 0})}"}
+
+
+async def _write_logs(user_id: int, action: str, n: int, day: date | None = None) -> None:
+    from app.database import AsyncSessionLocal
+    from app.usage_writer import usage_row, write_usage_rows
+
+    async with AsyncSessionLocal() as db:
+        await write_usage_rows(
+            db, [usage_row(user_id, action, 100 + i, day or date.today(), None) for i in range(n)]
+        )
+        await db.commit()
+
+
+def _parse(body: bytes, fmt: str) -> list[dict]:
+    text = body.decode()
+    if fmt == "ndjson":
+        return [json.loads(line) for line in text.splitlines()]
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+@pytest.fixture(scope="module")
+def exported(database):
+    """(en-têtes admin, id de l'utilisateur exporté, id d'un autre utilisateur)."""
+    async def scenario():
+        headers = await _admin_headers("exportadmin")
+        user_id = await _create_user("exported", 5)
+        other = await _create_user("exportedother", 5)
+        await _write_logs(user_id, "export_test", ROWS)
+        await _write_logs(other, "export_test", 3)
+        return headers, user_id, other
+
+    return run(scenario())
+
+
+@pytest.mark.parametrize("compress", [False, True], ids=["plain", "gzip"])
+@pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+def test_export_row_counts(exported, monkeypatch, fmt, compress):
+    from app.config import get_settings
+    from app.export import COLUMNS, usage_exporter
+
+    monkeypatch.setattr(get_settings(), "export_batch_size", BATCH_SIZE)
+    headers, user_id, _ = exported
+
+    async def scenario():
+        async with asgi_client() as client:
+            return await client.get(
+                "/api/admin/export/usage",
+                params={"format": fmt, "gzip": str(compress).lower(), "action": "export_test", "user_id": user_id},
+                headers=headers,
+            )
+
+    response = run(scenario())
+    assert response.status_code == 200
+    body = response.content
+    if compress:
+        assert response.headers["content-type"] == "application/gzip"
+        assert response.headers["content-disposition"].endswith(f'.{fmt}.gz"')
+        body = gzip.decompress(body)
+    rows = _parse(body, fmt)
+
+    assert len(rows) == ROWS
+    assert list(rows[0]) == list(COLUMNS)
+    assert {row["email"] for row in rows} == {"exported@test.example.com"}
+    assert [int(row["id"]) for row in rows] == sorted(int(row["id"]) for row in rows)
+    assert usage_exporter.active == 0
+
+
+def test_export_filters_by_action_only(exported):
+    headers, user_id, other = exported
+
+    async def scenario():
+        async with asgi_client() as client:
+            return await client.get(
+                "/api/admin/export/usage", params={"action": "export_test"}, headers=headers
+            )
+
+    rows = _parse(run(scenario()).content, "ndjson")
+    assert len(rows) == ROWS + 3
+    assert {row["user_id"] for row in rows} == {user_id, other}
+
+
+def test_export_requires_admin(exported):
+    from app.auth import create_access_token
+
+    _, user_id, _ = exported
+    token = create_access_token({"sub": str(user_id), "ver": 0})
+
+    async def scenario():
+        async with asgi_client() as client:
+            return await client.get("/api/admin/export/usage", headers={"authorization": f"Bearer {token}"})
+
+    assert run(scenario()).status_code == 403
@@ -0,0 +1,44 @@
+"""
+Compteurs globaux répartis en shards : chaque utilisateur écrit sa ligne,
+le total et le budget global portent sur la somme des shards.
+"""
+from fastapi import HTTPException
+
+from conftest import run
+from test_quota_reservation import _auth_user, _create_user
+
+
+def test_global_counters_are_sharded_and_budgeted(database, monkeypatch):
+    from app.config import get_settings
+    from app.database import AsyncSessionLocal
+    from app.models import GlobalUsageCounter
+    from app.quota import global_tokens, reserve_quota_batch
+    from sqlalchemy import func, select
+
+    settings = get_settings()
+
+    async def scenario():
+        users = [_auth_user(await _create_user(f"shard{i}", 10), 10) for i in range(3)]
+        async with AsyncSessionLocal() as db:
+            before = (await global_tokens(db))["day"]
+            for user in users:
+                await reserve_quota_batch(db, user, [100])
+            after = await global_tokens(db)
+            shards = await db.scalar(
+                select(func.count()).select_from(GlobalUsageCounter)
+                .where(GlobalUsageCounter.granularity == "day")
+            )
+            # Budget global atteint : la réservation suivante est refusée
+            monkeypatch.setattr(settings, "global_daily_token_budget", after["day"] + 50)
+            try:
+                await reserve_quota_batch(db, users[0], [100])
+                rejected = None
+            except HTTPException as exc:
+                rejected = exc.status_code
+        return before, after, shards, rejected
+
+    before, after, shards, rejected = run(scenario())
+    assert after["day"] - before == 300
+    assert after["month"] >= 300
+    assert shards >= 3
+    assert rejected == 429
@@ -0,0 +1,89 @@
+"""
+Métriques Prometheus : GET /api/metrics protégé par METRICS_TOKEN, latence
+des requêtes étiquetée par le template de route (MetricsMiddleware).
+"""
+import pytest
+
+from conftest import asgi_client, run
+
+
+@pytest.fixture
+def metrics_token(monkeypatch):
+    import app.main
+
+    monkeypatch.setattr(app.main.settings, "metrics_token", "metrics-secret")
+    return "metrics-secret"
+
+
+def test_metrics_token_required(database, metrics_token):
+    async def scenario():
+        async with asgi_client() as client:
+            missing = await client.get("/api/metrics")
+            wrong = await client.get("/api/metrics", headers={"authorization": "Bearer nope"})
+            ok = await client.get("/api/metrics", headers={"authorization": f"Bearer {metrics_token}"})
+        return missing, wrong, ok
+
+    missing, wrong, ok = run(scenario())
+    assert missing.status_code == wrong.status_code == 401
+    assert ok.status_code == 200
+    assert ok.headers["content-type"].startswith("text/plain")
+    assert "# TYPE lexora_http_request_duration_seconds histogram" in ok.text
+
+
+def test_request_latency_labelled_by_route_template(database):
+    from app import metrics
+
+    def count(route: str, status: str) -> int:
+        series = metrics.REQUEST_LATENCY._series.get(("GET", route, status))
+        return sum(series[:-1]) if series else 0
+
+    before = count("/api/admin/users/{user_id}/logs", "401"), count("unmatched", "404")
+
+    async def scenario():
+        async with asgi_client() as client:
+            await client.get("/api/admin/users/1/logs")
+            await client.get("/api/admin/users/2/logs")
+            await client.get("/no/such/route")
+            return (await client.get("/api/metrics")).text
+
+    text = run(scenario())
+    # Identifiants absents des étiquettes : une seule série pour les deux utilisateurs
+    assert count("/api/admin/users/{user_id}/logs", "401") - before[0] == 2
+    assert count("unmatched", "404") - before[1] == 1
+    assert 'route="/api/admin/users/{user_id}/logs",status="401"' in text
+    assert 'route="/api/admin/users/1/logs"' not in text
+
+
+def test_pool_depth_gauge_per_bucket(database):
+    from sqlalchemy import delete
+
+    from app import metrics
+    from app.database import AsyncSessionLocal
+    from app.models import PooledExercise
+    from app.pool import depths, take
+
+    def exercise(theme: str) -> PooledExercise:
+        return PooledExercise(action="flashcards_generate", theme=theme, level="B1", payload="[]", tokens_used=10)
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            db.add_all([exercise("gauge a"), exercise("gauge a"), exercise("gauge b")])
+            await db.commit()
+        await depths()
+        filled = metrics.render()
+        await take("flashcards_generate", "gauge b", "B1")
+        await depths()
+        drained = metrics.render()
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(PooledExercise).where(PooledExercise.theme.like("gauge %")))
+            await db.commit()
+        return filled, drained
+
+    filled, drained = run(scenario())
+    series = 'lexora_pool_depth{action="flashcards_generate",theme="gauge %s",level="B1"}'
+    assert "# TYPE lexora_pool_depth gauge" in filled
+    assert f"{series % 'a'} 2" in filled
+    assert f"{series % 'b'} 1" in filled
+    # Bucket vidé : la série disparaît
+    assert f"{series % 'a'} 2" in drained
+    assert series % "b" not in drained
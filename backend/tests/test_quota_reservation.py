@@ -0,0 +1,120 @@
+"""
+Réservation atomique du quota sous charge : 100 requêtes parallèles d'un même
+utilisateur ne dépassent jamais daily_quota, et les générations en échec
+rendent leur créneau.
+"""
+import asyncio
+from datetime import date
+
+from fastapi import HTTPException
+from sqlalchemy import func, insert, select
+
+from conftest import configure_fake, run
+
+PARALLEL = 100
+QUOTA = 20
+
+
+async def _create_user(name: str, quota: int) -> int:
+    from app.database import AsyncSessionLocal
+    from app.models import User, UserRole
+
+    async with AsyncSessionLocal() as db:
+        user_id = await db.scalar(
+            insert(User).returning(User.id),
+            [{
+                "email": f"{name}@test.example.com", "username": name, "hashed_password": "x",
+                "role": UserRole.user, "is_active": True, "daily_quota": quota, "token_version": 0,
+            }],
+        )
+        await db.commit()
+    return user_id
+
+
+def _auth_user(user_id: int, quota: int):
+    from app.schemas import AuthUser
+
+    return AuthUser(id=user_id, role="user", is_active=True, daily_quota=quota)
+
+
+async def _used_today(user_id: int) -> int:
+    from app.database import AsyncSessionLocal
+    from app.quota import get_usage_today
+
+    async with AsyncSessionLocal() as db:
+        return await get_usage_today(db, user_id)
+
+
+def test_parallel_reservations_never_exceed_quota(database):
+    from app.database import AsyncSessionLocal
+    from app.quota import reserve_quota_batch
+
+    async def scenario():
+        user_id = await _create_user("reserve", QUOTA)
+        user = _auth_user(user_id, QUOTA)
+
+        async def attempt():
+            async with AsyncSessionLocal() as db:
+                try:
+                    return await reserve_quota_batch(db, user, [100])
+                except HTTPException as exc:
+                    assert exc.status_code == 429
+                    return None
+
+        results = await asyncio.gather(*(attempt() for _ in range(PARALLEL)))
+        reserved = [r[0] for r in results if r is not None]
+        used = await _used_today(user_id)
+
+        # Les créneaux rendus redeviennent disponibles
+        async with AsyncSessionLocal() as db:
+            for reservation in reserved[:5]:
+                await reservation.release(db)
+        return len(reserved), used, await _used_today(user_id)
+
+    reserved, used, after_release = run(scenario())
+    assert reserved == QUOTA
+    assert used == QUOTA
+    assert after_release == QUOTA - 5
+
+
+def test_parallel_generations_against_stub_upstream(database, fake_gemini):
+    from app.database import AsyncSessionLocal
+    from app.models import UsageLog
+    from app.routers.generate import _exercise
+
+    async def scenario():
+        user_id = await _create_user("generate", QUOTA)
+        user = _auth_user(user_id, QUOTA)
+
+        async def attempt(i: int) -> int:
+            async with AsyncSessionLocal() as db:
+                try:
+                    # Thèmes distincts : ni cache ni coalescence entre les requêtes
+                    await _exercise(db, user, "flashcards_generate", f"theme {i}", "B1")
+                    return 200
+                except HTTPException as exc:
+                    return exc.status_code
+
+        statuses = await asyncio.gather(*(attempt(i) for i in range(PARALLEL)))
+        async with AsyncSessionLocal() as db:
+            logs = await db.scalar(
+                select(func.count(UsageLog.id)).where(
+                    UsageLog.user_id == user_id, UsageLog.log_date == date.today()
+                )
+            )
+        return statuses, logs, await _used_today(user_id)
+
+    configure_fake(fake_gemini, error_rate=0.3)
+    try:
+        statuses, logs, used = run(scenario())
+    finally:
+        configure_fake(fake_gemini, error_rate=0.0)
+    successes = statuses.count(200)
+    failures = [s for s in statuses if s not in (200, 429)]
+
+    # Un créneau rendu par un échec peut resservir à une requête encore en attente
+    assert successes <= QUOTA
+    assert failures, "le faux Gemini (30 % d'erreurs) devrait faire échouer des appels"
+    # Créneaux des appels en échec rendus : le compteur = générations réussies
+    assert used == successes
+    assert logs == successes
@@ -0,0 +1,105 @@
+"""
+Limitation de débit (RateLimitMiddleware) : clé email lue dans le corps du
+login puis rejouée au handler, sur les deux backends ; adresse client derrière
+N proxys (X-Forwarded-For).
+"""
+import pytest
+from sqlalchemy import insert
+
+from conftest import asgi_client, run
+
+PASSWORD = "secret-password"
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """Remplace le limiteur global ; `configure(règles, backend, proxy_hops)`."""
+    from app import ratelimit
+
+    def configure(rules: str, backend: str = "memory", proxy_hops: int = 1):
+        limiter = ratelimit.RateLimiter()
+        limiter.enabled = True
+        limiter.proxy_hops = proxy_hops
+        limiter.rules = ratelimit.parse_rules(rules)
+        limiter.backend = (
+            ratelimit.DBRateLimitBackend(60) if backend == "db"
+            else ratelimit.MemoryRateLimitBackend(100)
+        )
+        monkeypatch.setattr(ratelimit, "rate_limiter", limiter)
+        return limiter
+
+    return configure
+
+
+async def _create_login_user(name: str) -> str:
+    from app.auth import hash_password
+    from app.database import AsyncSessionLocal
+    from app.models import User, UserRole
+
+    email = f"{name}@test.example.com"
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [{
+            "email": email, "username": name, "hashed_password": hash_password(PASSWORD),
+            "role": UserRole.user, "is_active": True, "daily_quota": 5, "token_version": 0,
+        }])
+        await db.commit()
+    return email
+
+
+@pytest.mark.parametrize("backend", ["memory", "db"])
+def test_login_limited_per_email_and_body_replayed(database, limiter, backend):
+    limiter("login:email:2/60", backend)
+
+    async def scenario():
+        email = await _create_login_user(f"ratelimit{backend}")
+        other = await _create_login_user(f"ratelimitother{backend}")
+        async with asgi_client() as client:
+            async def login(address: str, password: str = PASSWORD):
+                return await client.post("/api/auth/login", json={"email": address, "password": password})
+
+            # Corps rejoué : le handler lit l'email et le mot de passe (200, pas 422)
+            ok = await login(email)
+            wrong = await login(email, "wrong-password")
+            blocked = await login(email)
+            # Casse et espaces ignorés : même clé
+            blocked_variant = await login(f"  {email.upper()} ")
+            other_email = await login(other)
+        return ok, wrong, blocked, blocked_variant, other_email
+
+    ok, wrong, blocked, blocked_variant, other_email = run(scenario())
+    assert ok.status_code == 200 and ok.json()["access_token"]
+    assert ok.headers["ratelimit-limit"] == "2"
+    assert wrong.status_code == 401
+    assert blocked.status_code == 429
+    assert int(blocked.headers["retry-after"]) >= 1
+    assert blocked_variant.status_code == 429
+    assert other_email.status_code == 200
+
+
+@pytest.mark.parametrize(("proxy_hops", "second_status"), [(1, 401), (0, 429)])
+def test_client_ip_behind_proxies(database, limiter, proxy_hops, second_status):
+    """Derrière un proxy (hops=1), deux clients distincts par X-Forwarded-For ; hops=0 : même IP TCP."""
+    limiter("login:ip:1/60", proxy_hops=proxy_hops)
+
+    async def scenario():
+        async with asgi_client("10.0.0.1") as client:
+            statuses = []
+            for forwarded in ("203.0.113.1", "203.0.113.2"):
+                response = await client.post(
+                    "/api/auth/login",
+                    json={"email": "nobody@test.example.com", "password": "x"},
+                    # Entrée ajoutée par le client (falsifiable), puis par le proxy
+                    headers={"x-forwarded-for": f"198.51.100.7, {forwarded}"},
+                )
+                statuses.append(response.status_code)
+        return statuses
+
+    assert run(scenario()) == [401, second_status]
+
+
+def test_client_ip_takes_nth_entry_from_the_end(limiter):
+    scope = {"client": ("10.0.0.1", 1), "headers": [(b"x-forwarded-for", b"1.1.1.1, 2.2.2.2, 3.3.3.3")]}
+    assert limiter("login:ip:1/60", proxy_hops=0).client_ip(scope) == "10.0.0.1"
+    assert limiter("login:ip:1/60", proxy_hops=1).client_ip(scope) == "3.3.3.3"
+    assert limiter("login:ip:1/60", proxy_hops=2).client_ip(scope) == "2.2.2.2"
+    assert limiter("login:ip:1/60", proxy_hops=5).client_ip(scope) == "1.1.1.1"
@@ -0,0 +1,127 @@
+"""
+Requêtes interrompues : le créneau de quota et les tokens réservés sont
+rendus, que le client se déconnecte en plein flux SSE ou que la requête soit
+annulée.
+"""
+import asyncio
+import json
+
+import pytest
+
+from conftest import configure_fake, run
+from test_quota_reservation import _create_user
+
+
+async def _counter(user_id: int) -> tuple[int, int]:
+    """(générations, tokens) du jour de l'utilisateur."""
+    from datetime import date
+
+    from sqlalchemy import select
+
+    from app.database import AsyncSessionLocal
+    from app.models import DailyUsageCounter
+
+    async with AsyncSessionLocal() as db:
+        row = (
+            await db.execute(
+                select(DailyUsageCounter.count, DailyUsageCounter.tokens).where(
+                    DailyUsageCounter.user_id == user_id, DailyUsageCounter.day == date.today()
+                )
+            )
+        ).first()
+    return tuple(row) if row else (0, 0)
+
+
+def _scope(token: str, spec_version: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": spec_version},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/api/generate/flashcards",
+        "raw_path": b"/api/generate/flashcards",
+        "query_string": b"stream=true",
+        "root_path": "",
+        "headers": [
+            (b"host", b"testserver"),
+            (b"content-type", b"application/json"),
+            (b"authorization", f"Bearer {token}".encode()),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+
+
+@pytest.mark.parametrize("spec_version", ["2.0", "2.4"], ids=["disconnect-message", "send-error"])
+def test_stream_disconnect_releases_reservation(database, fake_gemini, spec_version):
+    """
+    2.0 : http.disconnect reçu pendant l'appel upstream, la tâche du flux est
+    annulée ; 2.4 : l'envoi du premier événement échoue, le générateur reste
+    suspendu au `yield` jusqu'à sa fermeture.
+    """
+    from app.auth import create_access_token
+    from app.main import app
+
+    async def scenario():
+        user_id = await _create_user(f"stream{spec_version.replace('.', '')}", 5)
+        token = create_access_token({"sub": str(user_id), "ver": 0})
+        before = await _counter(user_id)
+        started, disconnect = asyncio.Event(), asyncio.Event()
+        body = json.dumps({"theme": "disconnect", "level": "B1"}).encode()
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                started.set()
+            elif message["type"] == "http.response.body" and spec_version == "2.4":
+                raise OSError("client parti")
+
+        request = asyncio.create_task(app(_scope(token, spec_version), receive, send))
+        await asyncio.wait_for(started.wait(), 10)
+        during = await _counter(user_id)
+        disconnect.set()
+        try:
+            await asyncio.wait_for(request, 10)
+        except Exception:
+            pass   # ClientDisconnect propagé par la pile ASGI
+        return before, during, await _counter(user_id)
+
+    configure_fake(fake_gemini, latency_ms=500)
+    try:
+        before, during, after = run(scenario())
+    finally:
+        configure_fake(fake_gemini, latency_ms=150)
+    assert during[0] == before[0] + 1 and during[1] > before[1]
+    assert after == before
+
+
+def test_cancelled_generation_releases_reservation(database, fake_gemini):
+    """Route non streamée annulée (cancel scope anyio, comme Starlette) pendant l'appel upstream."""
+    import anyio
+
+    from app.database import AsyncSessionLocal
+    from app.routers.generate import _exercise
+    from test_quota_reservation import _auth_user
+
+    async def scenario():
+        user_id = await _create_user("cancelled", 5)
+        before = await _counter(user_id)
+        async with AsyncSessionLocal() as db:
+            with anyio.move_on_after(0.2) as scope:
+                await _exercise(db, _auth_user(user_id, 5), "flashcards_generate", "annulé", "B1")
+        return scope.cancelled_caught, before, await _counter(user_id)
+
+    configure_fake(fake_gemini, latency_ms=500)
+    try:
+        cancelled, before, after = run(scenario())
+    finally:
+        configure_fake(fake_gemini, latency_ms=150)
+    assert cancelled
+    assert after == before
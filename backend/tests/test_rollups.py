@@ -0,0 +1,124 @@
+"""
+Rollups journaliers (usage_daily_rollup) : mis à jour à l'écriture des logs,
+lus par GET /api/admin/stats/timeseries par jour, semaine et mois, et
+recalculés depuis usage_logs par la compaction.
+"""
+from datetime import date
+
+import pytest
+from sqlalchemy import select, update
+
+from conftest import asgi_client, run
+from test_export import _admin_headers, _write_logs
+from test_quota_reservation import _create_user
+
+MONDAY = date(2021, 3, 1)   # période isolée des logs des autres tests
+
+
+@pytest.fixture(scope="module")
+def admin_headers(database):
+    """En-têtes admin ; logs de mars 2021 écrits par deux utilisateurs."""
+    async def scenario():
+        alice = await _create_user("rollupalice", 5)
+        bob = await _create_user("rollupbob", 5)
+        await _write_logs(alice, "rollup_x", 2, MONDAY)            # tokens 100 + 101
+        await _write_logs(alice, "rollup_x", 1, date(2021, 3, 8))  # 100
+        await _write_logs(bob, "rollup_y", 1, date(2021, 3, 2))    # 100
+        return await _admin_headers("rollupadmin")
+
+    return run(scenario())
+
+
+def _timeseries(headers: dict, **params) -> dict:
+    async def scenario():
+        async with asgi_client() as client:
+            return await client.get("/api/admin/stats/timeseries", params=params, headers=headers)
+
+    response = run(scenario())
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_timeseries_by_granularity(admin_headers):
+    bounds = {"from": "2021-03-01", "to": "2021-03-14"}
+
+    days = _timeseries(admin_headers, **bounds, granularity="day")["series"]
+    assert len(days) == 14
+    assert days[0] == {
+        "period": "2021-03-01", "calls": 2, "tokens": 201, "user_days": 1, "by_action": {"rollup_x": 2},
+    }
+    assert days[1]["by_action"] == {"rollup_y": 1}
+    assert days[2]["calls"] == 0
+
+    weeks = _timeseries(admin_headers, **bounds, granularity="week")["series"]
+    assert [(w["period"], w["calls"], w["user_days"]) for w in weeks] == [
+        ("2021-03-01", 3, 2), ("2021-03-08", 1, 1),
+    ]
+
+    months = _timeseries(admin_headers, **bounds, granularity="month")["series"]
+    assert months == [{
+        "period": "2021-03-01", "calls": 4, "tokens": 401, "user_days": 3,
+        "by_action": {"rollup_x": 3, "rollup_y": 1},
+    }]
+
+
+def test_timeseries_rejects_invalid_period(admin_headers):
+    async def scenario():
+        async with asgi_client() as client:
+            reversed_ = await client.get(
+                "/api/admin/stats/timeseries", params={"from": "2021-03-02", "to": "2021-03-01"},
+                headers=admin_headers,
+            )
+            too_long = await client.get(
+                "/api/admin/stats/timeseries", params={"from": "2018-01-01", "to": "2021-03-01"},
+                headers=admin_headers,
+            )
+        return reversed_.status_code, too_long.status_code
+
+    assert run(scenario()) == (400, 400)
+
+
+def test_compaction_repairs_drifted_rollups(admin_headers):
+    from app.database import AsyncSessionLocal
+    from app.models import UsageDailyRollup
+    from app.rollups import compact_rollups
+
+    async def scenario():
+        user_id = await _create_user("rollupdrift", 5)
+        await _write_logs(user_id, "rollup_drift", 3)
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(UsageDailyRollup)
+                .where(UsageDailyRollup.day == date.today(), UsageDailyRollup.action == "rollup_drift")
+                .values(calls=99, tokens=0, distinct_users=7)
+            )
+            await db.commit()
+
+    run(scenario())
+    today = {"from": date.today().isoformat(), "to": date.today().isoformat()}
+    assert _timeseries(admin_headers, **today)["series"][0]["by_action"]["rollup_drift"] == 99
+
+    run(compact_rollups(1))
+    stats = _timeseries(admin_headers, **today)["series"][0]
+    assert stats["by_action"]["rollup_drift"] == 3
+
+    async def row():
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(
+                select(UsageDailyRollup.calls, UsageDailyRollup.tokens, UsageDailyRollup.distinct_users)
+                .where(UsageDailyRollup.day == date.today(), UsageDailyRollup.action == "rollup_drift")
+            )).one()
+
+    assert tuple(run(row())) == (3, 303, 1)
+
+
+def test_stats_reads_rollups(admin_headers):
+    async def scenario():
+        async with asgi_client() as client:
+            return await client.get("/api/admin/stats", headers=admin_headers)
+
+    response = run(scenario())
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["by_action"]["rollup_x"] == 3
+    assert stats["total_calls"] == sum(stats["by_action"].values())
@@ -0,0 +1,45 @@
+"""
+Import groupé d'une classe de 1 000 élèves en quelques secondes : mots de
+passe générés hachés à coût réduit, remontés au coût normal à la connexion.
+"""
+import time
+
+from sqlalchemy import select
+
+from conftest import run
+
+STUDENTS = 1000
+IMPORT_BUDGET = 10.0   # s
+
+
+def test_roster_with_generated_passwords_imports_within_budget(database):
+    from app.auth import needs_rehash
+    from app.database import AsyncSessionLocal
+    from app.models import User
+    from app.roster import import_roster
+    from app.routers.auth import login
+    from app.schemas import UserLogin
+
+    rows = [{"email": f"eleve{i}@roster.example.com", "username": f"eleve{i}"} for i in range(STUDENTS)]
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            started = time.perf_counter()
+            report = await import_roster(db, rows)
+            elapsed = time.perf_counter() - started
+
+        first = report["rows"][0]
+        async with AsyncSessionLocal() as db:
+            await login(UserLogin(email=first["email"], password=first["password"]), db)
+            hashes = dict((await db.execute(
+                select(User.email, User.hashed_password)
+                .where(User.email.in_([first["email"], report["rows"][1]["email"]]))
+            )).all())
+        return report, elapsed, first["email"], report["rows"][1]["email"], hashes
+
+    report, elapsed, logged_in, untouched, hashes = run(scenario())
+    assert report["created"] == STUDENTS
+    assert elapsed < IMPORT_BUDGET, f"{elapsed:.1f} s pour {STUDENTS} comptes"
+    # Connexion : hash remonté au coût normal ; les autres comptes gardent le coût réduit
+    assert not needs_rehash(hashes[logged_in])
+    assert needs_rehash(hashes[untouched])
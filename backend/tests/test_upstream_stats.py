@@ -0,0 +1,47 @@
+"""
+Compteurs de GET /api/admin/upstream : taux de hit du cache des réponses et
+du cache des utilisateurs authentifiés.
+"""
+from conftest import run
+from test_quota_reservation import _auth_user, _create_user
+
+
+def test_response_cache_hit_rate(database, fake_gemini):
+    from app.cache import response_cache
+    from app.database import AsyncSessionLocal
+    from app.routers.admin import upstream_stats
+    from app.routers.generate import _exercise
+
+    async def scenario():
+        user_id = await _create_user("cachestats", 50)
+        before = (await upstream_stats(None))["response_cache"]
+        async with AsyncSessionLocal() as db:
+            # Variété 3 : trois misses puis un hit sur la même clé
+            for _ in range(response_cache.variety["flashcards_generate"] + 1):
+                await _exercise(db, _auth_user(user_id, 50), "flashcards_generate", "statistiques", "B1")
+        return before, (await upstream_stats(None))["response_cache"]
+
+    before, after = run(scenario())
+    assert after["misses"] - before["misses"] == response_cache.variety["flashcards_generate"]
+    assert after["hits"] - before["hits"] == 1
+    assert 0 < after["hit_rate"] <= 1
+
+
+def test_auth_cache_hit_rate(database):
+    from app.auth import create_access_token, get_current_user
+    from app.database import AsyncSessionLocal
+    from app.routers.admin import upstream_stats
+
+    async def scenario():
+        user_id = await _create_user("authstats", 5)
+        token = create_access_token({"sub": str(user_id), "ver": 0})
+        before = (await upstream_stats(None))["auth_cache"]
+        async with AsyncSessionLocal() as db:
+            for _ in range(3):   # un SELECT users, puis deux hits
+                await get_current_user(token, db)
+        return before, (await upstream_stats(None))["auth_cache"]
+
+    before, after = run(scenario())
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 2
+    assert after["size"] >= 1 and 0 < after["hit_rate"] <= 1
@@ -0,0 +1,40 @@
+"""
+Métadonnées des UsageLog : `model` est le modèle qui a répondu, absent quand
+aucun appel upstream n'a servi la requête (cache, pool).
+"""
+import json
+
+from sqlalchemy import select
+
+from conftest import run
+from test_quota_reservation import _auth_user, _create_user
+
+ACTION = "flashcards_generate"
+
+
+def test_model_logged_only_when_upstream_served(database, fake_gemini):
+    from app.config import get_settings
+    from app.database import AsyncSessionLocal
+    from app.models import UsageLog
+    from app.routers.generate import _exercise
+
+    variety = get_settings().cache_variety_map[ACTION]
+
+    async def scenario():
+        user_id = await _create_user("meta", 50)
+        user = _auth_user(user_id, 50)
+        # Les `variety` premières réponses remplissent le cache, la suivante y est lue
+        for _ in range(variety + 1):
+            async with AsyncSessionLocal() as db:
+                await _exercise(db, user, ACTION, "usage meta", "B1")
+        async with AsyncSessionLocal() as db:
+            extras = await db.scalars(
+                select(UsageLog.extra).where(UsageLog.user_id == user_id).order_by(UsageLog.id)
+            )
+            return [json.loads(extra) for extra in extras]
+
+    metas = run(scenario())
+    assert [m["cache"] for m in metas] == ["miss"] * variety + ["hit"]
+    # Le faux Gemini renvoie modelVersion = modèle appelé
+    assert all(m["model"] == get_settings().gemini_default_model for m in metas[:variety])
+    assert "model" not in metas[-1]